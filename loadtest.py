@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Офлайн-стенд для нагрузочных прогонов telegrambot.main():
+#   - локальный сервер синтетических RSS-лент (задержки и ошибки),
+#   - фейковый Groq (OpenAI-совместимый /chat/completions),
+#   - фейковый Telegram Bot API, записывающий вызовы sendMessage.
+#
+#   python loadtest.py --feeds 300 --entries 20 --runs 3 --log-level WARNING
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import string
+import asyncio
+import argparse
+import tempfile
+import threading
+import logging
+from datetime import datetime, timezone, timedelta
+from email.utils import format_datetime
+from typing import List, Dict, Optional
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+# ====================== СИНТЕТИЧЕСКИЕ ДАННЫЕ ======================
+AI_SUBJECTS = [
+    "OpenAI", "Anthropic", "DeepMind", "Mistral", "Meta", "NVIDIA", "DeepSeek",
+    "Google Gemini", "Claude", "Llama", "Stable Diffusion", "Midjourney",
+]
+AI_ACTIONS = [
+    "releases", "unveils", "open-sources", "benchmarks", "previews", "ships",
+    "trains", "publishes", "demonstrates", "expands",
+]
+AI_OBJECTS = [
+    "large language model", "reasoning model", "neural network compiler",
+    "diffusion model", "machine learning toolkit", "multimodal assistant",
+    "inference engine", "foundation model", "computer vision pipeline",
+]
+BLOCK_TITLES = [
+    "Роскомнадзор расширил реестр блокировок для сервисов {n}",
+    "Замедление трафика затронуло протокол {n} у провайдеров",
+    "Пользователи сообщили о блокировке VPN-протокола {n}",
+]
+NOISE_TITLES = [
+    "Best laptop deals of the week number {n} for students",
+    "Quarterly earnings call recap for company {n} investors",
+    "Fortnite season {n} patch notes and esports schedule",
+    "Weather station network upgrade scheduled for district {n}",
+]
+WORDS = (
+    "alpha beta gamma delta sigma orbit vector kernel lattice quantum "
+    "harbor prism falcon cobalt ember willow summit canyon matrix vertex"
+).split()
+
+# Словарь для текстов анонсов: достаточно большой, чтобы разные статьи не совпадали по содержанию
+_summary_rnd = random.Random(0)
+SUMMARY_WORDS = [
+    "".join(_summary_rnd.choice(string.ascii_lowercase) for _ in range(4 + i % 6))
+    for i in range(5000)
+]
+
+DEFAULT_POST_TEXT = (
+    "Исследовательская лаборатория представила открытую языковую модель "
+    "для анализа технической документации.\n\nРазработчики обучили систему на корпусе из двух "
+    "миллионов инженерных отчётов, спецификаций и руководств пользователя. По данным авторов, "
+    "модель отвечает на вопросы по схемам оборудования точнее предыдущих версий и реже путает "
+    "номера деталей.\n\nВеса опубликованы под свободной лицензией, а для запуска достаточно одной "
+    "видеокарты с двадцатью четырьмя гигабайтами памяти. Команда также выложила набор тестов, "
+    "чтобы сторонние инженеры смогли проверить результаты на собственных данных. Первые отзывы "
+    "производителей станков отмечают заметную экономию времени при подготовке сервисной "
+    "документации. Проект интересен промышленным компаниям, которым нужны локальные инструменты "
+    "без передачи чертежей внешним сервисам."
+)
+
+
+def synth_title(rnd: random.Random, relevant_ratio: float, n: int) -> str:
+    roll = rnd.random()
+    tail = " ".join(rnd.sample(WORDS, 3))
+    if roll < relevant_ratio * 0.8:
+        return (f"{rnd.choice(AI_SUBJECTS)} {rnd.choice(AI_ACTIONS)} "
+                f"{rnd.choice(AI_OBJECTS)} {tail} {n}")
+    if roll < relevant_ratio:
+        return rnd.choice(BLOCK_TITLES).format(n=f"{tail} {n}")
+    return rnd.choice(NOISE_TITLES).format(n=f"{tail} {n}")
+
+
+def build_feed(idx: int, entries: int, relevant_ratio: float, seed: int) -> bytes:
+    rnd = random.Random(seed * 100003 + idx)
+    now = datetime.now(timezone.utc)
+    items = []
+    for i in range(entries):
+        n = idx * 10000 + i
+        title = synth_title(rnd, relevant_ratio, n)
+        summary = (f"{title}. " + " ".join(rnd.choice(SUMMARY_WORDS) for _ in range(60)) + ".")
+        published = format_datetime(now - timedelta(minutes=rnd.randint(1, 60 * 48)))
+        items.append(
+            "<item>"
+            f"<title>{escape(title)}</title>"
+            f"<link>https://feed{idx}.loadtest.local/news/{n}?utm_source=rss</link>"
+            f"<description>{escape(summary)}</description>"
+            f"<pubDate>{published}</pubDate>"
+            "</item>"
+        )
+    body = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"><channel>'
+        f"<title>Synthetic feed {idx}</title>"
+        f"<link>https://feed{idx}.loadtest.local/</link>"
+        + "".join(items) +
+        "</channel></rss>"
+    )
+    return body.encode("utf-8")
+
+
+# ====================== ФЕЙКОВЫЕ СЕРВИСЫ ======================
+class FakeFeedServer:
+    def __init__(self, feeds: int, entries: int, relevant_ratio: float,
+                 latency_ms: float, jitter_ms: float, error_rate: float,
+                 hang_rate: float, seed: int, bad_feeds: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.rnd = random.Random(seed)
+        # Ленты, которые не отвечают никогда (для проверки circuit breaker)
+        self.bad_feeds = set(random.Random(seed + 3).sample(range(feeds), min(bad_feeds, feeds)))
+        self.bodies = [build_feed(i, entries, relevant_ratio, seed) for i in range(feeds)]
+        self.gzipped = [gzip.compress(body) for body in self.bodies]
+        self.stats = {"requests": 0, "errors": 0, "hangs": 0, "bytes": 0}
+
+    def routes(self) -> List[web.RouteDef]:
+        return [web.get("/feed/{idx}.xml", self.handle)]
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.stats["requests"] += 1
+        idx = int(request.match_info["idx"])
+        delay = max(0.0, self.latency_ms + self.rnd.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        roll = self.rnd.random()
+        if idx in self.bad_feeds or roll < self.hang_rate:
+            self.stats["hangs"] += 1
+            await asyncio.sleep(3600)
+        if roll < self.hang_rate + self.error_rate:
+            self.stats["errors"] += 1
+            return web.Response(status=self.rnd.choice([500, 502, 503, 404]))
+        if idx >= len(self.bodies):
+            return web.Response(status=404)
+        # Отдаём кусками, чтобы клиент мог оборвать чтение после нужных записей
+        compress = "gzip" in request.headers.get("Accept-Encoding", "")
+        body = self.gzipped[idx] if compress else self.bodies[idx]
+        resp = web.StreamResponse(headers={"Content-Type": "application/rss+xml; charset=utf-8"})
+        if compress:
+            resp.headers["Content-Encoding"] = "gzip"
+        await resp.prepare(request)
+        try:
+            for start in range(0, len(body), 8192):
+                await resp.write(body[start:start + 8192])
+                self.stats["bytes"] += len(body[start:start + 8192])
+                await asyncio.sleep(0)
+            await resp.write_eof()
+        except ConnectionResetError:
+            pass
+        return resp
+
+
+class FakeLLMBackend:
+    def __init__(self, text: str, latency_ms: float, error_rate: float,
+                 skip_rate: float, invalid_rate: float, seed: int, token_ms: float = 0.0):
+        self.text = text
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.skip_rate = skip_rate
+        self.invalid_rate = invalid_rate
+        self.rnd = random.Random(seed + 1)
+        self.stats = {"calls": 0, "errors": 0, "skips": 0, "invalid": 0,
+                      "streamed_tokens": 0, "aborted": 0}
+
+    def routes(self) -> List[web.RouteDef]:
+        return [web.post("/openai/v1/chat/completions", self.handle)]
+
+    def pick_text(self) -> str:
+        roll = self.rnd.random()
+        if roll < self.skip_rate:
+            self.stats["skips"] += 1
+            return "SKIP"
+        if roll < self.skip_rate + self.invalid_rate:
+            self.stats["invalid"] += 1
+            # Длинный ответ со строчной буквы: отбраковывается с первых символов потока
+            return "коротко и без точки, " + self.text
+        return self.text
+
+    async def stream(self, request: web.Request, payload: dict, text: str,
+                     usage: dict) -> web.StreamResponse:
+        # SSE как у OpenAI-совместимого API: куски по ~4 символа, usage в последнем (x_groq)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        base = {"id": f"chatcmpl-{self.stats['calls']}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": payload.get("model", "fake")}
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        try:
+            for piece in pieces:
+                chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece},
+                                             "finish_reason": None}])
+                await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.stats["streamed_tokens"] += 1
+                if self.token_ms:
+                    await asyncio.sleep(self.token_ms / 1000)
+            final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         x_groq={"id": base["id"], "usage": usage})
+            await resp.write(f"data: {json.dumps(final)}\n\n".encode())
+            await resp.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # Клиент оборвал поток (досрочная остановка)
+            self.stats["aborted"] += 1
+        return resp
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.stats["calls"] += 1
+        payload = await request.json()
+        await asyncio.sleep(self.latency_ms / 1000)
+        if self.rnd.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response(
+                {"error": {"message": "synthetic failure", "type": "server_error"}}, status=500
+            )
+        text = self.pick_text()
+        prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages", []))
+        if payload.get("stream"):
+            return await self.stream(request, payload, text, {
+                "prompt_tokens": prompt_chars // 3,
+                "completion_tokens": len(text) // 3,
+                "total_tokens": prompt_chars // 3 + len(text) // 3,
+            })
+        return web.json_response({
+            "id": f"chatcmpl-{self.stats['calls']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_chars // 3,
+                "completion_tokens": len(text) // 3,
+                "total_tokens": prompt_chars // 3 + len(text) // 3,
+            },
+        })
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float, error_rate: float, seed: int):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed + 2)
+        self.sent: List[Dict[str, str]] = []
+        self.stats = {"calls": 0, "errors": 0}
+
+    def routes(self) -> List[web.RouteDef]:
+        return [web.post("/bot{token}/{method}", self.handle)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats["calls"] += 1
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        await asyncio.sleep(self.latency_ms / 1000)
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot",
+            }})
+        if method == "sendmessage":
+            if self.rnd.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }, status=429)
+            self.sent.append({"chat_id": params.get("chat_id", ""), "text": params.get("text", "")})
+            chat_id = params.get("chat_id", "0")
+            return web.json_response({"ok": True, "result": {
+                "message_id": len(self.sent),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "channel"},
+                "text": params.get("text", ""),
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+
+class ServerThread(threading.Thread):
+    # Стенды живут в отдельном потоке со своим event loop, чтобы не мешать замерам бота
+    def __init__(self, apps: Dict[str, web.Application]):
+        super().__init__(daemon=True)
+        self.apps = apps
+        self.urls: Dict[str, str] = {}
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.runners: List[web.AppRunner] = []
+
+    async def _start(self):
+        for name, app in self.apps.items():
+            runner = web.AppRunner(app, access_log=None, shutdown_timeout=0.1)
+            await runner.setup()
+            self.runners.append(runner)
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.urls[name] = f"http://127.0.0.1:{port}"
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _cleanup(self):
+        for runner in self.runners:
+            await runner.cleanup()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._cleanup(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def make_app(routes: List[web.RouteDef]) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.add_routes(routes)
+    return app
+
+
+# ====================== ПРОГОН ======================
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Офлайн нагрузочный стенд для telegrambot.py")
+    p.add_argument("--feeds", type=int, default=200)
+    p.add_argument("--entries", type=int, default=20)
+    p.add_argument("--relevant-ratio", type=float, default=0.5)
+    p.add_argument("--feed-latency-ms", type=float, default=50)
+    p.add_argument("--feed-jitter-ms", type=float, default=30)
+    p.add_argument("--feed-error-rate", type=float, default=0.02)
+    p.add_argument("--feed-hang-rate", type=float, default=0.0)
+    p.add_argument("--bad-feeds", type=int, default=0, help="Сколько лент всегда зависают")
+    p.add_argument("--primary-feeds", type=int, default=0,
+                   help="Сколько первых лент назвать как PRIMARY_SOURCES (уровень 1)")
+    p.add_argument("--llm-latency-ms", type=float, default=200)
+    p.add_argument("--llm-token-ms", type=float, default=2.0,
+                   help="Пауза между кусками потокового ответа")
+    p.add_argument("--llm-error-rate", type=float, default=0.0)
+    p.add_argument("--llm-skip-rate", type=float, default=0.0)
+    p.add_argument("--llm-invalid-rate", type=float, default=0.0)
+    p.add_argument("--llm-text-file", default=None)
+    p.add_argument("--tg-latency-ms", type=float, default=20)
+    p.add_argument("--tg-error-rate", type=float, default=0.0)
+    p.add_argument("--http-timeout", type=float, default=10)
+    p.add_argument("--channels", type=int, default=1, help="Число профилей каналов (CHANNELS_FILE)")
+    p.add_argument("--runs", type=int, default=1)
+    p.add_argument("--pool-max-age-minutes", type=float, default=0,
+                   help="Переиспользование пула статей между прогонами (0 — качать каждый раз)")
+    p.add_argument("--no-adaptive-polling", action="store_true")
+    p.add_argument("--mode", default="run", help="Режим main(): run/prepare/send; "
+                   "можно цепочкой через запятую: prepare,send")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--workdir", default=None, help="Каталог для БД/логов (по умолчанию временный)")
+    p.add_argument("--log-level", default="WARNING")
+    p.add_argument("--json", action="store_true", help="Итог в JSON")
+    return p.parse_args(argv)
+
+
+async def run_bot(bot_module, runs: int, modes: List[str]) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        for mode in modes:
+            started = time.perf_counter()
+            await bot_module.main(mode)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    post_text = DEFAULT_POST_TEXT
+    if args.llm_text_file:
+        with open(args.llm_text_file, encoding="utf-8") as f:
+            post_text = f.read().strip()
+
+    feeds = FakeFeedServer(args.feeds, args.entries, args.relevant_ratio,
+                           args.feed_latency_ms, args.feed_jitter_ms,
+                           args.feed_error_rate, args.feed_hang_rate, args.seed, args.bad_feeds)
+    llm = FakeLLMBackend(post_text, args.llm_latency_ms, args.llm_error_rate,
+                         args.llm_skip_rate, args.llm_invalid_rate, args.seed, args.llm_token_ms)
+    tg = FakeBotAPI(args.tg_latency_ms, args.tg_error_rate, args.seed)
+
+    servers = ServerThread({
+        "rss": make_app(feeds.routes()),
+        "llm": make_app(llm.routes()),
+        "telegram": make_app(tg.routes()),
+    })
+    servers.start()
+    servers.ready.wait()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loadtest_")
+    os.makedirs(workdir, exist_ok=True)
+    feeds_file = os.path.join(workdir, "feeds.json")
+
+    channels_file = ""
+    if args.channels > 1:
+        channels_file = os.path.join(workdir, "channels.json")
+        with open(channels_file, "w", encoding="utf-8") as f:
+            json.dump([{"name": f"ch{i}", "channel_id": f"-100100000000{i}"}
+                       for i in range(args.channels)], f)
+
+    os.environ.update({
+        "GROQ_API_KEY": "loadtest",
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "CHANNEL_ID": "-1001000000001",
+        "GROQ_BASE_URL": servers.urls["llm"],
+        "TELEGRAM_API_URL": servers.urls["telegram"],
+        "RSS_FEEDS_FILE": feeds_file,
+        "CHANNELS_FILE": channels_file,
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import telegrambot
+
+    # Ленты читаются при каждом запуске main(), поэтому файл можно писать после импорта
+    primary = sorted(telegrambot.PRIMARY_SOURCES)[:args.primary_feeds]
+    with open(feeds_file, "w", encoding="utf-8") as f:
+        json.dump([[f"{servers.urls['rss']}/feed/{i}.xml",
+                    primary[i] if i < len(primary) else f"Synthetic {i}"]
+                   for i in range(args.feeds)], f)
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    telegrambot.config.fetch_delay_range = (0.0, 0.0)
+    telegrambot.config.groq_call_delay = 0.0
+    telegrambot.config.groq_base_delay = 0.05
+    telegrambot.config.post_retry_delay = 0.0
+    telegrambot.config.http_timeout = args.http_timeout
+    telegrambot.config.article_pool_max_age_minutes = args.pool_max_age_minutes
+    telegrambot.config.adaptive_polling = not args.no_adaptive_polling
+
+    try:
+        timings = asyncio.run(run_bot(telegrambot, args.runs, args.mode.split(",")))
+    finally:
+        servers.stop()
+
+    report = {
+        "workdir": workdir,
+        "feeds": args.feeds,
+        "entries_per_feed": args.entries,
+        "runs": args.runs,
+        "run_seconds": [round(t, 3) for t in timings],
+        "total_seconds": round(sum(timings), 3),
+        "rss": feeds.stats,
+        "llm": llm.stats,
+        "telegram": {**tg.stats, "sent": len(tg.sent)},
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"📂 {workdir}")
+        for i, t in enumerate(timings, 1):
+            print(f"⏱️ run {i}: {t:.3f}s")
+        print(f"📡 RSS: {feeds.stats}")
+        print(f"🤖 LLM: {llm.stats}")
+        print(f"📤 Telegram: {tg.stats}, отправлено {len(tg.sent)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
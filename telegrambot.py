@@ -3,42 +3,148 @@
 
 import os
 import json
+import argparse
 import asyncio
 import random
 import re
 import hashlib
+import html
 import logging
+import atexit
+import queue
+import shutil
+import tempfile
 import difflib
 import sqlite3
 import threading
 import signal
+import socket
 import sys
-from datetime import datetime, timezone
-from typing import List, Set, Optional, Tuple, Dict
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Set, Optional, Tuple, Dict, Callable, Iterator
 from urllib.parse import urlparse, parse_qs, urlencode
 from dataclasses import dataclass, field
-from functools import lru_cache
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import aiohttp
 import feedparser
+import numpy as np
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramEntityTooLarge, TelegramForbiddenError,
+    TelegramNotFound, TelegramRetryAfter, TelegramUnauthorizedError,
+)
 from groq import Groq
 
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
 # ====================== ЛОГИ ======================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    handlers=[
-        logging.FileHandler("block_ai_poster.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# Запись в файл и консоль — из фонового потока QueueListener; цикл событий только
+# кладёт запись в очередь. Решения по отдельным статьям — JSON-строки в отдельный файл
+DECISION_LOGGER = "decisions"
+
+
+class DeferredQueueHandler(QueueHandler):
+    # Запись уходит в очередь как есть: %-подстановка и форматирование — в потоке слушателя
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class DecisionFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "decision": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging() -> QueueListener:
+    text_format = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+    handlers: List[logging.Handler] = []
+    for handler in (logging.FileHandler("block_ai_poster.log", encoding="utf-8"), logging.StreamHandler()):
+        handler.setFormatter(text_format)
+        handler.addFilter(lambda record: record.name != DECISION_LOGGER)
+        handlers.append(handler)
+    decision_handler = RotatingFileHandler(
+        "decisions.jsonl", maxBytes=5 * 1024 * 1024, backupCount=2, encoding="utf-8"
+    )
+    decision_handler.setFormatter(DecisionFormatter())
+    decision_handler.addFilter(lambda record: record.name == DECISION_LOGGER)
+    handlers.append(decision_handler)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, handlers=[DeferredQueueHandler(log_queue)])
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 
+class DecisionLog:
+    # Решение по статье: ничего не собирается, если INFO выключен. Частые причины
+    # прореживаются — первые decision_log_burst за запуск пишутся все, дальше каждая
+    # decision_log_sample-я (с полем sample); общий поток — не больше decision_log_rate в секунду
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self.reset()
+
+    def reset(self):
+        self.counts: Counter = Counter()
+        self.dropped: Counter = Counter()
+        self.tokens: Optional[float] = None
+        self.refilled = time.monotonic()
+
+    def __call__(self, decision: str, article: Optional["Article"] = None, **fields):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self.counts[decision] += 1
+        count = self.counts[decision]
+        if count > config.decision_log_burst:
+            if count % config.decision_log_sample:
+                self.dropped[decision] += 1
+                return
+            fields["sample"] = config.decision_log_sample
+        now = time.monotonic()
+        rate = config.decision_log_rate
+        self.tokens = rate if self.tokens is None else min(rate, self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+        if self.tokens < 1:
+            self.dropped[decision] += 1
+            return
+        self.tokens -= 1
+        if article is not None:
+            fields.update(source=article.source, title=article.title[:80], url=article.link)
+        self.logger.info(decision, extra={"fields": fields})
+
+    def summary(self) -> dict:
+        total = sum(self.counts.values())
+        return {"decisions": total, "written": total - sum(self.dropped.values()),
+                "dropped": dict(self.dropped.most_common(5))}
+
+
+decisions = DecisionLog(DECISION_LOGGER)
+
+
 # ====================== CONFIG ======================
 class Config:
     def __init__(self):
@@ -47,11 +153,21 @@ class Config:
         self.channel_id = os.getenv("CHANNEL_ID")
         self.retention_days = 90
         self.db_file = "posted_articles.db"
+        self.db_read_connections = 3            # читающих WAL-соединений на канал (плюс одно пишущее)
+        self.bloom_size_bytes = 2 * 1024 * 1024 # фильтр Блума всех когда-либо опубликованных URL и хешей
+        self.bloom_false_positive_rate = 0.001  # задаёт число хешей; при 2 МБ это ~1.1 млн ключей
 
         self.title_similarity_threshold = 0.60
         self.ngram_similarity_threshold = 0.55
         self.jaccard_threshold = 0.55
         self.same_domain_similarity = 0.65
+        self.content_similarity_threshold = 0.40
+        self.simhash_max_distance = 6           # бит SimHash (короткие тексты: правка слова ≈ 1-2 бита);
+                                                # полос в индексе на одну больше
+        self.content_vector_dim = 1024          # float32-блоб 4 KB на пост
+        self.dedupe_window = 16                 # сюжетов на одну пакетную проверку по БД
+        self.content_ngram_range = (4, 5)
+        self.text_cache_size = 20000
 
         self.subject_window_hours = 48
         self.max_posts_per_subject = 10
@@ -61,6 +177,10 @@ class Config:
         self.alternation_enabled = True
 
         self.min_post_length = 700
+        self.max_post_length = 2000             # тело поста; с хештегами, ссылкой и дисклеймером
+        self.telegram_message_limit = 4096      # жёсткий лимит Telegram на текст сообщения
+        self.source_url_allowance = 512         # запас под ссылку на источник
+        self.stored_summary_length = 2000       # анонс статьи в очереди и outbox
         self.max_article_age_hours = 720
         self.min_ai_score = 1
         self.max_repeat_sentences = 2
@@ -76,15 +196,90 @@ class Config:
 
         self.batch_subject_limit = 10
 
+        # Ранжирование кандидатов по истории исходов генерации
+        self.learned_ranking = True
+        self.ranker_min_samples = 100
+        self.ranker_l2 = 1.0
+        self.ranker_source_buckets = 64
+        self.ranker_history_days = 90
+
         self.groq_retries_per_model = 2
+        self.prompt_token_budget = 1100         # весь промпт, по оценке estimate_tokens
+        self.prompt_min_summary_tokens = 150
+        self.completion_token_margin = 1.8      # запас к длине поста
+        self.reasoning_token_allowance = 1024   # gpt-oss с reasoning_effort=low
+        self.llm_streaming = True               # ответ потоком с досрочной остановкой
         self.groq_base_delay = 2.0
         self.telegram_timeout = 30
+        self.telegram_send_retries = 4
+        self.telegram_retry_base_delay = 1.0
+        self.telegram_max_retry_wait = 60
+        self.telegram_chat_interval = 3.0   # ≤20 сообщений в минуту в один канал
+        self.telegram_global_rate = 25      # < 30 сообщений в секунду на бота
+        self.outbox_max_attempts = 6        # дальше пост из outbox помечается failed
+        self.outbox_max_age_hours = 12      # устаревшую новость не досылаем
         self.http_timeout = 60
-
+        self.feed_max_entries = 20
+        self.feed_max_bytes = 2 * 1024 * 1024   # после распаковки
+        self.feed_chunk_size = 16 * 1024
+        # Архив сырых лент для replay: пусто — не записывать
+        self.feed_archive_dir = os.getenv("FEED_ARCHIVE_DIR", "")
+
+        # Координация запусков через аренды (leases) в БД состояния
+        self.runner_id = os.getenv("RUNNER_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_ttl_seconds = 180
+        self.lease_heartbeat_seconds = 30
+        self.article_pool_max_age_minutes = 10
+        self.fetch_wait_seconds = 120
+
+        # Очередь готовых постов (режим prepare)
+        self.queue_target_size = 3
+        self.queue_max_age_hours = 12
+        self.queue_fallback_full_run = True
+
+        # Адаптивный опрос лент по статистике (частота новых записей, доля принятых, задержка)
+        self.adaptive_polling = True
+        self.poll_min_history = 3
+        self.poll_max_interval_hours = 24
+        self.poll_low_yield_rate = 0.02
+        self.poll_low_yield_factor = 3.0
+        self.poll_slow_latency = 10.0
+        self.poll_stats_alpha = 0.3
+
+        # Circuit breaker и таймауты по истории задержек ленты
+        self.breaker_failure_threshold = 3
+        self.breaker_cooldown_minutes = 60
+        self.breaker_max_cooldown_hours = 24
+        self.breaker_probe_timeout = 10.0
+        self.feed_min_timeout = 5.0
+        self.feed_timeout_deviations = 4.0
+
+        self.fetch_deadline_seconds = 90
+        self.tiered_fetching = True
+
+        # Журнал решений по статьям (decisions.jsonl)
+        self.decision_log_burst = 20        # первые N решений каждого вида пишутся все
+        self.decision_log_sample = 10       # дальше — каждое N-е
+        self.decision_log_rate = 200        # записей в секунду, не больше
+
+        self.fetch_delay_range = (0.3, 1.5)
+        self.groq_call_delay = 1.0
+        self.post_retry_delay = 2.0
+
+        # Переопределения адресов (локальные стенды, self-hosted Bot API)
+        self.groq_base_url = os.getenv("GROQ_BASE_URL")
+        self.telegram_api_url = os.getenv("TELEGRAM_API_URL")
+        self.rss_feeds_file = os.getenv("RSS_FEEDS_FILE")
+
+        # JSON-список профилей каналов; без него работает один канал CHANNEL_ID
+        self.channels_file = os.getenv("CHANNELS_FILE")
+
+    def require_secrets(self):
+        # Только для режимов с LLM и Telegram: fetch, check-db, replay и search работают без секретов
         missing = []
         for var, name in [(self.groq_api_key, "GROQ_API_KEY"),
                           (self.telegram_token, "TELEGRAM_BOT_TOKEN"),
-                          (self.channel_id, "CHANNEL_ID")]:
+                          (self.channel_id or self.channels_file, "CHANNEL_ID")]:
             if not var:
                 missing.append(name)
         if missing:
@@ -93,17 +288,69 @@ class Config:
 
 config = Config()
 
+
+# ====================== ПРОФИЛИ КАНАЛОВ ======================
+@dataclass
+class ChannelProfile:
+    name: str
+    channel_id: str
+    db_file: str
+    include_ai: bool = True
+    include_block: bool = True
+    topics: Optional[Set[str]] = None
+    keywords: List[str] = field(default_factory=list)
+    exclude_keywords: List[str] = field(default_factory=list)
+    # None — берётся значение из Config
+    diversity_window: Optional[int] = None
+    same_topic_limit: Optional[int] = None
+    rotation_history_size: Optional[int] = None
+    source_min_posts_between: Optional[int] = None
+    source_max_in_window: Optional[int] = None
+
+    def rule(self, name: str):
+        value = getattr(self, name, None)
+        return value if value is not None else getattr(config, name)
+
+
+def load_channel_profiles() -> List[ChannelProfile]:
+    if not config.channels_file:
+        return [ChannelProfile(name="default", channel_id=config.channel_id, db_file=config.db_file)]
+    with open(config.channels_file, encoding="utf-8") as f:
+        raw_profiles = json.load(f)
+    profiles = []
+    for item in raw_profiles:
+        item = dict(item)
+        # Первый канал остаётся на config.db_file: включение CHANNELS_FILE не бросает его историю
+        item.setdefault("db_file", config.db_file if not profiles else f"posted_{item['name']}.db")
+        if item.get("topics") is not None:
+            item["topics"] = set(item["topics"])
+        item["keywords"] = [kw.lower() for kw in item.get("keywords", [])]
+        item["exclude_keywords"] = [kw.lower() for kw in item.get("exclude_keywords", [])]
+        profiles.append(ChannelProfile(**item))
+    db_files = [p.db_file for p in profiles]
+    if len(set(db_files)) != len(db_files):
+        raise SystemExit("❌ У каждого канала должна быть своя БД истории (db_file)")
+    return profiles
+
+
 bot: Optional[Bot] = None
 groq_client: Optional[Groq] = None
+delivery: Optional["TelegramDelivery"] = None
+feed_archive: Optional["FeedArchive"] = None
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+FEED_HEADERS = {**HEADERS, "Accept-Encoding": "gzip, deflate, br" if brotli else "gzip, deflate"}
 
 
 def init_clients():
-    global bot, groq_client
+    global bot, groq_client, delivery
     try:
+        session = None
+        if config.telegram_api_url:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(config.telegram_api_url))
         bot = Bot(
             token=config.telegram_token,
+            session=session,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
         logger.info("✅ Telegram Bot инициализирован")
@@ -111,11 +358,12 @@ def init_clients():
         logger.error(f"❌ Ошибка инициализации Telegram Bot: {e}")
         raise
     try:
-        groq_client = Groq(api_key=config.groq_api_key)
+        groq_client = Groq(api_key=config.groq_api_key, base_url=config.groq_base_url)
         logger.info("✅ Groq client инициализирован")
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации Groq: {e}")
         raise
+    delivery = TelegramDelivery()
 
 
 # ===== АКТУАЛЬНЫЕ МОДЕЛИ =====
@@ -159,6 +407,25 @@ RSS_FEEDS = [
      "&types%5B%5D=post&types%5B%5D=news", "Habr AI"),
 ]
 
+
+def get_rss_feeds() -> List[Tuple[str, str]]:
+    if not config.rss_feeds_file:
+        return RSS_FEEDS
+    with open(config.rss_feeds_file, encoding="utf-8") as f:
+        feeds = [(item[0], item[1]) for item in json.load(f)]
+    logger.info(f"📄 Ленты из {config.rss_feeds_file}: {len(feeds)}")
+    return feeds
+
+
+def source_tiers(feeds: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    # Уровень 1 — PRIMARY_SOURCES, остальные ленты нужны только если он пуст
+    if not config.tiered_fetching:
+        return [feeds]
+    primary = [feed for feed in feeds if feed[1] in PRIMARY_SOURCES]
+    fallback = [feed for feed in feeds if feed[1] not in PRIMARY_SOURCES]
+    return [tier for tier in (primary, fallback) if tier]
+
+
 # ---------- КЛЮЧЕВЫЕ СЛОВА ----------
 AI_KEYWORDS_STRONG = [
     "artificial intelligence", "machine learning", "deep learning",
@@ -231,6 +498,7 @@ class Article:
     link: str
     source: str
     published: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    features: Optional["ArticleFeatures"] = field(default=None, repr=False, compare=False)
 
 
 class Topic:
@@ -309,49 +577,120 @@ def get_domain(url: str) -> str:
         return ""
 
 
-@lru_cache(maxsize=2000)
+# ---------- НОРМАЛИЗАЦИЯ ТЕКСТА ----------
+# Один проход по заголовку даёт всё, что нужно дедупликации; результат кэшируется
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'must', 'shall', 'can', 'need', 'to', 'of',
+    'in', 'for', 'on', 'with', 'at', 'by', 'from', 'as', 'into', 'through',
+    'during', 'before', 'above', 'below', 'between', 'under',
+    'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where',
+    'why', 'how', 'all', 'each', 'few', 'more', 'most', 'other', 'some',
+    'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so', 'than', 'too',
+    'very', 'just', 'and', 'but', 'if', 'or', 'because', 'until', 'while',
+    'about', 'against', 'its', 'new', 'says', 'said', 'get', 'got', 'gets',
+    'make', 'made', 'makes', 'now', 'also', 'first', 'using', 'used', 'use',
+    'out', 'up', 'what', 'which', 'who', 'this', 'that', 'these', 'those',
+    'it', 'its', 'you', 'your', 'we', 'our', 'they', 'their', 'he', 'she',
+    'him', 'her', 'his', 'hers', 'my', 'mine', 'yours', 'ours', 'theirs',
+    'и', 'в', 'на', 'с', 'по', 'для', 'от', 'из', 'за', 'до', 'не',
+    'что', 'как', 'это', 'все', 'его', 'она', 'они', 'мы', 'вы', 'он',
+    'но', 'то', 'так', 'уже', 'или', 'ещё', 'еще', 'при', 'без',
+    'тоже', 'также', 'будет', 'была', 'были', 'быть', 'может',
+    'этот', 'эта', 'эти', 'тот', 'того', 'этого', 'свой', 'свои',
+})
+
+PUNCT_RE = re.compile(r'[^\w\s]')
+SPACE_RE = re.compile(r'\s+')
+MODEL_NUMBER_RE = re.compile(r'([a-zA-Zа-яА-ЯёЁ]+)\s*[-.]?\s*(\d+(?:\.\d+)?)')
+WORD_RE = re.compile(r'\b[a-zA-Zа-яА-ЯёЁ0-9]+\b')
+
+
+@dataclass(frozen=True)
+class TextTokens:
+    normalized: str
+    words: frozenset
+    signature: str
+    ngrams: frozenset
+    content_hash: str
+
+
+class TextNormalizer:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[Tuple[str, str], TextTokens]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _join_model_number(match: re.Match) -> str:
+        return match.group(1) + match.group(2).replace('.', '')
+
+    def _analyze(self, title: str, summary: str) -> TextTokens:
+        lower = title.lower()
+        normalized = SPACE_RE.sub(' ', PUNCT_RE.sub(' ', lower.strip())).strip()
+        normalized = MODEL_NUMBER_RE.sub(self._join_model_number, normalized)
+
+        words = frozenset(w for w in WORD_RE.findall(lower) if len(w) > 2 and w not in STOP_WORDS)
+
+        parts = lower.split()
+        if len(parts) < 2:
+            ngrams = frozenset(parts)
+        else:
+            ngrams = frozenset(f"{parts[i]} {parts[i + 1]}" for i in range(len(parts) - 1))
+
+        content = f"{title} {summary}"
+        content_hash = hashlib.md5(
+            SPACE_RE.sub(' ', content.lower().strip())[:300].encode()
+        ).hexdigest()
+
+        return TextTokens(
+            normalized=normalized,
+            words=words,
+            signature=' '.join(sorted(words)),
+            ngrams=ngrams,
+            content_hash=content_hash,
+        )
+
+    def analyze(self, title: str, summary: str = "") -> TextTokens:
+        key = (title, summary)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = self._analyze(title, summary)
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses, 'size': len(self._cache),
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+text_normalizer = TextNormalizer(config.text_cache_size)
+
+
 def normalize_title(title: str) -> str:
-    t = title.lower().strip()
-    t = re.sub(r'[^\w\s]', ' ', t)
-    t = re.sub(r'\s+', ' ', t).strip()
-    t = re.sub(
-        r'([a-zA-Zа-яА-ЯёЁ]+)\s*[-.]?\s*(\d+(?:\.\d+)?)',
-        lambda m: m.group(1) + m.group(2).replace('.', ''),
-        t
-    )
-    return t
+    return text_normalizer.analyze(title).normalized
 
 
-@lru_cache(maxsize=2000)
 def get_title_words(title: str) -> frozenset:
-    words = re.findall(r'\b[a-zA-Zа-яА-ЯёЁ0-9]+\b', title.lower())
-    stop_words = {
-        'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-        'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-        'should', 'may', 'might', 'must', 'shall', 'can', 'need', 'to', 'of',
-        'in', 'for', 'on', 'with', 'at', 'by', 'from', 'as', 'into', 'through',
-        'during', 'before', 'above', 'below', 'between', 'under',
-        'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where',
-        'why', 'how', 'all', 'each', 'few', 'more', 'most', 'other', 'some',
-        'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so', 'than', 'too',
-        'very', 'just', 'and', 'but', 'if', 'or', 'because', 'until', 'while',
-        'about', 'against', 'its', 'new', 'says', 'said', 'get', 'got', 'gets',
-        'make', 'made', 'makes', 'now', 'also', 'first', 'using', 'used', 'use',
-        'out', 'up', 'what', 'which', 'who', 'this', 'that', 'these', 'those',
-        'it', 'its', 'you', 'your', 'we', 'our', 'they', 'their', 'he', 'she',
-        'him', 'her', 'his', 'hers', 'my', 'mine', 'yours', 'ours', 'theirs',
-        'и', 'в', 'на', 'с', 'по', 'для', 'от', 'из', 'за', 'до', 'не',
-        'что', 'как', 'это', 'все', 'его', 'она', 'они', 'мы', 'вы', 'он',
-        'но', 'то', 'так', 'уже', 'или', 'ещё', 'еще', 'при', 'без',
-        'тоже', 'также', 'будет', 'была', 'были', 'быть', 'может',
-        'этот', 'эта', 'эти', 'тот', 'того', 'этого', 'свой', 'свои',
-    }
-    return frozenset(w for w in words if len(w) > 2 and w not in stop_words)
+    return text_normalizer.analyze(title).words
 
 
 def get_sorted_word_signature(title: str) -> str:
-    words = get_title_words(title)
-    return ' '.join(sorted(words))
+    return text_normalizer.analyze(title).signature
 
 
 def calculate_similarity(str1: str, str2: str) -> float:
@@ -366,22 +705,20 @@ def jaccard_similarity(set1: Set[str], set2: Set[str]) -> float:
 
 def ngram_similarity(str1: str, str2: str, n: int = 2) -> float:
     def get_ngrams(text: str, n: int) -> Set[str]:
+        if n == 2:
+            return text_normalizer.analyze(text).ngrams
         words = text.lower().split()
         if len(words) < n:
             return set(words)
         return set(' '.join(words[i:i + n]) for i in range(len(words) - n + 1))
 
-    ng1 = get_ngrams(str1, n)
-    ng2 = get_ngrams(str2, n)
-    if not ng1 or not ng2:
-        return 0.0
-    return len(ng1 & ng2) / len(ng1 | ng2)
+    return jaccard_similarity(get_ngrams(str1, n), get_ngrams(str2, n))
 
 
 def get_content_hash(text: str) -> str:
     if not text:
         return ""
-    normalized = re.sub(r'\s+', ' ', text.lower().strip())[:300]
+    normalized = SPACE_RE.sub(' ', text.lower().strip())[:300]
     return hashlib.md5(normalized.encode()).hexdigest()
 
 
@@ -447,50 +784,108 @@ def is_junk_content(text: str) -> bool:
     return any(kw in text_lower for kw in JUNK_KEYWORDS)
 
 
+# ====================== ПРИЗНАКИ СТАТЬИ ======================
+# Считаются один раз на статью и переиспользуются всеми каналами
+@dataclass
+class ArticleFeatures:
+    text: str
+    text_lower: str
+    title_normalized: str
+    word_signature: str
+    content_hash: str
+    topic: str
+    is_game: bool
+    is_business: bool
+    is_promo: bool
+    is_junk: bool
+    is_review: bool
+    has_strong_ai: bool
+    has_weak_ai: bool
+    is_block: bool
+    ai_score: int
+    block_score: int
+
+
+def get_features(article: Article) -> ArticleFeatures:
+    if article.features is None:
+        text = f"{article.title} {article.summary}"
+        text_lower = text.lower()
+        tokens = text_normalizer.analyze(article.title, article.summary)
+        article.features = ArticleFeatures(
+            text=text,
+            text_lower=text_lower,
+            title_normalized=tokens.normalized,
+            word_signature=tokens.signature,
+            content_hash=tokens.content_hash,
+            topic=Topic.detect(text),
+            is_game=any(g in text_lower for g in GAMES_EXCLUDE),
+            is_business=any(b in text_lower for b in BUSINESS_EXCLUDE),
+            is_promo=is_promo_content(text_lower),
+            is_junk=is_junk_content(text_lower),
+            is_review=any(rw in text_lower for rw in REVIEW_KEYWORDS),
+            has_strong_ai=any(kw in text_lower for kw in AI_KEYWORDS_STRONG),
+            has_weak_ai=any(kw in text_lower for kw in AI_KEYWORDS_WEAK),
+            is_block=any(kw in text_lower for kw in BLOCK_KEYWORDS),
+            ai_score=ai_relevance_score(text),
+            block_score=block_relevance_score(text),
+        )
+    return article.features
+
+
 # ====================== is_relevant ======================
-def is_relevant(article: Article) -> bool:
-    text = f"{article.title} {article.summary}".lower()
+def is_relevant(article: Article, profile: Optional[ChannelProfile] = None) -> bool:
+    f = get_features(article)
+    channel = profile.name if profile is not None else None
 
     age_hours = (datetime.now(timezone.utc) - article.published).total_seconds() / 3600
     if age_hours > config.max_article_age_hours:
-        logger.info(f"  ⏰ TOO_OLD ({age_hours:.0f}h): {article.title[:50]}")
+        decisions("TOO_OLD", article, channel=channel, age_hours=round(age_hours))
+        return False
+
+    if f.is_game:
+        decisions("GAME", article, channel=channel)
         return False
 
-    if any(g in text for g in GAMES_EXCLUDE):
-        logger.info(f"  🎮 GAME: {article.title[:50]}")
+    if f.is_business:
+        decisions("BUSINESS", article, channel=channel)
         return False
 
-    if any(b in text for b in BUSINESS_EXCLUDE):
-        logger.info(f"  🏢 BUSINESS: {article.title[:50]}")
+    if f.is_promo:
+        decisions("PROMO", article, channel=channel)
         return False
 
-    if is_promo_content(text):
-        logger.info(f"  📢 PROMO: {article.title[:50]}")
+    if f.is_junk:
+        decisions("JUNK", article, channel=channel)
         return False
 
-    if is_junk_content(text):
-        logger.info(f"  🗑️ JUNK (вакансия/реклама): {article.title[:50]}")
+    if f.is_review and not f.has_strong_ai:
+        decisions("REVIEW", article, channel=channel)
         return False
 
-    if any(rw in text for rw in REVIEW_KEYWORDS):
-        if not any(kw in text for kw in AI_KEYWORDS_STRONG):
-            logger.info(f"  📝 REVIEW/DEAL (нет сильного AI): {article.title[:50]}")
+    if profile is not None:
+        if any(kw in f.text_lower for kw in profile.exclude_keywords):
+            decisions("EXCLUDED", article, channel=channel)
             return False
+        if profile.topics is not None and f.topic not in profile.topics:
+            decisions("TOPIC", article, channel=channel, topic=f.topic)
+            return False
+        if any(kw in f.text_lower for kw in profile.keywords):
+            decisions("KEYWORD", article, channel=channel)
+            return True
 
-    has_strong_ai = any(kw in text for kw in AI_KEYWORDS_STRONG)
-    has_weak_ai = any(kw in text for kw in AI_KEYWORDS_WEAK)
-    is_ai = has_strong_ai or (has_weak_ai and config.min_ai_score <= 1)
-    is_block = any(kw in text for kw in BLOCK_KEYWORDS)
+    include_ai = profile.include_ai if profile is not None else True
+    include_block = profile.include_block if profile is not None else True
+    is_ai = f.has_strong_ai or (f.has_weak_ai and config.min_ai_score <= 1)
 
-    if is_block:
-        logger.info(f"  ✅ BLOCK (приоритет): {article.title[:55]}")
+    if f.is_block and include_block:
+        decisions("BLOCK", article, channel=channel)
         return True
 
-    if is_ai:
-        logger.info(f"  ✅ AI (без гео-фильтра): {article.title[:55]}")
+    if is_ai and include_ai:
+        decisions("AI", article, channel=channel)
         return True
 
-    logger.info(f"  🚫 NEITHER AI NOR BLOCK: {article.title[:50]}")
+    decisions("NEITHER", article, channel=channel)
     return False
 
 
@@ -509,22 +904,352 @@ class DuplicateCheckResult:
         self.is_duplicate = True
 
 
+@dataclass
+class CandidateScreen:
+    # Вердикты истории по одному кандидату: лимит темы, дубль, разнообразие
+    subject: Tuple[bool, str]
+    duplicate: DuplicateCheckResult
+    diversity: Tuple[bool, str]
+
+
+# ====================== ВЕКТОРНОЕ СРАВНЕНИЕ С ИСТОРИЕЙ ======================
+def content_vector(title: str, summary: str) -> np.ndarray:
+    # Хешированные символьные n-граммы текста (log-TF); IDF накладывается при сравнении.
+    # Знак из старшего бита хеша гасит коллизии корзин — фон сходства заметно ниже
+    text = SPACE_RE.sub(' ', f"{title} {summary[:1000]}".lower()).strip()
+    low, high = config.content_ngram_range
+    hashes = np.array([
+        zlib.crc32(text[i:i + n].encode())
+        for n in range(low, high + 1)
+        for i in range(len(text) - n + 1)
+    ], dtype=np.int64)
+    signs = np.where(hashes >> 31, -1.0, 1.0)
+    counts = np.bincount(hashes % config.content_vector_dim, weights=signs,
+                         minlength=config.content_vector_dim)
+    return (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+
+
+SIMHASH_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def summary_simhash(title: str, summary: str) -> int:
+    # 64-битный SimHash по словам заголовка и начала текста (вес — частота слова). Мелкая
+    # правка переворачивает несколько бит, а не весь отпечаток, как у content_hash
+    words = Counter(
+        w for w in WORD_RE.findall(f"{title} {summary[:1000]}".lower())
+        if len(w) > 2 and w not in STOP_WORDS
+    )
+    if not words:
+        return 0
+    hashes = np.array([
+        int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little") for w in words
+    ], dtype=np.uint64)
+    weights = np.fromiter(words.values(), dtype=np.float64, count=len(words))
+    bits = ((hashes[:, None] >> SIMHASH_SHIFTS) & np.uint64(1)).astype(np.float64)
+    votes = weights @ (2 * bits - 1)
+    return sum(1 << int(i) for i in np.nonzero(votes > 0)[0])
+
+
+def simhash_bands(fingerprint: int, bands: int) -> List[Tuple[int, int]]:
+    # 64 бита режутся на bands блоков подряд. Если отпечатки различаются не больше чем
+    # в bands - 1 битах, хотя бы один блок у них совпадает целиком
+    result = []
+    offset = 0
+    for band in range(bands):
+        width = 64 // bands + (1 if band < 64 % bands else 0)
+        result.append((band, (fingerprint >> offset) & ((1 << width) - 1)))
+        offset += width
+    return result
+
+
+def to_sqlite_int(value: int) -> int:
+    # SQLite INTEGER знаковый: старший бит отпечатка уходит в знак
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class TokenMatrix:
+    # Разреженная матрица «заголовок × токен» (CSR) поверх общего словаря
+    def __init__(self, vocab: Dict[str, int], rows: List[Set[str]]):
+        indptr = [0]
+        indices = []
+        for tokens in rows:
+            indices.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+            indptr.append(len(indices))
+        self.indices = np.array(indices, dtype=np.int64)
+        self.sizes = np.diff(np.array(indptr, dtype=np.int64))
+        self.row_ids = np.repeat(np.arange(len(rows), dtype=np.int64), self.sizes)
+
+    def jaccard(self, vocab: Dict[str, int], batch: List[frozenset]) -> np.ndarray:
+        # Пересечения считаются одним умножением по столбцам, встречающимся в пачке
+        columns: Dict[int, int] = {}
+        query_rows, query_cols = [], []
+        for i, tokens in enumerate(batch):
+            for token in tokens:
+                token_id = vocab.get(token)
+                if token_id is not None:
+                    query_rows.append(i)
+                    query_cols.append(columns.setdefault(token_id, len(columns)))
+
+        history_count = len(self.sizes)
+        intersections = np.zeros((len(batch), history_count), dtype=np.int64)
+        if columns and history_count:
+            col_map = np.full(len(vocab), -1, dtype=np.int64)
+            col_map[np.fromiter(columns, dtype=np.int64, count=len(columns))] = np.arange(len(columns))
+            mapped = col_map[self.indices]
+            present = mapped >= 0
+            history = np.zeros((history_count, len(columns)), dtype=np.float32)
+            history[self.row_ids[present], mapped[present]] = 1.0
+            query = np.zeros((len(batch), len(columns)), dtype=np.float32)
+            query[query_rows, query_cols] = 1.0
+            intersections = np.rint(query @ history.T).astype(np.int64)
+
+        batch_sizes = np.array([len(tokens) for tokens in batch], dtype=np.int64)[:, None]
+        history_sizes = self.sizes[None, :]
+        union = batch_sizes + history_sizes - intersections
+        both = (batch_sizes > 0) & (history_sizes > 0)
+        return np.where(both, intersections / np.maximum(union, 1), 0.0)
+
+
+class HistoryIndex:
+    # Снимок опубликованного за retention_days; сравнивает пачку заголовков со всей историей
+    def __init__(self, rows: list, version: tuple):
+        self.version = version
+        self.ids = [row[0] for row in rows]
+        self.titles = [row[1] for row in rows]
+        self.normalized = [(row[2] or "").lower() for row in rows]
+        self.domains = np.array([row[4] for row in rows], dtype=object)
+        self.lengths = np.array([len(n) for n in self.normalized], dtype=np.int64)
+        # Счётчики символов: по ним векторно считается quick_ratio (граница сверху для ratio)
+        self.alphabet: Dict[str, int] = {}
+        for text in self.normalized:
+            for ch in text:
+                self.alphabet.setdefault(ch, len(self.alphabet))
+        self.char_counts = np.zeros((len(rows), max(len(self.alphabet), 1)), dtype=np.int32)
+        for row, text in enumerate(self.normalized):
+            for ch, count in Counter(text).items():
+                self.char_counts[row, self.alphabet[ch]] = count
+        self.vocab: Dict[str, int] = {}
+        self.words = TokenMatrix(self.vocab, [set(safe_json_loads(row[3], [])) for row in rows])
+        self.ngrams = TokenMatrix(self.vocab, [text_normalizer.analyze(t).ngrams for t in self.titles])
+
+        # TF-IDF по содержанию: векторы из БД, недостающие досчитываются (и сохраняются менеджером)
+        dim = config.content_vector_dim
+        self.missing_vectors: List[Tuple[int, bytes]] = []
+        content = np.zeros((len(rows), dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            blob = row[6]
+            if blob and len(blob) == dim * 4:
+                content[i] = np.frombuffer(blob, dtype=np.float32)
+            else:
+                content[i] = content_vector(row[1], row[5] or "")
+                self.missing_vectors.append((row[0], content[i].tobytes()))
+        document_freq = (content != 0).sum(axis=0)
+        self.idf = (np.log((1 + len(rows)) / (1 + document_freq)) + 1).astype(np.float32)
+        self.content = normalize_rows(content * self.idf)
+
+    def check(self, batch: List[Tuple[TextTokens, str, np.ndarray]], results: List[DuplicateCheckResult]):
+        if not batch or not self.titles:
+            return
+        word_sim = self.words.jaccard(self.vocab, [tokens.words for tokens, _, _ in batch])
+        ngram_sim = self.ngrams.jaccard(self.vocab, [tokens.ngrams for tokens, _, _ in batch])
+        queries = normalize_rows(np.stack([vector for _, _, vector in batch]) * self.idf)
+        content_sim = queries @ self.content.T
+
+        for i, (tokens, domain, _) in enumerate(batch):
+            title_normalized = tokens.normalized.lower()
+            same_domain = self.domains == domain
+            # quick_ratio — верхняя граница SequenceMatcher.ratio(): отсекаем заведомо непохожие
+            cols, counts = [], []
+            for ch, count in Counter(title_normalized).items():
+                if ch in self.alphabet:
+                    cols.append(self.alphabet[ch])
+                    counts.append(count)
+            matches = np.minimum(self.char_counts[:, cols], np.array(counts, dtype=np.int32)).sum(axis=1)
+            total = len(title_normalized) + self.lengths
+            bound = np.where(total > 0, 2.0 * matches / np.maximum(total, 1), 1.0)
+            seq_needed = (bound > config.title_similarity_threshold) | (
+                same_domain & (bound > config.same_domain_similarity))
+            rows = np.nonzero(
+                seq_needed
+                | (ngram_sim[i] > config.ngram_similarity_threshold)
+                | (word_sim[i] > config.jaccard_threshold)
+                | (content_sim[i] > config.content_similarity_threshold)
+            )[0]
+
+            result = results[i]
+            for row in rows:
+                existing_title = self.titles[row]
+                seq_sim = 0.0
+                if seq_needed[row]:
+                    seq_sim = difflib.SequenceMatcher(None, title_normalized, self.normalized[row]).ratio()
+
+                if seq_sim > config.title_similarity_threshold:
+                    result.add_reason(f"TITLE_SIM ({seq_sim:.0%})", seq_sim, existing_title)
+
+                ngram = float(ngram_sim[i, row])
+                if ngram > config.ngram_similarity_threshold:
+                    result.add_reason(f"NGRAM ({ngram:.0%})", ngram, existing_title)
+
+                jaccard = float(word_sim[i, row])
+                if jaccard > config.jaccard_threshold:
+                    result.add_reason(f"JACCARD ({jaccard:.0%})", jaccard, existing_title)
+
+                if same_domain[row] and seq_sim > config.same_domain_similarity:
+                    result.add_reason(f"SAME_DOMAIN ({seq_sim:.0%})", seq_sim, existing_title)
+
+                content = float(content_sim[i, row])
+                if content > config.content_similarity_threshold:
+                    result.add_reason(f"CONTENT_SIM ({content:.0%})", content, existing_title)
+
+
+# ====================== ФИЛЬТР БЛУМА ======================
+class BloomFilter:
+    # Битовый массив фиксированного размера и k позиций на ключ (двойное хеширование blake2b).
+    # Ложноотрицательных ответов нет; ложноположительных при n ключах ≈ (1 - e^(-kn/m))^k
+    def __init__(self, size_bytes: int, false_positive_rate: float,
+                 bits: Optional[bytes] = None, hashes: int = 0, items: int = 0):
+        self.bits = bytearray(bits) if bits is not None else bytearray(size_bytes)
+        self.size = len(self.bits) * 8
+        self.hashes = hashes or self.hashes_for(false_positive_rate)
+        self.items = items
+
+    @staticmethod
+    def hashes_for(false_positive_rate: float) -> int:
+        return max(1, round(-np.log2(false_positive_rate)))
+
+    def _positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> bool:
+        added = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                added = True
+        if added:
+            self.items += 1
+        return added
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def merge(self, bits: bytes):
+        # Биты другого процесса, сохранённые в ту же БД: объединение не теряет ни одного ключа.
+        # Ключи, добавленные с обеих сторон, не складываются, поэтому их число оценивается
+        # по доле единичных бит: n ≈ -(m/k)·ln(1 - X/m)
+        merged = int.from_bytes(self.bits, "little") | int.from_bytes(bits, "little")
+        self.bits[:] = merged.to_bytes(len(self.bits), "little")
+        filled = min(merged.bit_count(), self.size - 1)
+        self.items = round(-self.size / self.hashes * np.log(1 - filled / self.size))
+
+    def stats(self) -> dict:
+        load = self.hashes * self.items / self.size
+        return {
+            'items': self.items, 'size_kb': len(self.bits) // 1024, 'hashes': self.hashes,
+            'fpr': round(float((1 - np.exp(-load)) ** self.hashes), 6),
+        }
+
+
 # ====================== POSTED MANAGER ======================
 class PostedManager:
-    def __init__(self, db_file: str = "posted_articles.db"):
+    # Горячие запросы к posted_articles. Их же проверяет full_scans() через EXPLAIN QUERY PLAN
+    EXACT_KINDS = (("URL_EXACT", "norm_url"), ("CONTENT_HASH", "content_hash"), ("TITLE_EXACT", "title_normalized"))
+    HISTORY_VERSION_SQL = 'SELECT COUNT(*), MAX(id) FROM posted_articles WHERE posted_date > datetime("now", ?)'
+    HISTORY_SQL = '''
+        SELECT id, title, title_normalized, title_words, domain, summary, content_vector
+        FROM posted_articles
+        WHERE posted_date > datetime('now', ?)
+    '''
+    RECENT_SQL = (
+        "SELECT source, topic FROM posted_articles WHERE posted_date > datetime('now', ?) "
+        "ORDER BY posted_date DESC LIMIT ?"
+    )
+    BLOOM_SYNC_SQL = 'SELECT id, norm_url, content_hash FROM posted_articles WHERE id > ? ORDER BY id'
+    SEEN_KEYS_SQL = 'SELECT kind, key, title FROM posted_keys WHERE key IN ({})'
+    # Ветка на полосу: кортежное (band, value) IN (VALUES …) SQLite превращает в проход по posted_articles
+    SIMHASH_BRANCH_SQL = (
+        "SELECT b.post_id, p.simhash, p.title FROM simhash_bands b "
+        "JOIN posted_articles p ON p.id = b.post_id "
+        "WHERE b.band = ? AND b.value IN ({}) AND p.posted_date > datetime('now', ?)"
+    )
+    # Любой проход (SCAN) — по таблице или целиком по индексу — регрессия. Исключение —
+    # MATCH по FTS5: SQLite показывает его как SCAN виртуальной таблицы по её индексу
+    FULL_SCAN_RE = re.compile(r'SCAN (?!\w+ VIRTUAL TABLE INDEX \d+:M)')
+    # Составные индексы, которые должны обслуживать запрос, с порядком колонок: переставленные
+    # колонки или потерянный индекс дают поиск по другому (уникальному или датному) индексу без SCAN
+    EXPECTED_PLANS = {
+        "exact_match": tuple(
+            f"USING COVERING INDEX idx_{column}_recent ({column}=? AND posted_date>?)" for _, column in EXACT_KINDS
+        ),
+        "subject_window": ("USING INDEX idx_subject_recent (subject=? AND posted_date>?)",),
+    }
+    # Веса bm25 по колонкам posted_fts: title, summary, topic, subject, source
+    SEARCH_SQL = (
+        "SELECT posted_date, source, topic, subject, title, url, "
+        "bm25(posted_fts, 10.0, 3.0, 1.0, 2.0, 1.0) AS score, "
+        "snippet(posted_fts, 1, '[', ']', '…', 12) AS snippet "
+        "FROM posted_fts WHERE posted_fts MATCH ? AND posted_date > datetime('now', ?) ORDER BY score LIMIT ?"
+    )
+    AGGREGATE_KEYS = ('source', 'topic', 'subject')
+
+    def __init__(self, db_file: str = "posted_articles.db", profile: Optional[ChannelProfile] = None):
         self.db_file = db_file
-        self._local = threading.local()
+        self.profile = profile or ChannelProfile(name="default", channel_id=config.channel_id, db_file=db_file)
         self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._readers: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+        self._reader_conns: List[sqlite3.Connection] = []
+        # Свой пул на канал: записи идут по очереди через одно соединение под _lock,
+        # чтения — параллельно через WAL-читателей
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.db_read_connections + 1, thread_name_prefix=f"db-{self.profile.name}"
+        )
+        self._history: Optional[HistoryIndex] = None
         self._init_db()
+        self._index_simhashes()
+        self._bloom = self._load_bloom()
+        self._bloom_seen_id = 0
+        with self._reader() as conn:
+            self._sync_bloom(conn)
+        self._save_bloom()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
 
     def _get_conn(self) -> sqlite3.Connection:
-        if not hasattr(self._local, 'conn') or self._local.conn is None:
-            conn = sqlite3.connect(self.db_file, timeout=30.0, check_same_thread=True)
-            conn.row_factory = sqlite3.Row
-            conn.execute('PRAGMA journal_mode=WAL')
-            conn.execute('PRAGMA busy_timeout=30000')
-            self._local.conn = conn
-        return self._local.conn
+        # Единственное пишущее соединение; пользоваться только под self._lock
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        # Читатель WAL не ждёт ни писателя, ни других читателей. Соединений не больше,
+        # чем потоков, которые одновременно читают
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+            conn.execute('PRAGMA query_only=ON')
+            with self._lock:
+                self._reader_conns.append(conn)
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
 
     def _init_db(self):
         with self._lock:
@@ -546,7 +1271,8 @@ class PostedManager:
                     topic TEXT DEFAULT 'general',
                     subject TEXT DEFAULT 'other',
                     source TEXT,
-                    posted_date TEXT DEFAULT CURRENT_TIMESTAMP
+                    posted_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                    content_vector BLOB
                 )
             ''')
             cursor.execute('''
@@ -557,20 +1283,88 @@ class PostedManager:
                     rejected_at TEXT DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS publish_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    norm_url TEXT NOT NULL UNIQUE,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    summary TEXT,
+                    source TEXT,
+                    published TEXT,
+                    topic TEXT DEFAULT 'general',
+                    post_text TEXT NOT NULL,
+                    prepared_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS simhash_bands (
+                    band INTEGER NOT NULL,
+                    value INTEGER NOT NULL,
+                    post_id INTEGER NOT NULL,
+                    PRIMARY KEY (band, value, post_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_simhash_post ON simhash_bands(post_id)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS bloom_filters (
+                    name TEXT PRIMARY KEY,
+                    bits BLOB NOT NULL,
+                    hashes INTEGER NOT NULL,
+                    items INTEGER NOT NULL,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    summary TEXT,
+                    source TEXT,
+                    published TEXT,
+                    topic TEXT DEFAULT 'general',
+                    post_text TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
             try:
                 cursor.execute("ALTER TABLE posted_articles ADD COLUMN subject TEXT DEFAULT 'other'")
                 conn.commit()
             except Exception:
                 pass
-
+            try:
+                cursor.execute("ALTER TABLE posted_articles ADD COLUMN content_vector BLOB")
+                conn.commit()
+            except Exception:
+                pass
+            try:
+                cursor.execute("ALTER TABLE posted_articles ADD COLUMN simhash INTEGER")
+                conn.commit()
+            except Exception:
+                pass
+            self._init_fts(cursor)
+            self._init_seen_keys(cursor)
+
+            # Точные совпадения и окна тем читаются только из индексов: ключ, дата, заголовок.
+            # Одноколоночные индексы по этим полям поглощены составными
+            # Агрегаты поиска теперь считаются по posted_daily, индексы источника/топика не нужны
+            for idx_name in ('idx_norm_url', 'idx_content_hash', 'idx_title_normalized', 'idx_subject',
+                             'idx_source_recent', 'idx_topic_recent'):
+                cursor.execute(f'DROP INDEX IF EXISTS {idx_name}')
             indices = [
-                ('idx_norm_url', 'norm_url'),
-                ('idx_content_hash', 'content_hash'),
+                ('idx_norm_url_recent', 'norm_url, posted_date, title'),
+                ('idx_content_hash_recent', 'content_hash, posted_date, title'),
+                ('idx_title_normalized_recent', 'title_normalized, posted_date, title'),
                 ('idx_domain', 'domain'),
                 ('idx_posted_date', 'posted_date'),
-                ('idx_title_normalized', 'title_normalized'),
                 ('idx_title_word_signature', 'title_word_signature'),
-                ('idx_subject', 'subject'),
+                ('idx_subject_recent', 'subject, posted_date'),
             ]
             for idx_name, column in indices:
                 try:
@@ -580,6 +1374,246 @@ class PostedManager:
             conn.commit()
         logger.info("📚 База данных инициализирована")
 
+    def _init_fts(self, cursor: sqlite3.Cursor):
+        # Архив для поиска: posted_fts хранит текст сам и переживает cleanup по retention_days,
+        # posted_daily — счётчики постов по дням для агрегатов за годы. Оба пополняются триггерами
+        existing = cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'posted_fts'"
+        ).fetchone()
+        if existing and "content='posted_articles'" in existing[0]:
+            # Первая версия индекса читала текст из posted_articles и теряла всё удалённое cleanup
+            cursor.executescript('''
+                DROP TRIGGER IF EXISTS posted_fts_insert;
+                DROP TRIGGER IF EXISTS posted_fts_delete;
+                DROP TRIGGER IF EXISTS posted_fts_update;
+                DROP TABLE posted_fts;
+            ''')
+            existing = None
+        daily_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posted_daily'"
+        ).fetchone()
+        cursor.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS posted_fts USING fts5(
+                title, summary, topic, subject, source, url UNINDEXED, posted_date UNINDEXED,
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            CREATE TABLE IF NOT EXISTS posted_daily (
+                day TEXT NOT NULL,
+                source TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                posts INTEGER NOT NULL,
+                PRIMARY KEY (day, source, topic, subject)
+            ) WITHOUT ROWID;
+            CREATE TRIGGER IF NOT EXISTS posted_fts_insert AFTER INSERT ON posted_articles BEGIN
+                INSERT INTO posted_fts (rowid, title, summary, topic, subject, source, url, posted_date)
+                VALUES (new.id, new.title, new.summary, new.topic, new.subject, new.source, new.url, new.posted_date);
+                INSERT INTO posted_daily (day, source, topic, subject, posts)
+                VALUES (date(new.posted_date), IFNULL(new.source, ''), IFNULL(new.topic, ''), IFNULL(new.subject, ''), 1)
+                ON CONFLICT (day, source, topic, subject) DO UPDATE SET posts = posts + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS posted_fts_update
+            AFTER UPDATE OF title, summary, topic, subject, source ON posted_articles BEGIN
+                UPDATE posted_fts SET title = new.title, summary = new.summary, topic = new.topic,
+                    subject = new.subject, source = new.source
+                WHERE rowid = new.id;
+            END;
+        ''')
+        if not existing:
+            cursor.execute(
+                "INSERT INTO posted_fts (rowid, title, summary, topic, subject, source, url, posted_date) "
+                "SELECT id, title, summary, topic, subject, source, url, posted_date FROM posted_articles"
+            )
+            logger.info("🔎 Полнотекстовый индекс истории построен")
+        if not daily_exists:
+            cursor.execute(
+                "INSERT INTO posted_daily (day, source, topic, subject, posts) "
+                "SELECT date(posted_date), IFNULL(source, ''), IFNULL(topic, ''), IFNULL(subject, ''), COUNT(*) "
+                "FROM posted_articles GROUP BY 1, 2, 3, 4"
+            )
+
+    def _init_seen_keys(self, cursor: sqlite3.Cursor):
+        # URL и хеши содержания всех публикаций, без очистки по retention_days. По ним
+        # подтверждаются попадания фильтра Блума: сам фильтр доказывает только отсутствие ключа
+        created = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posted_keys'"
+        ).fetchone() is None
+        cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS posted_keys (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                title TEXT
+            ) WITHOUT ROWID;
+            CREATE TRIGGER IF NOT EXISTS posted_keys_insert AFTER INSERT ON posted_articles BEGIN
+                INSERT OR IGNORE INTO posted_keys (key, kind, title) VALUES (new.norm_url, 'URL_SEEN', new.title);
+                INSERT OR IGNORE INTO posted_keys (key, kind, title)
+                SELECT new.content_hash, 'CONTENT_SEEN', new.title WHERE new.content_hash IS NOT NULL;
+            END;
+        ''')
+        if created:
+            cursor.execute(
+                "INSERT OR IGNORE INTO posted_keys (key, kind, title) "
+                "SELECT norm_url, 'URL_SEEN', title FROM posted_articles"
+            )
+            cursor.execute(
+                "INSERT OR IGNORE INTO posted_keys (key, kind, title) "
+                "SELECT content_hash, 'CONTENT_SEEN', title FROM posted_articles WHERE content_hash IS NOT NULL"
+            )
+
+    # ---------- Поиск по истории ----------
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        # Запрос без синтаксиса FTS5 (или с ошибкой в нём) ищется как набор слов
+        words = re.findall(r'\w+', query)
+        return " ".join(f'"{w}"' for w in words)
+
+    def _match(self, conn: sqlite3.Connection, sql: str, query: str, params: tuple) -> List[sqlite3.Row]:
+        try:
+            return conn.execute(sql, (query, *params)).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                raise
+            fallback = self._fts_query(query)
+            return conn.execute(sql, (fallback, *params)).fetchall() if fallback else []
+
+    def search(self, query: str, days: int = 0, limit: int = 20) -> List[dict]:
+        window = f'-{days} days' if days else '-100 years'
+        with self._reader() as conn:
+            rows = self._match(conn, self.SEARCH_SQL, query, (window, limit))
+        return [dict(row) for row in rows]
+
+    def aggregate(self, by: str, query: str = "", days: int = 0, limit: int = 20) -> List[dict]:
+        if by not in self.AGGREGATE_KEYS:
+            raise ValueError(f"Агрегат возможен только по {self.AGGREGATE_KEYS}")
+        window = f'-{days} days' if days else '-100 years'
+        with self._reader() as conn:
+            if query:
+                rows = self._match(conn, (
+                    f"SELECT {by} AS key, COUNT(*) AS posts, MIN(posted_date) AS first, MAX(posted_date) AS last "
+                    f"FROM posted_fts WHERE posted_fts MATCH ? AND posted_date > datetime('now', ?) "
+                    f"GROUP BY {by} ORDER BY posts DESC LIMIT ?"
+                ), query, (window, limit))
+            else:
+                rows = conn.execute(
+                    f"SELECT {by} AS key, SUM(posts) AS posts, MIN(day) AS first, MAX(day) AS last "
+                    f"FROM posted_daily WHERE day >= date('now', ?) GROUP BY {by} ORDER BY posts DESC LIMIT ?",
+                    (window, limit)
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---------- SimHash и индекс расстояния Хэмминга ----------
+    def _insert_bands(self, conn: sqlite3.Connection, rows: List[Tuple[int, int]]):
+        bands = config.simhash_max_distance + 1
+        conn.executemany(
+            'INSERT OR IGNORE INTO simhash_bands (band, value, post_id) VALUES (?, ?, ?)',
+            [
+                (band, value, post_id)
+                for post_id, fingerprint in rows if fingerprint
+                for band, value in simhash_bands(fingerprint & ((1 << 64) - 1), bands)
+            ]
+        )
+
+    def _index_simhashes(self):
+        # Досчитывает SimHash постов, сохранённых до появления колонки, и перестраивает
+        # полосы, если simhash_max_distance поменялся
+        bands = config.simhash_max_distance + 1
+        with self._lock:
+            conn = self._get_conn()
+            layout = conn.execute('SELECT MAX(band) FROM simhash_bands').fetchone()[0]
+            if layout is not None and layout != bands - 1:
+                conn.execute('DELETE FROM simhash_bands')
+                self._insert_bands(conn, conn.execute(
+                    'SELECT id, simhash FROM posted_articles WHERE simhash IS NOT NULL'
+                ).fetchall())
+                logger.info(f"🔢 Полосы SimHash перестроены: {bands}")
+            missing = conn.execute(
+                'SELECT id, title, summary FROM posted_articles WHERE simhash IS NULL'
+            ).fetchall()
+            if missing:
+                rows = [(r[0], to_sqlite_int(summary_simhash(r[1], r[2] or ""))) for r in missing]
+                conn.executemany('UPDATE posted_articles SET simhash = ? WHERE id = ?',
+                                 [(fingerprint, post_id) for post_id, fingerprint in rows])
+                self._insert_bands(conn, rows)
+                logger.info(f"🔢 SimHash досчитан для {len(missing)} постов")
+            conn.commit()
+
+    def simhash_sql(self, values_per_band: int) -> str:
+        branch = self.SIMHASH_BRANCH_SQL.format(", ".join("?" * values_per_band))
+        return " UNION ALL ".join([branch] * (config.simhash_max_distance + 1))
+
+    def _near_simhashes(self, conn: sqlite3.Connection, fingerprints: List[int]) -> List[Optional[Tuple[int, str]]]:
+        # Несколько индексных поисков по полосам вместо прохода по истории; кандидаты
+        # добиваются точным расстоянием. Ответ — (расстояние, заголовок) ближайшего или None
+        found: List[Optional[Tuple[int, str]]] = [None] * len(fingerprints)
+        queries = [fp for fp in fingerprints if fp]
+        if not queries:
+            return found
+        bands = config.simhash_max_distance + 1
+        per_band = [[] for _ in range(bands)]
+        for fingerprint in queries:
+            for band, value in simhash_bands(fingerprint, bands):
+                per_band[band].append(value)
+        params = []
+        for band, values in enumerate(per_band):
+            params.extend((band, *values, f'-{config.retention_days} days'))
+        rows = conn.execute(self.simhash_sql(len(queries)), params).fetchall()
+        for i, fingerprint in enumerate(fingerprints):
+            if not fingerprint:
+                continue
+            for _, stored, title in rows:
+                distance = (fingerprint ^ (stored & ((1 << 64) - 1))).bit_count()
+                if distance <= config.simhash_max_distance and (found[i] is None or distance < found[i][0]):
+                    found[i] = (distance, title)
+        return found
+
+    # ---------- фильтр Блума всех публикаций ----------
+    def _load_bloom(self) -> BloomFilter:
+        # Фильтр переживает очистку по retention_days: ключи из него не удаляются никогда.
+        # Сохранённые параметры важнее config — иначе пришлось бы забыть уже удалённые посты
+        with self._lock:
+            row = self._get_conn().execute(
+                'SELECT bits, hashes, items FROM bloom_filters WHERE name = ?', ("posted",)
+            ).fetchone()
+        if row is None:
+            return BloomFilter(config.bloom_size_bytes, config.bloom_false_positive_rate)
+        bloom = BloomFilter(config.bloom_size_bytes, config.bloom_false_positive_rate,
+                            zlib.decompress(row[0]), row[1], row[2])
+        if (len(bloom.bits) != config.bloom_size_bytes
+                or bloom.hashes != BloomFilter.hashes_for(config.bloom_false_positive_rate)):
+            logger.warning(
+                f"🌸 [{self.profile.name}] Фильтр Блума создан с другими параметрами "
+                f"({len(bloom.bits) // 1024} KB, k={bloom.hashes}); новые применятся после удаления bloom_filters"
+            )
+        return bloom
+
+    def _sync_bloom(self, conn: sqlite3.Connection):
+        # Догоняет посты, вставленные после прошлой синхронизации (в том числе другими
+        # запусками): id из AUTOINCREMENT не переиспользуются, поэтому хватает id > последнего
+        rows = conn.execute(self.BLOOM_SYNC_SQL, (self._bloom_seen_id,)).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            for post_id, norm_url, content_hash in rows:
+                self._bloom.add(norm_url)
+                if content_hash:
+                    self._bloom.add(content_hash)
+            self._bloom_seen_id = max(self._bloom_seen_id, rows[-1][0])
+
+    def _save_bloom(self):
+        with self._lock:
+            conn = self._get_conn()
+            row = conn.execute('SELECT bits FROM bloom_filters WHERE name = ?', ("posted",)).fetchone()
+            if row is not None:
+                stored = zlib.decompress(row[0])
+                if len(stored) == len(self._bloom.bits):
+                    self._bloom.merge(stored)
+            conn.execute(
+                'INSERT OR REPLACE INTO bloom_filters (name, bits, hashes, items, updated_at) '
+                'VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)',
+                ("posted", zlib.compress(bytes(self._bloom.bits)), self._bloom.hashes, self._bloom.items)
+            )
+            conn.commit()
+
     def _add_rejected(self, norm_url: str, title: str, reason: str):
         pass
 
@@ -587,8 +1621,8 @@ class PostedManager:
         return False, ""
 
     def get_subject_posts_in_window(self, subject: str, hours: int) -> List[dict]:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('''
                 SELECT title, posted_date, title_normalized, entities
                 FROM posted_articles
@@ -606,9 +1640,36 @@ class PostedManager:
                 })
             return results
 
+    @staticmethod
+    def subject_window_sql(subjects: int) -> str:
+        return f'''
+            SELECT subject, title, posted_date, title_normalized, entities
+            FROM posted_articles
+            WHERE subject IN ({", ".join("?" * subjects)})
+              AND posted_date > datetime('now', ?)
+            ORDER BY posted_date DESC
+        '''
+
+    def get_subject_windows(self, subjects: Set[str], hours: int) -> Dict[str, List[dict]]:
+        # Окна сразу для нескольких тем — один запрос вместо запроса на каждую статью
+        result: Dict[str, List[dict]] = {subject: [] for subject in subjects}
+        if not subjects:
+            return result
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.subject_window_sql(len(subjects)), (*subjects, f'-{hours} hours'))
+            for r in cursor.fetchall():
+                result[r[0]].append({
+                    'title': r[1],
+                    'date': r[2],
+                    'normalized': r[3],
+                    'entities': r[4]
+                })
+            return result
+
     def get_subject_stats_cached(self, hours: int = 24) -> Dict[str, List[dict]]:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('''
                 SELECT subject, title, posted_date, title_normalized
                 FROM posted_articles
@@ -625,8 +1686,8 @@ class PostedManager:
             return dict(result)
 
     def get_last_n_subjects(self, n: int = 5) -> List[str]:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('''
                 SELECT subject FROM posted_articles
                 ORDER BY posted_date DESC
@@ -645,8 +1706,13 @@ class PostedManager:
     ) -> Tuple[bool, str]:
         if subject == "other":
             return True, ""
+        return self._subject_verdict(
+            subject, new_title, self.get_subject_posts_in_window(subject, config.subject_window_hours)
+        )
 
-        recent_posts = self.get_subject_posts_in_window(subject, config.subject_window_hours)
+    def _subject_verdict(self, subject: str, new_title: str, recent_posts: List[dict]) -> Tuple[bool, str]:
+        if subject == "other":
+            return True, ""
 
         if len(recent_posts) >= config.max_posts_per_subject:
             return (
@@ -674,172 +1740,420 @@ class PostedManager:
         return True, ""
 
     def is_duplicate(self, url: str, title: str, summary: str = "") -> DuplicateCheckResult:
-        result = DuplicateCheckResult(is_duplicate=False, reasons=[])
-        with self._lock:
-            conn = self._get_conn()
-            cursor = conn.cursor()
-            norm_url = normalize_url(url)
-            title_normalized = normalize_title(title)
-            title_words = set(get_title_words(title))
-            content_hash = get_content_hash(f"{title} {summary}")
-            domain = get_domain(url)
-
-            cursor.execute(
-                'SELECT title FROM posted_articles WHERE norm_url = ? '
-                'AND posted_date > datetime("now", ?)',
-                (norm_url, f'-{config.retention_days} days')
-            )
-            row = cursor.fetchone()
-            if row:
-                result.add_reason("URL_EXACT", 1.0, row[0])
-                return result
-
-            if content_hash:
-                cursor.execute(
-                    'SELECT title FROM posted_articles WHERE content_hash = ? '
-                    'AND posted_date > datetime("now", ?)',
-                    (content_hash, f'-{config.retention_days} days')
+        return self.check_duplicates([(url, title, summary)])[0]
+
+    def _get_history(self) -> HistoryIndex:
+        cursor = self._get_conn().cursor()
+        cursor.execute(self.HISTORY_VERSION_SQL, (f'-{config.retention_days} days',))
+        version = tuple(cursor.fetchone())
+        if self._history is None or self._history.version != version:
+            cursor.execute(self.HISTORY_SQL, (f'-{config.retention_days} days',))
+            self._history = HistoryIndex(cursor.fetchall(), version)
+            if self._history.missing_vectors:
+                cursor.executemany(
+                    'UPDATE posted_articles SET content_vector = ? WHERE id = ?',
+                    [(blob, post_id) for post_id, blob in self._history.missing_vectors]
                 )
-                row = cursor.fetchone()
-                if row:
-                    result.add_reason("CONTENT_HASH", 1.0, row[0])
-                    return result
-
-            cursor.execute(
-                'SELECT title FROM posted_articles WHERE title_normalized = ? '
-                'AND posted_date > datetime("now", ?)',
-                (title_normalized, f'-{config.retention_days} days')
-            )
-            row = cursor.fetchone()
-            if row:
-                result.add_reason("TITLE_EXACT", 1.0, row[0])
-                return result
-
-            cursor.execute('''
-                SELECT id, title, title_normalized, title_words, domain
-                FROM posted_articles
-                WHERE posted_date > datetime('now', ?)
-            ''', (f'-{config.retention_days} days',))
-            all_posts = cursor.fetchall()
-
-            for row in all_posts:
-                existing_id, existing_title, existing_normalized, existing_words_json, existing_domain = row
-
-                seq_sim = calculate_similarity(title_normalized, existing_normalized or "")
-                if seq_sim > config.title_similarity_threshold:
-                    result.add_reason(f"TITLE_SIM ({seq_sim:.0%})", seq_sim, existing_title)
+                self._get_conn().commit()
+                logger.info(f"🧮 Досчитаны векторы содержания: {len(self._history.missing_vectors)}")
+                self._history.missing_vectors = []
+        return self._history
 
-                ngram_sim = ngram_similarity(title, existing_title)
-                if ngram_sim > config.ngram_similarity_threshold:
-                    result.add_reason(f"NGRAM ({ngram_sim:.0%})", ngram_sim, existing_title)
+    def content_idf(self) -> np.ndarray:
+        with self._lock:
+            return self._get_history().idf
+
+    @classmethod
+    def exact_match_sql(cls, counts: Tuple[int, ...]) -> str:
+        # Все виды точных совпадений для пачки — один запрос; каждая ветка читает только
+        # составной индекс (ключ, posted_date, title)
+        return " UNION ALL ".join(
+            f"SELECT '{kind}', {column}, title FROM posted_articles "
+            f"WHERE {column} IN ({', '.join('?' * count)}) AND posted_date > datetime('now', ?)"
+            for (kind, column), count in zip(cls.EXACT_KINDS, counts)
+        )
 
-                existing_words = set(safe_json_loads(existing_words_json, []))
-                if existing_words:
-                    jaccard = jaccard_similarity(title_words, existing_words)
-                    if jaccard > config.jaccard_threshold:
-                        result.add_reason(f"JACCARD ({jaccard:.0%})", jaccard, existing_title)
+    def check_duplicates(self, items: List[Tuple[str, str, str]]) -> List[DuplicateCheckResult]:
+        # Точные совпадения — одним запросом по индексам, похожие заголовки — пачкой против всей истории
+        results = [DuplicateCheckResult(is_duplicate=False, reasons=[]) for _ in items]
+        analyzed = [(normalize_url(url), text_normalizer.analyze(title, summary)) for url, title, summary in items]
+        window = f'-{config.retention_days} days'
+        with self._reader() as conn:
+            # Всё, что есть в posted_articles, есть и в фильтре Блума, поэтому ключи, которых
+            # нет в фильтре, в запросы не идут. Попадание фильтра — только кандидат: оно
+            # подтверждается точным запросом к posted_articles или, для постов старше
+            # retention_days, к posted_keys
+            self._sync_bloom(conn)
+            with self._lock:
+                seen = [
+                    (norm_url in self._bloom, bool(tokens.content_hash) and tokens.content_hash in self._bloom)
+                    for norm_url, tokens in analyzed
+                ]
+            keys = (
+                list({norm_url for (norm_url, _), (url_seen, _) in zip(analyzed, seen) if url_seen}),
+                list({tokens.content_hash for (_, tokens), (_, hash_seen) in zip(analyzed, seen) if hash_seen}),
+                list({tokens.normalized for _, tokens in analyzed}),
+            )
+            rows = conn.execute(
+                self.exact_match_sql(tuple(len(group) for group in keys)),
+                [param for group in keys for param in (*group, window)]
+            ).fetchall()
+            seen_keys = keys[0] + keys[1]
+            if seen_keys:
+                rows += conn.execute(self.SEEN_KEYS_SQL.format(", ".join("?" * len(seen_keys))), seen_keys).fetchall()
+        matches: Dict[Tuple[str, str], str] = {}
+        for kind, key, title in rows:
+            matches.setdefault((kind, key), title)
+
+        fuzzy: List[Tuple[TextTokens, str, np.ndarray]] = []
+        fuzzy_results: List[DuplicateCheckResult] = []
+        near_items: List[Tuple[str, str]] = []
+        for (url, title, summary), (norm_url, tokens), result in zip(items, analyzed, results):
+            for kind, key in zip((*(kind for kind, _ in self.EXACT_KINDS), "URL_SEEN", "CONTENT_SEEN"),
+                                 (norm_url, tokens.content_hash, tokens.normalized, norm_url, tokens.content_hash)):
+                matched = matches.get((kind, key)) if key else None
+                if matched is not None:
+                    result.add_reason(kind, 1.0, matched)
+                    break
+            else:
+                fuzzy.append((tokens, get_domain(url), content_vector(title, summary)))
+                fuzzy_results.append(result)
+                near_items.append((title, summary))
+
+        # Почти те же тексты (SimHash в пределах simhash_max_distance бит) — по полосам в БД,
+        # до сравнения со всей историей
+        if near_items:
+            with self._reader() as conn:
+                near = self._near_simhashes(conn, [summary_simhash(t, s) for t, s in near_items])
+            kept = [i for i, match in enumerate(near) if match is None]
+            for match, result in zip(near, fuzzy_results):
+                if match is not None:
+                    distance, matched_title = match
+                    result.add_reason(f"SIMHASH ({distance} bit)", 1 - distance / 64, matched_title)
+            fuzzy = [fuzzy[i] for i in kept]
+            fuzzy_results = [fuzzy_results[i] for i in kept]
+
+        if fuzzy:
+            with self._lock:
+                self._get_history().check(fuzzy, fuzzy_results)
+        return results
+
+    def _recent_sources_topics(self) -> List[Tuple[str, str]]:
+        # Последние посты для ротации источников и разнообразия тем — одним запросом
+        rules = self.profile
+        limit = max(rules.rule("rotation_history_size"), rules.rule("diversity_window"))
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.RECENT_SQL, (f'-{config.retention_days} days', limit))
+            return [(row[0], row[1]) for row in cursor.fetchall()]
 
-                if domain == existing_domain:
-                    same_sim = calculate_similarity(title_normalized, existing_normalized or "")
-                    if same_sim > config.same_domain_similarity:
-                        result.add_reason(f"SAME_DOMAIN ({same_sim:.0%})", same_sim, existing_title)
+    def check_diversity(self, topic: str, source: str = "") -> Tuple[bool, str]:
+        return self._diversity_verdict(topic, source, self._recent_sources_topics())
 
-            return result
+    def _diversity_verdict(self, topic: str, source: str, recent: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        rules = self.profile
+        if source:
+            recent_sources = [row[0] for row in recent[:rules.rule("rotation_history_size")]]
+            min_between = rules.rule("source_min_posts_between")
+            last_few = recent_sources[:min_between]
 
-    def check_diversity(self, topic: str, source: str = "") -> Tuple[bool, str]:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+            if source in last_few:
+                pos = last_few.index(source) + 1
+                return (
+                    False,
+                    f"SOURCE_TOO_RECENT ({source} был {pos}-м из последних "
+                    f"{min_between})"
+                )
 
-            if source:
-                cursor.execute(
-                    'SELECT source FROM posted_articles ORDER BY posted_date DESC LIMIT ?',
-                    (config.rotation_history_size,)
+            source_count = sum(1 for s in recent_sources if s == source)
+            max_in_window = rules.rule("source_max_in_window")
+            if source_count >= max_in_window:
+                return (
+                    False,
+                    f"SOURCE_LIMIT ({source}: {source_count}/{max_in_window} "
+                    f"за последние {rules.rule('rotation_history_size')})"
                 )
-                recent_sources = [row[0] for row in cursor.fetchall()]
-                last_few = recent_sources[:config.source_min_posts_between]
-
-                if source in last_few:
-                    pos = last_few.index(source) + 1
-                    return (
-                        False,
-                        f"SOURCE_TOO_RECENT ({source} был {pos}-м из последних "
-                        f"{config.source_min_posts_between})"
-                    )
 
-                source_count = sum(1 for s in recent_sources if s == source)
-                if source_count >= config.source_max_in_window:
-                    return (
-                        False,
-                        f"SOURCE_LIMIT ({source}: {source_count}/{config.source_max_in_window} "
-                        f"за последние {config.rotation_history_size})"
-                    )
+        if topic == Topic.GENERAL:
+            return True, ""
 
-            if topic == Topic.GENERAL:
-                return True, ""
+        diversity_window = rules.rule("diversity_window")
+        recent_topics = [row[1] for row in recent[:diversity_window]]
+        if not recent_topics:
+            return True, ""
 
-            cursor.execute(
-                'SELECT topic FROM posted_articles ORDER BY posted_date DESC LIMIT ?',
-                (config.diversity_window,)
-            )
-            recent_topics = [row[0] for row in cursor.fetchall()]
-            if not recent_topics:
-                return True, ""
+        same_count = sum(1 for t in recent_topics if t == topic)
+        if same_count >= rules.rule("same_topic_limit"):
+            return False, f"TOO_MANY: {same_count}/{diversity_window} = {topic}"
 
-            same_count = sum(1 for t in recent_topics if t == topic)
-            if same_count >= config.same_topic_limit:
-                return False, f"TOO_MANY: {same_count}/{config.diversity_window} = {topic}"
+        return True, ""
 
-            return True, ""
+    def screen_candidates(self, articles: List[Article]) -> List[CandidateScreen]:
+        # Все проверки окна сюжетов за один заход в пул: окна тем и последние посты
+        # читаются по разу на окно, дубли — пачкой
+        topics = [get_features(a).topic for a in articles]
+        windows = self.get_subject_windows(set(topics) - {"other"}, config.subject_window_hours)
+        recent = self._recent_sources_topics()
+        duplicates = self.check_duplicates([(a.link, a.title, a.summary) for a in articles])
+        return [
+            CandidateScreen(
+                subject=self._subject_verdict(topic, a.title, windows.get(topic, [])),
+                duplicate=dup,
+                diversity=self._diversity_verdict(topic, a.source, recent),
+            )
+            for a, topic, dup in zip(articles, topics, duplicates)
+        ]
+
+    def _insert_posted(self, conn: sqlite3.Connection, article: Article, topic: str, subject: str) -> int:
+        # Без commit: вызывающий решает, что ещё входит в транзакцию
+        tokens = text_normalizer.analyze(article.title, article.summary)
+        fingerprint = summary_simhash(article.title, article.summary)
+        cursor = conn.execute('''
+            INSERT INTO posted_articles
+            (url, norm_url, domain, title, title_normalized, title_words,
+             title_word_signature, summary, content_hash, entities, topic, subject, source,
+             content_vector, simhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            article.link, normalize_url(article.link), get_domain(article.link), article.title,
+            tokens.normalized, json.dumps(list(tokens.words)), tokens.signature, article.summary[:1000],
+            tokens.content_hash, json.dumps([]), topic, subject, article.source,
+            content_vector(article.title, article.summary).tobytes(), to_sqlite_int(fingerprint)
+        ))
+        post_id = cursor.lastrowid
+        self._insert_bands(conn, [(post_id, fingerprint)])
+        return post_id
 
     def add(self, article: Article, topic: str = Topic.GENERAL, subject: str = "other") -> bool:
         with self._lock:
             conn = self._get_conn()
-            cursor = conn.cursor()
-            norm_url = normalize_url(article.link)
-            domain_val = get_domain(article.link)
-            title_normalized = normalize_title(article.title)
-            title_words = list(get_title_words(article.title))
-            word_signature = get_sorted_word_signature(article.title)
-            content_hash = get_content_hash(f"{article.title} {article.summary}")
             try:
-                cursor.execute('''
-                    INSERT INTO posted_articles
-                    (url, norm_url, domain, title, title_normalized, title_words,
-                     title_word_signature, summary, content_hash, entities, topic, subject, source)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    article.link, norm_url, domain_val, article.title, title_normalized,
-                    json.dumps(title_words), word_signature, article.summary[:1000],
-                    content_hash, json.dumps([]), topic, subject, article.source
-                ))
+                post_id = self._insert_posted(conn, article, topic, subject)
                 conn.commit()
-                cursor.execute('SELECT id FROM posted_articles WHERE norm_url = ?', (norm_url,))
-                saved = cursor.fetchone()
-                if saved:
-                    logger.info(f"💾 Сохранено (ID={saved[0]}, topic={topic}): {article.title[:50]}...")
-                    return True
-                else:
-                    logger.error(f"❌ Не сохранено: {article.title[:50]}")
-                    return False
+                logger.info(f"💾 Сохранено (ID={post_id}, topic={topic}): {article.title[:50]}...")
+                return True
             except sqlite3.IntegrityError:
+                conn.rollback()
                 logger.warning(f"⚠️ Уже существует: {article.title[:40]}")
                 return False
             except Exception as e:
+                conn.rollback()
                 logger.error(f"❌ Ошибка сохранения: {e}")
                 return False
 
-    def log_rejected(self, article: Article, reason: str):
-        logger.info(f"🚫 [{reason}]: {article.title[:50]}")
-
-    def get_recent_posts(self, limit: int = 5) -> List[dict]:
+    # ---------- очередь готовых постов ----------
+    def enqueue_post(self, article: Article, text: str, topic: str) -> bool:
         with self._lock:
-            cursor = self._get_conn().cursor()
+            conn = self._get_conn()
+            try:
+                conn.execute('''
+                    INSERT INTO publish_queue
+                    (norm_url, url, title, summary, source, published, topic, post_text)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    normalize_url(article.link), article.link, article.title,
+                    article.summary[:config.stored_summary_length], article.source, article.published.isoformat(),
+                    topic, text
+                ))
+                conn.commit()
+                logger.info(f"📥 В очередь [{self.profile.name}]: {article.title[:50]}")
+                return True
+            except sqlite3.IntegrityError:
+                logger.info(f"⚠️ Уже в очереди: {article.title[:40]}")
+                return False
+
+    def get_queued_posts(self) -> List[dict]:
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('''
-                SELECT title, topic, source, posted_date, subject
-                FROM posted_articles
-                ORDER BY posted_date DESC
-                LIMIT ?
-            ''', (limit,))
+                SELECT id, url, title, summary, source, published, topic, post_text, prepared_at
+                FROM publish_queue
+                ORDER BY prepared_at ASC, id ASC
+            ''')
+            results = []
+            for r in cursor.fetchall():
+                article = Article(
+                    title=r[2], summary=r[3] or "", link=r[1], source=r[4] or "",
+                    published=parse_db_datetime(r[5] or ""),
+                )
+                results.append({
+                    'id': r[0], 'article': article, 'topic': r[6],
+                    'text': r[7], 'prepared_at': r[8]
+                })
+            return results
+
+    def get_queued_urls(self) -> Set[str]:
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT norm_url FROM publish_queue')
+            return {row[0] for row in cursor.fetchall()}
+
+    def queue_size(self) -> int:
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM publish_queue')
+            return cursor.fetchone()[0]
+
+    def remove_queued(self, item_id: int):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('DELETE FROM publish_queue WHERE id = ?', (item_id,))
+            conn.commit()
+
+    def evict_stale_queue(self, max_age_hours: int) -> int:
+        with self._lock:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM publish_queue WHERE prepared_at < datetime('now', ?)",
+                (f'-{max_age_hours} hours',)
+            )
+            evicted = cursor.rowcount
+            conn.commit()
+            if evicted:
+                logger.info(f"🧹 Очередь [{self.profile.name}]: вытеснено устаревших {evicted}")
+            return evicted
+
+    # ---------- outbox доставки ----------
+    def outbox_add(self, article: Article, text: str, topic: str) -> int:
+        with self._lock:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO outbox
+                (chat_id, url, title, summary, source, published, topic, post_text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                self.profile.channel_id, article.link, article.title, article.summary[:config.stored_summary_length],
+                article.source, article.published.isoformat(), topic, text
+            ))
+            conn.commit()
+            return cursor.lastrowid
+
+    def get_outbox(self, due_only: bool = True) -> List[dict]:
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            query = '''
+                SELECT id, url, title, summary, source, published, topic, post_text, attempts
+                FROM outbox
+                WHERE status = 'pending' AND chat_id = ?
+            '''
+            if due_only:
+                query += " AND next_attempt_at <= datetime('now')"
+            cursor.execute(query + ' ORDER BY id ASC', (self.profile.channel_id,))
+            results = []
+            for r in cursor.fetchall():
+                article = Article(
+                    title=r[2], summary=r[3] or "", link=r[1], source=r[4] or "",
+                    published=parse_db_datetime(r[5] or ""),
+                )
+                results.append({
+                    'id': r[0], 'article': article, 'topic': r[6],
+                    'text': r[7], 'attempts': r[8]
+                })
+            return results
+
+    def outbox_expire(self) -> int:
+        # Пост, который слишком долго не уходил, уже не новость
+        with self._lock:
+            conn = self._get_conn()
+            cursor = conn.execute('''
+                UPDATE outbox
+                SET status = 'failed',
+                    last_error = 'EXPIRED: ' || COALESCE(last_error, '')
+                WHERE status = 'pending' AND chat_id = ?
+                  AND (attempts >= ? OR created_at < datetime('now', ?))
+            ''', (self.profile.channel_id, config.outbox_max_attempts,
+                  f'-{config.outbox_max_age_hours} hours'))
+            conn.commit()
+            return cursor.rowcount
+
+    def outbox_reconcile(self) -> Tuple[int, int]:
+        # «sending» после перезапуска: процесс упал между вызовом API и записью в историю.
+        # Пост в posted_articles — доставлен; иначе исход неизвестен, повторно не шлём
+        with self._lock:
+            conn = self._get_conn()
+            rows = conn.execute(
+                "SELECT id, url FROM outbox WHERE status = 'sending' AND chat_id = ?",
+                (self.profile.channel_id,)
+            ).fetchall()
+            confirmed = [
+                (item_id,) for item_id, url in rows
+                if conn.execute('SELECT 1 FROM posted_articles WHERE norm_url = ?',
+                                (normalize_url(url),)).fetchone()
+            ]
+            conn.executemany('DELETE FROM outbox WHERE id = ?', confirmed)
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = 'SEND_UNCONFIRMED' "
+                "WHERE status = 'sending' AND chat_id = ?",
+                (self.profile.channel_id,)
+            )
+            conn.commit()
+            return len(confirmed), len(rows) - len(confirmed)
+
+    def outbox_claim(self, item_id: int) -> bool:
+        with self._lock:
+            conn = self._get_conn()
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'sending' WHERE id = ? AND status = 'pending'", (item_id,)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def outbox_sent(self, item_id: int, article: Article, topic: str, subject: str) -> bool:
+        # Запись в историю и удаление из outbox — одна транзакция сразу после отправки
+        with self._lock:
+            conn = self._get_conn()
+            post_id = None
+            try:
+                try:
+                    post_id = self._insert_posted(conn, article, topic, subject)
+                except sqlite3.IntegrityError:
+                    logger.warning(f"⚠️ Уже существует: {article.title[:40]}")
+                conn.execute('DELETE FROM outbox WHERE id = ?', (item_id,))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"❌ Ошибка сохранения: {e}")
+                return False
+            if post_id is not None:
+                logger.info(f"💾 Сохранено (ID={post_id}, topic={topic}): {article.title[:50]}...")
+            return post_id is not None
+
+    def outbox_defer(self, item_id: int, retry_in: float, error: str):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('''
+                UPDATE outbox
+                SET status = 'pending', attempts = attempts + 1, last_error = ?,
+                    next_attempt_at = datetime('now', ?)
+                WHERE id = ?
+            ''', (error[:500], f'+{int(retry_in)} seconds', item_id))
+            conn.commit()
+
+    def outbox_fail(self, item_id: int, error: str):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (error[:500], item_id)
+            )
+            conn.commit()
+
+    def log_rejected(self, article: Article, reason: str):
+        # Вид решения — код причины до скобок/двоеточия: TITLE_SIM, FINAL_DUP, GENERATION_FAILED…
+        kind = re.split(r'[\s:(]', reason, 1)[0] or "REJECTED"
+        decisions(kind, article, channel=self.profile.name, reason=reason)
+
+    def get_recent_posts(self, limit: int = 5) -> List[dict]:
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT title, topic, source, posted_date, subject
+                FROM posted_articles
+                ORDER BY posted_date DESC
+                LIMIT ?
+            ''', (limit,))
             results = []
             for r in cursor.fetchall():
                 results.append({
@@ -849,8 +2163,8 @@ class PostedManager:
             return results
 
     def get_last_topic(self) -> Optional[str]:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('SELECT topic FROM posted_articles ORDER BY posted_date DESC LIMIT 1')
             row = cursor.fetchone()
             return row[0] if row else None
@@ -858,24 +2172,68 @@ class PostedManager:
     def cleanup(self, days: int = 90):
         with self._lock:
             conn = self._get_conn()
+            # Удаляемые посты сначала попадают в фильтр Блума и на диск
+            self._sync_bloom(conn)
+            self._save_bloom()
             cursor = conn.cursor()
+            cursor.execute(
+                f"DELETE FROM simhash_bands WHERE post_id IN (SELECT id FROM posted_articles "
+                f"WHERE posted_date < datetime('now', '-{days} days'))"
+            )
             cursor.execute(
                 f"DELETE FROM posted_articles WHERE posted_date < datetime('now', '-{days} days')"
             )
             deleted_posted = cursor.rowcount
+            cursor.execute(
+                f"DELETE FROM outbox WHERE status = 'failed' AND created_at < datetime('now', '-{days} days')"
+            )
             cursor.execute("DELETE FROM rejected_urls")
             deleted_rejected = cursor.rowcount
             conn.commit()
             logger.info(f"🧹 Очищено: {deleted_posted} posted, {deleted_rejected} rejected (вся таблица)")
 
     def get_stats(self) -> dict:
-        with self._lock:
-            cursor = self._get_conn().cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM posted_articles')
             total = cursor.fetchone()[0]
             cursor.execute('SELECT COUNT(*) FROM rejected_urls')
             rejected = cursor.fetchone()[0]
-            return {'total_posted': total, 'total_rejected': rejected}
+        with self._lock:
+            bloom = self._bloom.stats()
+        return {'total_posted': total, 'total_rejected': rejected, 'bloom': bloom}
+
+    def full_scans(self) -> Dict[str, List[str]]:
+        # EXPLAIN QUERY PLAN горячих запросов: проход по всей таблице без индекса —
+        # регрессия индексов. Параметры — заглушки, план от значений не зависит
+        window = f'-{config.retention_days} days'
+        hot_queries = {
+            "exact_match": (self.exact_match_sql((2, 2, 2)), ("", "", window) * 3),
+            "subject_window": (self.subject_window_sql(2), ("", "", f'-{config.subject_window_hours} hours')),
+            "history_version": (self.HISTORY_VERSION_SQL, (window,)),
+            "history": (self.HISTORY_SQL, (window,)),
+            "recent": (self.RECENT_SQL, (window, config.rotation_history_size)),
+            "bloom_sync": (self.BLOOM_SYNC_SQL, (0,)),
+            "seen_keys": (self.SEEN_KEYS_SQL.format("?, ?"), ("", "")),
+            "simhash": (self.simhash_sql(2), (0, 0, 0, window) * (config.simhash_max_distance + 1)),
+            "search": (self.SEARCH_SQL, ("x", window, 20)),
+        }
+        scans: Dict[str, List[str]] = {}
+        # Отдельное соединение: закэшированный EXPLAIN не видит смены схемы и отдаёт старый план
+        conn = self._connect()
+        try:
+            for name, (sql, params) in hot_queries.items():
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+                bad = [detail for detail in plan if self.FULL_SCAN_RE.match(detail)]
+                bad += [
+                    f"нет {expected}" for expected in self.EXPECTED_PLANS.get(name, ())
+                    if not any(detail.endswith(expected) for detail in plan)
+                ]
+                if bad:
+                    scans[name] = bad
+        finally:
+            conn.close()
+        return scans
 
     def verify_db(self) -> bool:
         with self._lock:
@@ -887,8 +2245,19 @@ class PostedManager:
                 return False
 
     def close(self):
+        self.executor.shutdown(wait=True)
         with self._lock:
-            conn = getattr(self._local, 'conn', None)
+            try:
+                with self._reader() as reader:
+                    self._sync_bloom(reader)
+                self._save_bloom()
+            except Exception as e:
+                logger.error(f"❌ Не удалось сохранить фильтр Блума: {e}")
+            for reader in self._reader_conns:
+                reader.close()
+            self._reader_conns = []
+            self._readers = queue.SimpleQueue()
+            conn = self._conn
             if conn:
                 try:
                     conn.commit()
@@ -897,52 +2266,997 @@ class PostedManager:
                 except Exception as e:
                     logger.error(f"❌ Ошибка закрытия БД: {e}")
                 finally:
-                    self._local.conn = None
+                    self._conn = None
+
+
+class AsyncPostedManager:
+    # Асинхронный фасад над PostedManager: SQLite работает в пуле потоков канала,
+    # а event loop тем временем качает ленты, ждёт LLM и Telegram
+    def __init__(self, db: PostedManager):
+        self.db = db
+        self.profile = db.profile
+
+    async def _run(self, method: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db.executor, partial(method, *args))
+
+    def log_rejected(self, article: Article, reason: str):
+        self.db.log_rejected(article, reason)
+
+    async def verify_db(self) -> bool:
+        return await self._run(self.db.verify_db)
+
+    async def full_scans(self) -> Dict[str, List[str]]:
+        return await self._run(self.db.full_scans)
+
+    async def cleanup(self, days: int = 90):
+        await self._run(self.db.cleanup, days)
+
+    async def get_stats(self) -> dict:
+        return await self._run(self.db.get_stats)
+
+    async def get_recent_posts(self, limit: int = 5) -> List[dict]:
+        return await self._run(self.db.get_recent_posts, limit)
+
+    async def content_idf(self) -> np.ndarray:
+        return await self._run(self.db.content_idf)
+
+    async def screen_candidates(self, articles: List[Article]) -> List[CandidateScreen]:
+        return await self._run(self.db.screen_candidates, articles)
+
+    async def is_duplicate(self, url: str, title: str, summary: str = "") -> DuplicateCheckResult:
+        return await self._run(self.db.is_duplicate, url, title, summary)
+
+    async def add(self, article: Article, topic: str = Topic.GENERAL, subject: str = "other") -> bool:
+        return await self._run(self.db.add, article, topic, subject)
+
+    async def enqueue_post(self, article: Article, text: str, topic: str) -> bool:
+        return await self._run(self.db.enqueue_post, article, text, topic)
+
+    async def get_queued_posts(self) -> List[dict]:
+        return await self._run(self.db.get_queued_posts)
+
+    async def get_queued_urls(self) -> Set[str]:
+        return await self._run(self.db.get_queued_urls)
+
+    async def queue_size(self) -> int:
+        return await self._run(self.db.queue_size)
+
+    async def remove_queued(self, item_id: int):
+        await self._run(self.db.remove_queued, item_id)
+
+    async def evict_stale_queue(self, max_age_hours: int) -> int:
+        return await self._run(self.db.evict_stale_queue, max_age_hours)
+
+    async def outbox_add(self, article: Article, text: str, topic: str) -> int:
+        return await self._run(self.db.outbox_add, article, text, topic)
+
+    async def get_outbox(self, due_only: bool = True) -> List[dict]:
+        return await self._run(self.db.get_outbox, due_only)
+
+    async def outbox_expire(self) -> int:
+        return await self._run(self.db.outbox_expire)
+
+    async def outbox_reconcile(self) -> Tuple[int, int]:
+        return await self._run(self.db.outbox_reconcile)
+
+    async def outbox_claim(self, item_id: int) -> bool:
+        return await self._run(self.db.outbox_claim, item_id)
+
+    async def outbox_sent(self, item_id: int, article: Article, topic: str, subject: str) -> bool:
+        return await self._run(self.db.outbox_sent, item_id, article, topic, subject)
+
+    async def outbox_defer(self, item_id: int, retry_in: float, error: str):
+        await self._run(self.db.outbox_defer, item_id, retry_in, error)
+
+    async def outbox_fail(self, item_id: int, error: str):
+        await self._run(self.db.outbox_fail, item_id, error)
+
+    def close(self):
+        self.db.close()
+
+
+# ====================== СТАТИСТИКА И РАСПИСАНИЕ ЛЕНТ ======================
+@dataclass
+class FeedResult:
+    url: str
+    source: str
+    articles: List[Article] = field(default_factory=list)
+    ok: bool = False
+    error: str = ""
+    latency: float = 0.0
+    parse_time: float = 0.0
+    wire_bytes: int = 0
+    body_bytes: int = 0
+    peak_memory: int = 0
+    stopped_early: bool = False
+    truncated: bool = False
+    content_type: str = ""
+    body_sha: str = ""
+
+
+class FeedScheduler:
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._conns: List[sqlite3.Connection] = []
+        self._stats: Dict[str, dict] = {}
+        # feed_stats живёт в общей БД: запись ждёт busy_timeout в этом потоке, а не в event loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feed-stats")
+        self._init_db()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conn') or self._local.conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30.0, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return self._local.conn
+
+    def _init_db(self):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS feed_stats (
+                    source TEXT PRIMARY KEY,
+                    url TEXT,
+                    polls INTEGER DEFAULT 0,
+                    failures INTEGER DEFAULT 0,
+                    entries_total INTEGER DEFAULT 0,
+                    new_total INTEGER DEFAULT 0,
+                    accepted_total INTEGER DEFAULT 0,
+                    new_rate REAL DEFAULT 0,
+                    accept_rate REAL DEFAULT 0,
+                    latency_avg REAL DEFAULT 0,
+                    latency_dev REAL DEFAULT 0,
+                    parse_avg REAL DEFAULT 0,
+                    last_polled REAL,
+                    consecutive_failures INTEGER DEFAULT 0,
+                    circuit_state TEXT DEFAULT 'closed',
+                    opened_at REAL,
+                    trips INTEGER DEFAULT 0
+                )
+            ''')
+            for column in ("latency_dev REAL DEFAULT 0",
+                           "consecutive_failures INTEGER DEFAULT 0",
+                           "circuit_state TEXT DEFAULT 'closed'",
+                           "opened_at REAL",
+                           "trips INTEGER DEFAULT 0",
+                           "parse_avg REAL DEFAULT 0"):
+                try:
+                    conn.execute(f"ALTER TABLE feed_stats ADD COLUMN {column}")
+                except Exception:
+                    pass
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS feed_entries (
+                    source TEXT NOT NULL,
+                    norm_url TEXT NOT NULL,
+                    first_seen REAL NOT NULL,
+                    PRIMARY KEY (source, norm_url)
+                ) WITHOUT ROWID
+            ''')
+            conn.commit()
+
+    def get_stats(self) -> Dict[str, dict]:
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            cursor.execute('''
+                SELECT source, polls, failures, new_rate, accept_rate, latency_avg, last_polled,
+                       latency_dev, consecutive_failures, circuit_state, opened_at, trips, parse_avg
+                FROM feed_stats
+            ''')
+            return {
+                r[0]: {
+                    'polls': r[1], 'failures': r[2], 'new_rate': r[3],
+                    'accept_rate': r[4], 'latency_avg': r[5], 'last_polled': r[6],
+                    'latency_dev': r[7], 'consecutive_failures': r[8],
+                    'circuit_state': r[9] or 'closed', 'opened_at': r[10], 'trips': r[11] or 0,
+                    'parse_avg': r[12] or 0.0,
+                }
+                for r in cursor.fetchall()
+            }
+
+    def breaker_cooldown(self, stats: dict) -> float:
+        minutes = config.breaker_cooldown_minutes * (2 ** max(stats['trips'] - 1, 0))
+        return min(minutes * 60, config.breaker_max_cooldown_hours * 3600)
+
+    def timeout_for(self, source: str) -> float:
+        # Таймаут по истории задержек: среднее + k·отклонение, но не больше http_timeout
+        stats = self._stats.get(source)
+        if not stats:
+            return config.http_timeout
+        if stats['circuit_state'] != 'closed':
+            return min(config.breaker_probe_timeout, config.http_timeout)
+        if stats['polls'] - stats['failures'] < config.poll_min_history:
+            return config.http_timeout
+        timeout = stats['latency_avg'] + config.feed_timeout_deviations * stats['latency_dev']
+        return min(max(timeout, config.feed_min_timeout), config.http_timeout)
+
+    def _set_circuit(self, source: str, state: str):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('UPDATE feed_stats SET circuit_state = ? WHERE source = ?', (state, source))
+            conn.commit()
+
+    def poll_interval_hours(self, stats: dict) -> float:
+        # Ждём, пока лента в среднем накопит хотя бы одну новую запись
+        interval = 1.0 / max(stats['new_rate'], 1e-3)
+        if stats['polls'] >= config.poll_min_history and stats['accept_rate'] < config.poll_low_yield_rate:
+            interval *= config.poll_low_yield_factor
+        if stats['latency_avg'] > config.poll_slow_latency:
+            interval *= 2
+        return min(interval, config.poll_max_interval_hours)
+
+    def estimate_cost(self, feeds: List[Tuple[str, str]]) -> Tuple[int, float]:
+        # Сколько запросов и секунд парсинга стоил бы опрос этих лент
+        # Для лент без истории берём средний парсинг по известным
+        all_stats = self.get_stats()
+        known = [stats['parse_avg'] for stats in all_stats.values() if stats['parse_avg'] > 0]
+        default = sum(known) / len(known) if known else 0.0
+        parse_time = sum(
+            all_stats[source]['parse_avg'] if source in all_stats else default
+            for _, source in feeds
+        )
+        return len(feeds), parse_time
+
+    def select(self, feeds: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        all_stats = self._stats = self.get_stats()
+        now = time.time()
+        selected = []
+        for url, source in feeds:
+            stats = all_stats.get(source)
+            if stats and stats['circuit_state'] != 'closed':
+                cooldown = self.breaker_cooldown(stats)
+                open_for = now - (stats['opened_at'] or 0)
+                if open_for < cooldown:
+                    logger.info(
+                        f"  🔌 CIRCUIT_OPEN {source}: ещё {(cooldown - open_for) / 60:.0f} мин "
+                        f"({stats['consecutive_failures']} ошибок подряд)"
+                    )
+                    continue
+                logger.info(f"  🔌 HALF_OPEN {source}: пробный запрос")
+                self._set_circuit(source, 'half_open')
+                selected.append((url, source))
+                continue
+            if not config.adaptive_polling:
+                selected.append((url, source))
+                continue
+            if (source in PRIMARY_SOURCES or stats is None or stats['last_polled'] is None
+                    or stats['polls'] < config.poll_min_history):
+                selected.append((url, source))
+                continue
+            hours_since = (now - stats['last_polled']) / 3600
+            interval = self.poll_interval_hours(stats)
+            if hours_since >= interval:
+                selected.append((url, source))
+            else:
+                logger.info(
+                    f"  ⏭️ POLL_SKIP {source}: прошло {hours_since:.1f}h < {interval:.1f}h "
+                    f"(new {stats['new_rate']:.2f}/h, accept {stats['accept_rate']:.0%}, "
+                    f"{stats['latency_avg']:.1f}s)"
+                )
+        skipped = len(feeds) - len(selected)
+        if skipped:
+            logger.info(f"🗓️ Опрос: {len(selected)}/{len(feeds)} лент, пропущено {skipped}")
+        return selected
+
+    def record_fetch(self, results: List[FeedResult]):
+        now = time.time()
+        alpha = config.poll_stats_alpha
+        with self._lock:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+            for res in results:
+                cursor.execute('''
+                    SELECT polls, failures, new_rate, latency_avg, last_polled, latency_dev,
+                           consecutive_failures, circuit_state, opened_at, trips, parse_avg
+                    FROM feed_stats WHERE source = ?
+                ''', (res.source,))
+                row = cursor.fetchone()
+                (polls, failures, new_rate, latency_avg, last_polled, latency_dev,
+                 consecutive, state, opened_at, trips, parse_avg) = row if row else (
+                    0, 0, 0.0, 0.0, None, 0.0, 0, 'closed', None, 0, 0.0)
+                parse_avg = parse_avg or 0.0
+
+                new_count = 0
+                if res.ok:
+                    for art in res.articles:
+                        cursor.execute(
+                            'INSERT OR IGNORE INTO feed_entries (source, norm_url, first_seen) VALUES (?, ?, ?)',
+                            (res.source, normalize_url(art.link), now)
+                        )
+                        new_count += cursor.rowcount
+                    if last_polled is not None:
+                        hours = max((now - last_polled) / 3600, 1 / 60)
+                        new_rate = (1 - alpha) * new_rate + alpha * (new_count / hours)
+                    else:
+                        new_rate = float(new_count)
+                    if polls - failures <= 0:
+                        latency_avg, latency_dev = res.latency, res.latency / 2
+                        parse_avg = res.parse_time
+                    else:
+                        latency_dev = (1 - alpha) * latency_dev + alpha * abs(res.latency - latency_avg)
+                        latency_avg = (1 - alpha) * latency_avg + alpha * res.latency
+                        parse_avg = (1 - alpha) * parse_avg + alpha * res.parse_time
+
+                    if state != 'closed':
+                        logger.info(f"  🔌 CIRCUIT_CLOSED {res.source}: лента снова отвечает")
+                    consecutive, state = 0, 'closed'
+                else:
+                    consecutive += 1
+                    if state == 'half_open' or (state == 'closed'
+                                                and consecutive >= config.breaker_failure_threshold):
+                        trips += 1
+                        state, opened_at = 'open', now
+                        logger.warning(
+                            f"  🔌 CIRCUIT_OPEN {res.source}: {consecutive} ошибок подряд "
+                            f"({res.error}), пауза {self.breaker_cooldown({'trips': trips}) / 60:.0f} мин"
+                        )
+
+                cursor.execute('''
+                    INSERT INTO feed_stats
+                    (source, url, polls, failures, entries_total, new_total, new_rate, latency_avg,
+                     last_polled, latency_dev, consecutive_failures, circuit_state, opened_at, trips,
+                     parse_avg)
+                    VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(source) DO UPDATE SET
+                        url = excluded.url,
+                        polls = polls + 1,
+                        failures = failures + excluded.failures,
+                        entries_total = entries_total + excluded.entries_total,
+                        new_total = new_total + excluded.new_total,
+                        new_rate = excluded.new_rate,
+                        latency_avg = excluded.latency_avg,
+                        last_polled = excluded.last_polled,
+                        latency_dev = excluded.latency_dev,
+                        consecutive_failures = excluded.consecutive_failures,
+                        circuit_state = excluded.circuit_state,
+                        opened_at = excluded.opened_at,
+                        trips = excluded.trips,
+                        parse_avg = excluded.parse_avg
+                ''', (res.source, res.url, 0 if res.ok else 1, len(res.articles), new_count,
+                      new_rate, latency_avg, now, latency_dev, consecutive, state, opened_at, trips,
+                      parse_avg))
+            cursor.execute(
+                'DELETE FROM feed_entries WHERE first_seen < ?',
+                (now - config.retention_days * 86400,)
+            )
+            conn.commit()
+
+    def record_acceptance(self, articles: List[Article], polled_sources: Set[str], accepted_links: Set[str]):
+        fetched: Dict[str, int] = defaultdict(int)
+        accepted: Dict[str, int] = defaultdict(int)
+        for art in articles:
+            if art.source in polled_sources:
+                fetched[art.source] += 1
+                if art.link in accepted_links:
+                    accepted[art.source] += 1
+        alpha = config.poll_stats_alpha
+        with self._lock:
+            conn = self._get_conn()
+            for source in polled_sources:
+                rate = accepted[source] / fetched[source] if fetched[source] else 0.0
+                conn.execute('''
+                    UPDATE feed_stats
+                    SET accepted_total = accepted_total + ?,
+                        accept_rate = CASE WHEN polls <= 1 THEN ? ELSE (1 - ?) * accept_rate + ? * ? END
+                    WHERE source = ?
+                ''', (accepted[source], rate, alpha, alpha, rate, source))
+            conn.commit()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка закрытия БД статистики лент: {e}")
+            self._conns.clear()
+            self._local.conn = None
+
+
+class AsyncFeedScheduler:
+    # Асинхронный фасад над FeedScheduler, как AsyncPostedManager и AsyncRunCoordinator:
+    # чтение и запись feed_stats не останавливают загрузку лент
+    def __init__(self, scheduler: FeedScheduler):
+        self.scheduler = scheduler
+
+    async def _run(self, method: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.scheduler.executor, partial(method, *args)
+        )
+
+    def timeout_for(self, source: str) -> float:
+        # Только кэш последнего select — без БД
+        return self.scheduler.timeout_for(source)
+
+    async def select(self, feeds: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        return await self._run(self.scheduler.select, feeds)
+
+    async def estimate_cost(self, feeds: List[Tuple[str, str]]) -> Tuple[int, float]:
+        return await self._run(self.scheduler.estimate_cost, feeds)
+
+    async def record_fetch(self, results: List[FeedResult]):
+        await self._run(self.scheduler.record_fetch, results)
+
+    async def record_acceptance(self, articles: List[Article], polled_sources: Set[str], accepted_links: Set[str]):
+        await self._run(self.scheduler.record_acceptance, articles, polled_sources, accepted_links)
+
+    def close(self):
+        self.scheduler.close()
+
+
+# ====================== КООРДИНАЦИЯ ЗАПУСКОВ (LEASES) ======================
+class RunCoordinator:
+    def __init__(self, db_file: str, owner: str):
+        self.db_file = db_file
+        self.owner = owner
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._conns: List[sqlite3.Connection] = []
+        self._held: Dict[str, float] = {}
+        # BEGIN IMMEDIATE ждёт чужую запись до busy_timeout — только в этих потоках, не в event loop
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="coordinator")
+        self._init_db()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conn') or self._local.conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return self._local.conn
+
+    def _init_db(self):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    acquired_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            # Пул — кэш на минуты; таблицы до разбиения на уровни просто пересоздаём
+            columns = [r[1] for r in conn.execute('PRAGMA table_info(pool_meta)')]
+            if columns and 'tier' not in columns:
+                conn.execute('DROP TABLE IF EXISTS pool_meta')
+                conn.execute('DROP TABLE IF EXISTS article_pool')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS article_pool (
+                    tier INTEGER NOT NULL,
+                    norm_url TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    summary TEXT,
+                    source TEXT,
+                    published TEXT,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (tier, norm_url)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS pool_meta (
+                    tier INTEGER PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    owner TEXT,
+                    articles INTEGER
+                )
+            ''')
+
+    def acquire(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT owner, expires_at FROM leases WHERE name = ?', (name,)
+                ).fetchone()
+                if row and row[0] != self.owner and row[1] > now:
+                    conn.execute('ROLLBACK')
+                    return False
+                if row and row[0] != self.owner:
+                    logger.warning(
+                        f"♻️ Lease {name}: перехват просроченной аренды у {row[0]} "
+                        f"(истекла {now - row[1]:.0f}s назад)"
+                    )
+                conn.execute('''
+                    INSERT INTO leases (name, owner, acquired_at, heartbeat_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        owner = excluded.owner,
+                        acquired_at = excluded.acquired_at,
+                        heartbeat_at = excluded.heartbeat_at,
+                        expires_at = excluded.expires_at
+                ''', (name, self.owner, now, now, now + ttl))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._held[name] = ttl
+            return True
+
+    def heartbeat(self) -> List[str]:
+        now = time.time()
+        lost = []
+        with self._lock:
+            conn = self._get_conn()
+            for name, ttl in list(self._held.items()):
+                cursor = conn.execute(
+                    'UPDATE leases SET heartbeat_at = ?, expires_at = ? WHERE name = ? AND owner = ?',
+                    (now, now + ttl, name, self.owner)
+                )
+                if cursor.rowcount == 0:
+                    lost.append(name)
+                    self._held.pop(name, None)
+        return lost
+
+    def release(self, name: str):
+        with self._lock:
+            self._held.pop(name, None)
+            self._get_conn().execute(
+                'DELETE FROM leases WHERE name = ? AND owner = ?', (name, self.owner)
+            )
+
+    def release_all(self):
+        for name in list(self._held):
+            self.release(name)
+
+    def get_holder(self, name: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._get_conn().execute(
+                'SELECT owner, expires_at FROM leases WHERE name = ? AND expires_at > ?',
+                (name, time.time())
+            ).fetchone()
+            return (row[0], row[1]) if row else None
+
+    # ---------- общий пул скачанных статей ----------
+    def store_articles(self, articles: List[Article], tier: int = 1):
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM article_pool WHERE tier = ?', (tier,))
+                conn.executemany('''
+                    INSERT OR IGNORE INTO article_pool
+                    (tier, norm_url, url, title, summary, source, published, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (tier, normalize_url(a.link), a.link, a.title, a.summary, a.source,
+                     a.published.isoformat(), now)
+                    for a in articles
+                ])
+                conn.execute('''
+                    INSERT INTO pool_meta (tier, fetched_at, owner, articles) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(tier) DO UPDATE SET
+                        fetched_at = excluded.fetched_at,
+                        owner = excluded.owner,
+                        articles = excluded.articles
+                ''', (tier, now, self.owner, len(articles)))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def load_articles(self, max_age_seconds: float, tier: int = 1) -> Optional[List[Article]]:
+        with self._lock:
+            conn = self._get_conn()
+            meta = conn.execute(
+                'SELECT fetched_at, owner FROM pool_meta WHERE tier = ?', (tier,)
+            ).fetchone()
+            if not meta or time.time() - meta[0] > max_age_seconds:
+                return None
+            rows = conn.execute(
+                'SELECT url, title, summary, source, published FROM article_pool WHERE tier = ?',
+                (tier,)
+            ).fetchall()
+        logger.info(
+            f"♻️ Пул статей (уровень {tier}) от {meta[1]} ({time.time() - meta[0]:.0f}s назад): {len(rows)}"
+        )
+        return [
+            Article(title=r[1], summary=r[2] or "", link=r[0], source=r[3] or "",
+                    published=parse_db_datetime(r[4] or ""))
+            for r in rows
+        ]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка закрытия БД координации: {e}")
+            self._conns.clear()
+            self._local.conn = None
+
+
+class AsyncRunCoordinator:
+    # Асинхронный фасад над RunCoordinator: аренды и пул статей идут через его потоки,
+    # поэтому чужая запись в БД не замораживает загрузку лент и heartbeat аренд
+    def __init__(self, coordinator: RunCoordinator):
+        self.coordinator = coordinator
+        self.owner = coordinator.owner
+
+    async def _run(self, method: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.coordinator.executor, partial(method, *args)
+        )
+
+    async def acquire(self, name: str, ttl: float) -> bool:
+        return await self._run(self.coordinator.acquire, name, ttl)
+
+    async def heartbeat(self) -> List[str]:
+        return await self._run(self.coordinator.heartbeat)
+
+    async def release(self, name: str):
+        await self._run(self.coordinator.release, name)
+
+    async def release_all(self):
+        await self._run(self.coordinator.release_all)
+
+    async def get_holder(self, name: str) -> Optional[Tuple[str, float]]:
+        return await self._run(self.coordinator.get_holder, name)
+
+    async def store_articles(self, articles: List[Article], tier: int = 1):
+        await self._run(self.coordinator.store_articles, articles, tier)
+
+    async def load_articles(self, max_age_seconds: float, tier: int = 1) -> Optional[List[Article]]:
+        return await self._run(self.coordinator.load_articles, max_age_seconds, tier)
+
+    def close(self):
+        self.coordinator.close()
+
+
+async def keep_leases_alive(coordinator: AsyncRunCoordinator, shutdown_event: asyncio.Event):
+    while True:
+        await asyncio.sleep(config.lease_heartbeat_seconds)
+        lost = await coordinator.heartbeat()
+        if lost:
+            logger.error(f"❌ Потеряны аренды {lost} — другой запуск перехватил работу, завершаемся")
+            shutdown_event.set()
+            return
+
+
+async def obtain_articles(
+    coordinator: AsyncRunCoordinator,
+    scheduler: AsyncFeedScheduler,
+    shutdown_event: asyncio.Event,
+    tier_feeds: List[Tuple[str, str]],
+    tier: int = 1,
+    polled_sources: Optional[Set[str]] = None,
+    on_batch: Optional[Callable[[List[Article]], None]] = None
+) -> Optional[List[Article]]:
+    # Ленты качает один запуск; остальные ждут и берут его результат из пула
+    max_age = config.article_pool_max_age_minutes * 60
+    deadline = time.monotonic() + config.fetch_wait_seconds
+    lease = "fetch" if tier == 1 else f"fetch:{tier}"
+    while not shutdown_event.is_set():
+        pool = await coordinator.load_articles(max_age, tier)
+        if pool is not None:
+            if on_batch:
+                on_batch(pool)
+            return pool
+
+        if await coordinator.acquire(lease, config.lease_ttl_seconds):
+            try:
+                feeds = await scheduler.select(tier_feeds)
+                if polled_sources is not None:
+                    polled_sources.update(source for _, source in feeds)
+                raw = await load_all_feeds(feeds, scheduler, on_batch, tier)
+
+                sources_count: Dict[str, int] = {}
+                for art in raw:
+                    sources_count[art.source] = sources_count.get(art.source, 0) + 1
+                logger.info(f"📰 Источники: {sources_count}")
+
+                working = sum(1 for v in sources_count.values() if v > 0)
+                logger.info(
+                    f"📡 Работающих источников (уровень {tier}): "
+                    f"{working}/{len(feeds)} (всего лент {len(tier_feeds)})"
+                )
+
+                await coordinator.store_articles(raw, tier)
+                return raw
+            finally:
+                await coordinator.release(lease)
+
+        if time.monotonic() > deadline:
+            logger.error("❌ Не дождались загрузки RSS другим запуском")
+            return None
+        holder = await coordinator.get_holder(lease)
+        logger.info(f"⏳ RSS качает {holder[0] if holder else '?'}, ждём...")
+        await asyncio.sleep(2)
+    return None
+
+
+# ====================== АРХИВ ЛЕНТ (ЗАПИСЬ И ПОВТОР) ======================
+class FeedArchive:
+    # Сырые тела лент — zlib-блобы с именем sha256 (неизменившаяся лента хранится один раз),
+    # на каждый запуск — манифест runs/<run_id>.json с метаданными загрузок
+    def __init__(self, root: str):
+        self.root = root
+        self.started = datetime.now(timezone.utc)
+        self.run_id = f"{self.started:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.fetches: List[dict] = []
+        self.new_blobs = 0
+        self.new_bytes = 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def put(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            packed = zlib.compress(body, 6)
+            tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(packed)
+            os.replace(tmp, path)
+            self.new_blobs += 1
+            self.new_bytes += len(packed)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def add_fetches(self, results: List[FeedResult], tier: int):
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        for r in results:
+            self.fetches.append({
+                'url': r.url, 'source': r.source, 'tier': tier, 'ok': r.ok, 'error': r.error,
+                'latency': round(r.latency, 3), 'wire_bytes': r.wire_bytes, 'body_bytes': r.body_bytes,
+                'stopped_early': r.stopped_early, 'truncated': r.truncated,
+                'content_type': r.content_type, 'body': r.body_sha, 'fetched_at': fetched_at,
+            })
+
+    def finish(self):
+        if not self.fetches:
+            return
+        runs_dir = os.path.join(self.root, "runs")
+        os.makedirs(runs_dir, exist_ok=True)
+        path = os.path.join(runs_dir, f"{self.run_id}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({'run_id': self.run_id, 'runner': config.runner_id, 'started': self.started.isoformat(),
+                       'fetches': self.fetches}, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+        logger.info(
+            f"🗄️ Ленты записаны в архив ({self.run_id}): {len(self.fetches)} загрузок, "
+            f"новых блобов {self.new_blobs} ({self.new_bytes / 1024:.0f} KB)"
+        )
+
+    def load_runs(self, run_ids: Optional[List[str]] = None, since: Optional[datetime] = None) -> List[dict]:
+        runs_dir = os.path.join(self.root, "runs")
+        runs = []
+        for name in sorted(os.listdir(runs_dir)) if os.path.isdir(runs_dir) else []:
+            if not name.endswith(".json") or (run_ids and name[:-5] not in run_ids):
+                continue
+            with open(os.path.join(runs_dir, name), encoding="utf-8") as f:
+                run = json.load(f)
+            if since is None or datetime.fromisoformat(run['started']) >= since:
+                runs.append(run)
+        return runs
 
 
 # ====================== RSS LOADING ======================
-async def fetch_feed(url: str, source: str) -> List[Article]:
+FEED_ITEM_END_RE = re.compile(rb'</(?:[\w-]+:)?(?:item|entry)\s*>', re.IGNORECASE)
+
+
+def stream_decoder(encoding: str) -> Optional[Callable[[bytes], Iterator[bytes]]]:
+    # Распаковка кусками не больше feed_chunk_size — пик памяти не растёт от степени сжатия
+    encoding = encoding.strip().lower()
+    step = config.feed_chunk_size
+    if encoding in ("", "identity"):
+        def pieces(chunk: bytes) -> Iterator[bytes]:
+            for start in range(0, len(chunk), step):
+                yield chunk[start:start + step]
+        return pieces
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding != "deflate" else zlib.MAX_WBITS)
+        # Многие серверы шлют deflate без zlib-заголовка: при первой ошибке
+        # переключаемся на «сырой» поток, как aiohttp и requests
+        head: Optional[bytes] = b"" if encoding == "deflate" else None
+
+        def pieces(chunk: bytes) -> Iterator[bytes]:
+            nonlocal decompressor, head
+            if head is not None:
+                head += chunk
+            while chunk:
+                try:
+                    data = decompressor.decompress(chunk, step)
+                except zlib.error:
+                    if head is None:
+                        raise
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                    chunk, head = head, None
+                    continue
+                if data:
+                    head = None
+                yield data
+                chunk = decompressor.unconsumed_tail
+        return pieces
+    if encoding == "br" and brotli is not None:
+        decompressor = brotli.Decompressor()
+
+        def pieces(chunk: bytes) -> Iterator[bytes]:
+            data = decompressor.process(chunk)
+            for start in range(0, len(data), step):
+                yield data[start:start + step]
+        return pieces
+    return None
+
+
+async def read_feed_body(resp: aiohttp.ClientResponse, result: FeedResult) -> Optional[bytes]:
+    # Читаем поток, пока не наберём feed_max_entries записей или feed_max_bytes
+    decode = stream_decoder(resp.headers.get("Content-Encoding", ""))
+    if decode is None:
+        result.error = f"Unsupported encoding {resp.headers.get('Content-Encoding')}"
+        return None
+    body = bytearray()
+    items = 0
+    scan_from = 0
+    async for chunk in resp.content.iter_chunked(config.feed_chunk_size):
+        result.wire_bytes += len(chunk)
+        for piece in decode(chunk):
+            body += piece
+            result.peak_memory = max(result.peak_memory, len(body) + len(chunk))
+            for match in FEED_ITEM_END_RE.finditer(body, scan_from):
+                items += 1
+                scan_from = match.end()
+                if items >= config.feed_max_entries:
+                    result.stopped_early = True
+                    break
+            if result.stopped_early:
+                del body[scan_from:]
+                break
+            scan_from = max(scan_from, len(body) - 32)
+            if len(body) > config.feed_max_bytes:
+                del body[config.feed_max_bytes:]
+                result.truncated = True
+                break
+        if result.stopped_early or result.truncated:
+            break
+    result.body_bytes = len(body)
+    return bytes(body)
+
+
+def parse_feed_articles(content: bytes, content_type: str, source: str,
+                        shift: timedelta = timedelta(0)) -> List[Article]:
+    # shift сдвигает даты публикации: при повторе архива возраст статей — как в момент записи
+    feed = feedparser.parse(content, response_headers={"content-type": content_type})
+    articles = []
+    for entry in feed.entries[:config.feed_max_entries]:
+        link = entry.get('link', '').strip()
+        title = entry.get('title', '').strip()
+        summary = re.sub(r'<[^>]+>', '', entry.get('summary', entry.get('description', '')).strip())
+        if not link or not title or len(title) < 15:
+            continue
+        pub_date = entry.get('published_parsed') or entry.get('updated_parsed')
+        published = (datetime(*pub_date[:6], tzinfo=timezone.utc) + shift) if pub_date else datetime.now(timezone.utc)
+        articles.append(Article(title=title, summary=summary, link=link, source=source, published=published))
+    return articles
+
+
+async def fetch_feed(url: str, source: str, timeout_seconds: Optional[float] = None) -> FeedResult:
+    result = FeedResult(url=url, source=source)
+    started = None
     try:
-        await asyncio.sleep(random.uniform(0.3, 1.5))
-        timeout = aiohttp.ClientTimeout(total=config.http_timeout)
-        async with aiohttp.ClientSession(timeout=timeout) as sess:
-            async with sess.get(url, headers=HEADERS) as resp:
+        await asyncio.sleep(random.uniform(*config.fetch_delay_range))
+        started = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=timeout_seconds or config.http_timeout)
+        async with aiohttp.ClientSession(timeout=timeout, auto_decompress=False) as sess:
+            async with sess.get(url, headers=FEED_HEADERS) as resp:
                 if resp.status != 200:
                     logger.warning(f"  ⚠️ {source}: HTTP {resp.status}")
-                    return []
-                content = await resp.text()
-        feed = await asyncio.to_thread(feedparser.parse, content)
-        articles = []
-        for entry in feed.entries[:20]:
-            link = entry.get('link', '').strip()
-            title = entry.get('title', '').strip()
-            summary = re.sub(r'<[^>]+>', '', entry.get('summary', entry.get('description', '')).strip())
-            if not link or not title or len(title) < 15:
-                continue
-            pub_date = entry.get('published_parsed') or entry.get('updated_parsed')
-            published = datetime(*pub_date[:6], tzinfo=timezone.utc) if pub_date else datetime.now(timezone.utc)
-            articles.append(Article(title=title, summary=summary, link=link, source=source, published=published))
-        logger.info(f"  ✅ {source}: {len(articles)}")
-        return articles
+                    result.error = f"HTTP {resp.status}"
+                    return result
+                content = await read_feed_body(resp, result)
+                if content is None:
+                    logger.warning(f"  ⚠️ {source}: {result.error}")
+                    return result
+                result.content_type = resp.headers.get("Content-Type", "")
+        result.latency = time.monotonic() - started
+        if result.truncated:
+            logger.warning(f"  ✂️ {source}: тело больше {config.feed_max_bytes // 1024} KB, обрезано")
+        if feed_archive is not None:
+            result.body_sha = await asyncio.to_thread(feed_archive.put, content)
+        parse_started = time.monotonic()
+        articles = await asyncio.to_thread(parse_feed_articles, content, result.content_type, source)
+        result.parse_time = time.monotonic() - parse_started
+        logger.info(
+            f"  ✅ {source}: {len(articles)} ({result.wire_bytes / 1024:.0f} KB по сети, "
+            f"{result.body_bytes / 1024:.0f} KB XML, пик {result.peak_memory / 1024:.0f} KB"
+            f"{', ранняя остановка' if result.stopped_early else ''})"
+        )
+        result.articles = articles
+        result.ok = True
+        return result
     except asyncio.TimeoutError:
-        logger.warning(f"  ⚠️ {source}: Timeout")
-        return []
+        logger.warning(f"  ⚠️ {source}: Timeout ({timeout_seconds or config.http_timeout:.0f}s)")
+        result.error = "Timeout"
+        return result
     except Exception as e:
         logger.warning(f"  ⚠️ {source}: {e}")
-        return []
+        result.error = str(e) or type(e).__name__
+        return result
+    finally:
+        if started is not None and not result.latency:
+            result.latency = time.monotonic() - started
 
 
-async def load_all_feeds() -> List[Article]:
+async def load_all_feeds(
+    feeds: List[Tuple[str, str]] = None,
+    scheduler: Optional[AsyncFeedScheduler] = None,
+    on_batch: Optional[Callable[[List[Article]], None]] = None,
+    tier: int = 1
+) -> List[Article]:
+    # Каждая лента уходит в фильтры сразу по приходу — сеть и CPU работают внахлёст
     logger.info("📥 Загрузка RSS...")
-    tasks = [fetch_feed(url, source) for url, source in RSS_FEEDS]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    feeds = feeds if feeds is not None else RSS_FEEDS
+    started = time.monotonic()
+    tasks: Dict[asyncio.Task, Tuple[str, str]] = {}
+    for url, source in feeds:
+        task = asyncio.create_task(
+            fetch_feed(url, source, scheduler.timeout_for(source) if scheduler else None)
+        )
+        tasks[task] = (url, source)
+
     all_articles = []
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            logger.warning(f"  ⚠️ {RSS_FEEDS[i][1]}: {result}")
-        elif result:
-            all_articles.extend(result)
-    logger.info(f"📦 Всего: {len(all_articles)}")
+    feed_results = []
+    filter_time = 0.0
+    try:
+        for next_done in asyncio.as_completed(list(tasks), timeout=config.fetch_deadline_seconds or None):
+            try:
+                result = await next_done
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                logger.warning(f"  ⚠️ RSS: {e}")
+                continue
+            feed_results.append(result)
+            all_articles.extend(result.articles)
+            if on_batch and result.articles:
+                batch_started = time.perf_counter()
+                on_batch(result.articles)
+                filter_time += time.perf_counter() - batch_started
+    except asyncio.TimeoutError:
+        logger.warning(f"  ⏱️ Дедлайн загрузки {config.fetch_deadline_seconds}s — продолжаем с тем, что пришло")
+
+    done_sources = {r.source for r in feed_results}
+    for task, (url, source) in tasks.items():
+        if not task.done():
+            task.cancel()
+        if source not in done_sources:
+            feed_results.append(FeedResult(url=url, source=source, error="Deadline"))
+
+    if scheduler:
+        await scheduler.record_fetch(feed_results)
+    if feed_archive is not None:
+        feed_archive.add_fetches(feed_results, tier)
+    wall = time.monotonic() - started
+    logger.info(
+        f"📦 Всего: {len(all_articles)} за {wall:.1f}s"
+        + (f" (фильтрация внахлёст: {filter_time:.2f}s)" if on_batch else "")
+    )
+    if feed_results:
+        logger.info(
+            f"📶 Трафик: {sum(r.wire_bytes for r in feed_results) / 1024:.0f} KB по сети, "
+            f"{sum(r.body_bytes for r in feed_results) / 1024:.0f} KB XML, "
+            f"пик на ленту {max(r.peak_memory for r in feed_results) / 1024:.0f} KB, "
+            f"ранних остановок {sum(r.stopped_early for r in feed_results)}"
+        )
     return all_articles
 
 
@@ -964,125 +3278,553 @@ def interleave_by_source(candidates: List[Article]) -> List[Article]:
     return result
 
 
-# ====================== filter_and_dedupe ======================
-def filter_and_dedupe(articles: List[Article], posted: PostedManager) -> List[Article]:
-    logger.info("🔍 Фильтрация...")
-    logger.info(f"   Входящих статей: {len(articles)}")
-
-    candidates = []
-    seen_normalized_titles: Set[str] = set()
-    seen_word_signatures: Set[str] = set()
-    seen_content_hashes: Set[str] = set()
-    batch_subject_counts: Dict[str, int] = defaultdict(int)
-
-    stats = {
-        "batch_dup": 0, "db_dup": 0, "diversity": 0, "passed": 0,
-        "filtered_out": 0, "subject_limit": 0, "subject_rotation": 0,
-        "batch_subject": 0, "blacklisted": 0,
-    }
+# ====================== РАНЖИРОВАНИЕ ПО ИСХОДАМ ГЕНЕРАЦИИ ======================
+@dataclass
+class GenerationRecord:
+    calls: int = 0
+    outcome: str = "error"      # ok / skip / invalid / water / error
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+
+
+class CandidateRanker:
+    # Логистическая регрессия на исходах генерации: вероятность, что статья даст
+    # валидный пост. Признаки хранятся в строке исхода, модель обучается при запуске
+    NUMERIC = ("summary_len", "title_len", "ai_score", "block_score")
+    FLAGS = ("is_block", "is_primary", "strong_ai")
+    TOPICS = tuple(sorted(Topic.HASHTAGS))
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.run_id = f"{config.runner_id}:{uuid.uuid4().hex[:6]}"   # группа для офлайн-оценки
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self.weights: Optional[np.ndarray] = None
+        self.mean: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self._init_db()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conn') or self._local.conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return self._local.conn
+
+    def _init_db(self):
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS generation_outcomes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created REAL NOT NULL,
+                    run_id TEXT NOT NULL,
+                    norm_url TEXT NOT NULL,
+                    source TEXT,
+                    topic TEXT,
+                    summary_len INTEGER,
+                    title_len INTEGER,
+                    ai_score INTEGER,
+                    block_score INTEGER,
+                    is_block INTEGER,
+                    is_primary INTEGER,
+                    strong_ai INTEGER,
+                    relevance INTEGER,
+                    outcome TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    latency REAL DEFAULT 0
+                )
+            ''')
+            for column in ("prompt_tokens INTEGER DEFAULT 0",
+                           "completion_tokens INTEGER DEFAULT 0",
+                           "latency REAL DEFAULT 0"):
+                try:
+                    conn.execute(f"ALTER TABLE generation_outcomes ADD COLUMN {column}")
+                except Exception:
+                    pass
+            conn.execute(
+                'DELETE FROM generation_outcomes WHERE created < ?',
+                (time.time() - config.ranker_history_days * 86400,)
+            )
+            conn.commit()
+
+    @staticmethod
+    def describe(article: Article) -> dict:
+        features = get_features(article)
+        return {
+            'source': article.source, 'topic': features.topic,
+            'summary_len': len(article.summary), 'title_len': len(article.title),
+            'ai_score': features.ai_score, 'block_score': features.block_score,
+            'is_block': int(features.is_block), 'is_primary': int(article.source in PRIMARY_SOURCES),
+            'strong_ai': int(features.has_strong_ai), 'relevance': candidate_relevance_score(article),
+        }
+
+    def record(self, article: Article, result: GenerationRecord):
+        row = self.describe(article)
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute('''
+                INSERT INTO generation_outcomes
+                (created, run_id, norm_url, source, topic, summary_len, title_len, ai_score,
+                 block_score, is_block, is_primary, strong_ai, relevance, outcome, calls,
+                 prompt_tokens, completion_tokens, latency)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (time.time(), self.run_id, normalize_url(article.link), row['source'],
+                  row['topic'], row['summary_len'], row['title_len'], row['ai_score'],
+                  row['block_score'], row['is_block'], row['is_primary'], row['strong_ai'],
+                  row['relevance'], result.outcome, result.calls, result.prompt_tokens,
+                  result.completion_tokens, result.latency))
+            conn.commit()
+
+    def load(self) -> List[dict]:
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            cursor.execute('''
+                SELECT run_id, source, topic, summary_len, title_len, ai_score, block_score,
+                       is_block, is_primary, strong_ai, relevance, outcome, calls
+                FROM generation_outcomes ORDER BY id
+            ''')
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, r)) for r in cursor.fetchall()]
+
+    def _matrix(self, rows: List[dict]) -> np.ndarray:
+        # Числовые признаки в log1p, тема one-hot, источник — хешированный one-hot
+        buckets = config.ranker_source_buckets
+        x = np.zeros((len(rows), len(self.NUMERIC) + len(self.FLAGS) + len(self.TOPICS) + buckets),
+                     dtype=np.float64)
+        topic_index = {t: i for i, t in enumerate(self.TOPICS)}
+        offset = len(self.NUMERIC) + len(self.FLAGS)
+        for i, row in enumerate(rows):
+            x[i, :len(self.NUMERIC)] = np.log1p([max(row[name] or 0, 0) for name in self.NUMERIC])
+            x[i, len(self.NUMERIC):offset] = [row[name] or 0 for name in self.FLAGS]
+            if row['topic'] in topic_index:
+                x[i, offset + topic_index[row['topic']]] = 1.0
+            x[i, offset + len(self.TOPICS) + zlib.crc32((row['source'] or '').encode()) % buckets] = 1.0
+        return x
+
+    def _design(self, rows: List[dict]) -> np.ndarray:
+        x = (self._matrix(rows) - self.mean) / self.scale
+        return np.hstack([np.ones((len(rows), 1)), x])
+
+    def fit(self, rows: Optional[List[dict]] = None) -> bool:
+        # Ньютон (IRLS) с L2; свободный член не штрафуется
+        rows = self.load() if rows is None else rows
+        labels = np.array([r['outcome'] == 'ok' for r in rows], dtype=np.float64)
+        if len(rows) < config.ranker_min_samples or labels.min(initial=1) == labels.max(initial=0):
+            self.weights = None
+            return False
+        raw = self._matrix(rows)
+        self.mean = raw.mean(axis=0)
+        self.scale = np.where(raw.std(axis=0) > 0, raw.std(axis=0), 1.0)
+        x = self._design(rows)
+        penalty = np.full(x.shape[1], config.ranker_l2)
+        penalty[0] = 0.0
+        weights = np.zeros(x.shape[1])
+        for _ in range(25):
+            p = 1.0 / (1.0 + np.exp(-x @ weights))
+            gradient = x.T @ (p - labels) + penalty * weights
+            hessian = (x * (p * (1 - p))[:, None]).T @ x + np.diag(penalty + 1e-9)
+            step = np.linalg.solve(hessian, gradient)
+            weights -= step
+            if np.abs(step).max() < 1e-6:
+                break
+        self.weights = weights
+        return True
 
-    for article in articles:
-        if not is_relevant(article):
-            stats["filtered_out"] += 1
-            continue
+    def probabilities(self, rows: List[dict]) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-self._design(rows) @ self.weights))
 
-        title_normalized = normalize_title(article.title)
-        if title_normalized in seen_normalized_titles:
-            stats["batch_dup"] += 1
-            continue
+    @property
+    def trained(self) -> bool:
+        return self.weights is not None
 
-        word_sig = get_sorted_word_signature(article.title)
-        if word_sig in seen_word_signatures:
-            stats["batch_dup"] += 1
-            continue
+    def rank(self, articles: List[Article]) -> List[Article]:
+        # Блокировки по-прежнему впереди, внутри — по вероятности успешной генерации
+        if not self.trained or not articles:
+            return sorted(articles, key=candidate_relevance_score, reverse=True)
+        p = self.probabilities([self.describe(a) for a in articles])
+        order = sorted(range(len(articles)),
+                       key=lambda i: (get_features(articles[i]).is_block, p[i]), reverse=True)
+        return [articles[i] for i in order]
 
-        content_hash = get_content_hash(f"{article.title} {article.summary}")
-        if content_hash in seen_content_hashes:
-            stats["batch_dup"] += 1
-            continue
+    @staticmethod
+    def _calls_until_success(rows: List[dict], order: List[int]) -> Tuple[int, bool]:
+        calls = 0
+        for i in order:
+            calls += rows[i]['calls']
+            if rows[i]['outcome'] == 'ok':
+                return calls, True
+        return calls, False
+
+    def evaluate(self, train_share: float = 0.7) -> dict:
+        # Офлайн-оценка: обучение на ранних исходах, проверка на поздних.
+        # Для каждого запуска из тестовой части считаем вызовы LLM до первого успеха
+        # при порядке по релевантности и по модели
+        rows = self.load()
+        split = int(len(rows) * train_share)
+        train, test = rows[:split], rows[split:]
+        if not test or not self.fit(train):
+            return {'rows': len(rows), 'trained': False}
+        labels = np.array([r['outcome'] == 'ok' for r in test], dtype=np.float64)
+        p = np.clip(self.probabilities(test), 1e-6, 1 - 1e-6)
+        prior = np.clip(np.mean([r['outcome'] == 'ok' for r in train]), 1e-6, 1 - 1e-6)
+        ranks = np.argsort(np.argsort(p)) + 1
+        positives = labels.sum()
+        negatives = len(labels) - positives
+        auc = ((ranks[labels == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives)
+               if positives and negatives else float('nan'))
+
+        runs: Dict[str, List[int]] = defaultdict(list)
+        for i, row in enumerate(test):
+            runs[row['run_id']].append(i)
+        totals = {'relevance': [0, 0], 'model': [0, 0]}
+        for members in runs.values():
+            by_relevance = sorted(members, key=lambda i: test[i]['relevance'], reverse=True)
+            by_model = sorted(members, key=lambda i: (test[i]['is_block'], p[i]), reverse=True)
+            for name, order in (('relevance', by_relevance), ('model', by_model)):
+                calls, ok = self._calls_until_success(test, order)
+                totals[name][0] += calls
+                totals[name][1] += ok
+        return {
+            'rows': len(rows), 'train': len(train), 'test': len(test), 'trained': True,
+            'success_rate': round(float(labels.mean()), 3),
+            'log_loss_model': round(float(-np.mean(labels * np.log(p) + (1 - labels) * np.log(1 - p))), 4),
+            'log_loss_prior': round(float(-np.mean(labels * np.log(prior) + (1 - labels) * np.log(1 - prior))), 4),
+            'auc': round(float(auc), 3),
+            'runs': len(runs),
+            'calls_per_post_relevance': round(totals['relevance'][0] / max(totals['relevance'][1], 1), 2),
+            'calls_per_post_model': round(totals['model'][0] / max(totals['model'][1], 1), 2),
+        }
 
-        text = f"{article.title} {article.summary}"
-        subject = Topic.detect(text)
 
-        if subject != "other" and batch_subject_counts[subject] >= config.batch_subject_limit:
-            logger.info(f"  ⏭️ BATCH_SUBJECT_LIMIT ({subject}, {batch_subject_counts[subject]} in batch): {article.title[:50]}")
-            stats["batch_subject"] += 1
-            continue
+# ====================== filter_and_dedupe ======================
+def candidate_relevance_score(article: Article) -> int:
+    features = get_features(article)
+    if features.is_block:
+        return 1000 + features.block_score
+    return features.ai_score
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def story_rank(article: Article) -> Tuple[bool, int]:
+    return article.source in PRIMARY_SOURCES, candidate_relevance_score(article)
+
+
+class StoryClusters:
+    # Сюжеты пополняются пачками по мере загрузки лент. Рёбра — те же признаки и пороги,
+    # что у дедупликации по БД; сюжеты нумеруются в порядке появления первой статьи.
+    # Новые статьи склеиваются между собой и с известными сюжетами, а известные сюжеты
+    # между собой не сливаются: их представители уже проверены по БД
+    def __init__(self, idf: np.ndarray):
+        self.idf = idf
+        self.heads: List[Article] = []          # первая статья сюжета — по ней сравниваются кластеры
+        self.members: List[List[Article]] = []
+        self.keys: Dict[Tuple[str, str], int] = {}
+        self.words: List[frozenset] = []
+        self.ngrams: List[frozenset] = []
+        self.vectors = np.zeros((0, config.content_vector_dim), dtype=np.float32)
 
-        subj_ok, subj_reason = posted.check_subject_limit(subject, article.title)
-        if not subj_ok:
-            logger.info(f"  ⏭️ {subj_reason}: {article.title[:50]}")
-            stats["subject_limit"] += 1
-            continue
+    @staticmethod
+    def _keys(article: Article) -> List[Tuple[str, str]]:
+        features = get_features(article)
+        keys = (("title", features.title_normalized), ("signature", features.word_signature),
+                ("hash", features.content_hash))
+        return [key for key in keys if key[1]]
+
+    def add(self, articles: List[Article]) -> Tuple[List[int], Dict[int, List[Article]]]:
+        # Ответ — номера новых сюжетов и статьи, пополнившие уже известные
+        known = len(self.heads)
+        total = known + len(articles)
+        uf = UnionFind(total)
+
+        def join(a: int, b: int):
+            root_a, root_b = uf.find(a), uf.find(b)
+            if root_a != root_b and not (root_a < known and root_b < known):
+                uf.union(root_a, root_b)
+
+        first_with_key = dict(self.keys)
+        for i, article in enumerate(articles, known):
+            for key in self._keys(article):
+                join(i, first_with_key.setdefault(key, i))
+
+        tokens = [text_normalizer.analyze(a.title, a.summary) for a in articles]
+        words = self.words + [t.words for t in tokens]
+        ngrams = self.ngrams + [t.ngrams for t in tokens]
+        new_vectors = normalize_rows(
+            np.stack([content_vector(a.title, a.summary) for a in articles]) * self.idf
+        ).astype(np.float32)
+        vectors = np.vstack([self.vectors, new_vectors])
+
+        if total > 1:
+            vocab: Dict[str, int] = {}
+            word_matrix = TokenMatrix(vocab, words)
+            ngram_matrix = TokenMatrix(vocab, ngrams)
+
+            def similar(a: int, b: int) -> bool:
+                return (
+                    jaccard_similarity(words[a], words[b]) > config.jaccard_threshold
+                    or jaccard_similarity(ngrams[a], ngrams[b]) > config.ngram_similarity_threshold
+                    or float(vectors[a] @ vectors[b]) > config.content_similarity_threshold
+                )
 
-        dup_result = posted.is_duplicate(article.link, article.title, article.summary)
-        if dup_result.is_duplicate:
-            reason = "; ".join(dup_result.reasons[:3])
-            posted.log_rejected(article, reason)
-            stats["db_dup"] += 1
-            continue
+            # Строки — только новые статьи, блоками, чтобы память не росла квадратично.
+            # Кластеры склеиваются, только если похожи и их первые статьи — иначе цепочка
+            # «A≈B≈C» собрала бы в один сюжет все новости с общими словами
+            block = 512
+            for start in range(known, total, block):
+                rows = slice(start, start + block)
+                edges = (
+                    (word_matrix.jaccard(vocab, words[rows]) > config.jaccard_threshold)
+                    | (ngram_matrix.jaccard(vocab, ngrams[rows]) > config.ngram_similarity_threshold)
+                    | (vectors[rows] @ vectors.T > config.content_similarity_threshold)
+                )
+                for i, j in zip(*np.nonzero(edges)):
+                    i, j = start + int(i), int(j)
+                    if i == j or known <= j < i:
+                        continue
+                    root_i, root_j = uf.find(i), uf.find(j)
+                    if root_i != root_j and similar(root_i, root_j):
+                        join(root_i, root_j)
+
+        new_stories: Dict[int, int] = {}
+        grown: Dict[int, List[Article]] = {}
+        for i, article in enumerate(articles, known):
+            root = uf.find(i)
+            if root < known:
+                story = root
+                grown.setdefault(story, []).append(article)
+            else:
+                if root not in new_stories:
+                    new_stories[root] = len(self.heads)
+                    self.heads.append(articles[root - known])
+                    self.members.append([])
+                    self.words.append(words[root])
+                    self.ngrams.append(ngrams[root])
+                    self.vectors = np.vstack([self.vectors, vectors[root:root + 1]])
+                story = new_stories[root]
+            self.members[story].append(article)
+            for key in self._keys(article):
+                self.keys.setdefault(key, story)
+        return list(new_stories.values()), grown
+
+    def best(self, story: int) -> Article:
+        # Внутри сюжета — лучшая по приоритету источника и релевантности
+        return max(self.members[story], key=story_rank)
+
+
+class CandidateFilter:
+    # add() дёшево отсеивает нерелевантное по мере загрузки лент и в фоне склеивает сюжеты
+    # и проверяет по БД по одной статье на сюжет — пока остальные ленты ещё качаются
+    def __init__(self, posted: AsyncPostedManager, accepted: Optional[Set[str]] = None,
+                 ranker: Optional[CandidateRanker] = None):
+        self.posted = posted
+        self.profile = posted.profile
+        self.accepted = accepted
+        self.ranker = ranker
+        self.candidates: List[Article] = []
+        self.pending: List[Article] = []
+        self.clusters: Optional[StoryClusters] = None
+        self.representatives: Dict[int, Article] = {}   # сюжет → проверенная по БД статья
+        self.worker: Optional[asyncio.Task] = None
+        self.batch_subject_counts: Dict[str, int] = defaultdict(int)
+        self.incoming = 0
+        self.cpu_time = 0.0
+        self.stats = {
+            "batch_dup": 0, "db_dup": 0, "diversity": 0, "passed": 0,
+            "filtered_out": 0, "subject_limit": 0, "subject_rotation": 0,
+            "batch_subject": 0, "blacklisted": 0,
+        }
+
+    @property
+    def stories(self) -> int:
+        return len(self.clusters.heads) if self.clusters else 0
+
+    def add(self, articles: List[Article]):
+        started = time.perf_counter()
+        self.incoming += len(articles)
+        for article in articles:
+            if not is_relevant(article, self.profile):
+                self.stats["filtered_out"] += 1
+                continue
+            self.pending.append(article)
+        self.cpu_time += time.perf_counter() - started
+        if self.pending and (self.worker is None or self.worker.done()):
+            self.worker = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self.pending:
+            await self._process_pending()
+
+    def _subject_full(self, subject: str) -> bool:
+        return subject != "other" and self.batch_subject_counts[subject] >= config.batch_subject_limit
+
+    async def process(self):
+        # Дожидается фоновой обработки всего, что уже пришло; пачки, пришедшие за время
+        # ожидания, добирает тот же обработчик
+        while self.pending or self.worker is not None:
+            if self.worker is None:
+                self.worker = asyncio.create_task(self._drain())
+            worker = self.worker
+            await worker
+            if self.worker is worker:
+                self.worker = None
+
+    async def _process_pending(self):
+        if self.clusters is None:
+            self.clusters = StoryClusters(await self.posted.content_idf())
+        started = time.perf_counter()
+        posted = self.posted
+        stats = self.stats
+        clusters = self.clusters
+        pending, self.pending = self.pending, []
+        new_stories, grown = clusters.add(pending)
+        stats["batch_dup"] += len(pending) - len(new_stories)
+        for story in new_stories + list(grown):
+            members = clusters.members[story]
+            if len(members) > 1:
+                decisions("STORY", clusters.heads[story], channel=self.profile.name, size=len(members),
+                          sources=list(dict.fromkeys(a.source for a in members))[:5])
+
+        # По БД проверяется лучшая статья каждого нового сюжета. Если известный сюжет
+        # пополнился статьёй лучше его представителя, проверяется и она: пройдя, она заменит
+        # представителя среди кандидатов (так 3DNews-версия вытесняет пришедший раньше пересказ)
+        screening: List[Tuple[int, Article]] = [(story, clusters.best(story)) for story in new_stories]
+        for story, articles in grown.items():
+            best = max(articles, key=story_rank)
+            if story_rank(best) > story_rank(self.representatives[story]):
+                screening.append((story, best))
+        screening.sort(key=lambda item: item[0])
+
+        # Вердикты по истории считаются окнами по несколько сюжетов, одним заходом в пул БД.
+        # Счётчики пачки только растут, поэтому упёршиеся в лимит темы до проверки по БД не дойдут
+        verdicts: Dict[int, CandidateScreen] = {}
+        for i, (story, article) in enumerate(screening):
+            subject = get_features(article).topic
+            previous = self.representatives.get(story)
+            self.representatives.setdefault(story, article)
+
+            if self._subject_full(subject):
+                decisions("BATCH_SUBJECT_LIMIT", article, channel=self.profile.name, subject=subject,
+                          in_batch=self.batch_subject_counts[subject])
+                stats["batch_subject"] += 1
+                continue
 
-        topic = subject
-        div_ok, div_reason = posted.check_diversity(topic, article.source)
-        if not div_ok:
-            logger.info(f"  ⏭️ DIVERSITY ({div_reason}): {article.title[:50]}")
-            stats["diversity"] += 1
-            continue
+            if id(article) not in verdicts:
+                window = [
+                    a for _, a in screening[i:i + config.dedupe_window]
+                    if id(a) not in verdicts and not self._subject_full(get_features(a).topic)
+                ]
+                verdicts.update(zip((id(a) for a in window), await posted.screen_candidates(window)))
+            screen = verdicts[id(article)]
+
+            subj_ok, subj_reason = screen.subject
+            if not subj_ok:
+                decisions("SUBJECT_LIMIT", article, channel=self.profile.name, reason=subj_reason)
+                stats["subject_limit"] += 1
+                continue
+
+            dup_result = screen.duplicate
+            if dup_result.is_duplicate:
+                reason = "; ".join(dup_result.reasons[:3])
+                posted.log_rejected(article, reason)
+                stats["db_dup"] += 1
+                continue
 
-        seen_normalized_titles.add(title_normalized)
-        seen_word_signatures.add(word_sig)
-        if content_hash:
-            seen_content_hashes.add(content_hash)
+            topic = subject
+            div_ok, div_reason = screen.diversity
+            if not div_ok:
+                decisions("DIVERSITY", article, channel=self.profile.name, reason=div_reason)
+                stats["diversity"] += 1
+                continue
 
-        batch_subject_counts[subject] += 1
-        candidates.append(article)
-        stats["passed"] += 1
+            if previous is not None and previous in self.candidates:
+                self.candidates.remove(previous)
+                self.batch_subject_counts[get_features(previous).topic] -= 1
+                stats["passed"] -= 1
+            self.representatives[story] = article
+            self.batch_subject_counts[subject] += 1
+            self.candidates.append(article)
+            stats["passed"] += 1
+            decisions("PASSED", article, channel=self.profile.name, topic=topic)
+            if self.accepted is not None:
+                self.accepted.add(article.link)
+        self.cpu_time += time.perf_counter() - started
+
+    def _rank(self, articles: List[Article]) -> List[Article]:
+        if self.ranker is not None:
+            return self.ranker.rank(articles)
+        return sorted(articles, key=candidate_relevance_score, reverse=True)
+
+    async def finalize(self) -> List[Article]:
+        await self.process()
+        logger.info(
+            f"🔍 Фильтрация [{self.profile.name}]: входящих {self.incoming}, "
+            f"сюжетов {self.stories}, {self.cpu_time:.2f}s CPU | {self.stats}"
+        )
 
-    # --- НОВАЯ ЛОГИКА ПРИОРИТЕТА 3DNews ---
-    primary_candidates = [
-        article for article in candidates
-        if article.source in PRIMARY_SOURCES
-    ]
+        # --- НОВАЯ ЛОГИКА ПРИОРИТЕТА 3DNews ---
+        primary_candidates = [
+            article for article in self.candidates
+            if article.source in PRIMARY_SOURCES
+        ]
+
+        fallback_candidates = [
+            article for article in self.candidates
+            if article.source not in PRIMARY_SOURCES
+        ]
+
+        # Сначала пробуем только два главных RSS 3DNews
+        if primary_candidates:
+            primary_candidates = self._rank(primary_candidates)
+            logger.info(
+                f"⭐ Основные 3DNews-источники: "
+                f"{len(primary_candidates)} подходящих кандидатов"
+            )
+            return interleave_by_source(primary_candidates)[:5]
 
-    fallback_candidates = [
-        article for article in candidates
-        if article.source not in PRIMARY_SOURCES
-    ]
+        # Резерв включается только при полном отсутствии кандидатов 3DNews
+        fallback_candidates = self._rank(fallback_candidates)
 
-    def relevance_score(article: Article) -> int:
-        text = f"{article.title} {article.summary}"
-        if any(kw in text.lower() for kw in BLOCK_KEYWORDS):
-            return 1000 + block_relevance_score(text)
-        return ai_relevance_score(text)
-
-    # Сначала пробуем только два главных RSS 3DNews
-    if primary_candidates:
-        primary_candidates.sort(
-            key=relevance_score,
-            reverse=True
-        )
         logger.info(
-            f"⭐ Основные 3DNews-источники: "
-            f"{len(primary_candidates)} подходящих кандидатов"
+            f"🔄 В основных 3DNews нет подходящих новостей. "
+            f"Использую резервные источники: {len(fallback_candidates)} кандидатов"
         )
-        return interleave_by_source(primary_candidates)[:5]
 
-    # Резерв включается только при полном отсутствии кандидатов 3DNews
-    fallback_candidates.sort(
-        key=relevance_score,
-        reverse=True
-    )
+        return interleave_by_source(fallback_candidates)[:5]
 
-    logger.info(
-        f"🔄 В основных 3DNews нет подходящих новостей. "
-        f"Использую резервные источники: {len(fallback_candidates)} кандидатов"
-    )
 
-    return interleave_by_source(fallback_candidates)[:5]
+async def filter_and_dedupe(
+    articles: List[Article],
+    posted: AsyncPostedManager,
+    accepted: Optional[Set[str]] = None
+) -> List[Article]:
+    candidate_filter = CandidateFilter(posted, accepted)
+    candidate_filter.add(articles)
+    return await candidate_filter.finalize()
 
 
-def rotate_candidates(candidates: List[Article], posted: PostedManager) -> List[Article]:
-    recent = posted.get_recent_posts(config.rotation_history_size)
+async def rotate_candidates(candidates: List[Article], posted: AsyncPostedManager) -> List[Article]:
+    rules = posted.profile
+    recent = await posted.get_recent_posts(rules.rule("rotation_history_size"))
     if not recent:
         return candidates
 
@@ -1090,7 +3832,9 @@ def rotate_candidates(candidates: List[Article], posted: PostedManager) -> List[
     source_counts: Dict[str, int] = {}
     for src in recent_sources:
         source_counts[src] = source_counts.get(src, 0) + 1
-    last_n_sources = recent_sources[:config.source_min_posts_between]
+    min_between = rules.rule("source_min_posts_between")
+    max_in_window = rules.rule("source_max_in_window")
+    last_n_sources = recent_sources[:min_between]
 
     priority: List[Article] = []
     deprioritized: List[Article] = []
@@ -1098,11 +3842,10 @@ def rotate_candidates(candidates: List[Article], posted: PostedManager) -> List[
     for art in candidates:
         src = art.source
         if src in last_n_sources:
-            pos = last_n_sources.index(src) + 1
-            logger.info(f"   ⬇️ DEPRIO [src {src}] был {pos}-м из последних {config.source_min_posts_between}: {art.title[:40]}")
+            decisions("DEPRIO", art, channel=rules.name, recent_position=last_n_sources.index(src) + 1)
             deprioritized.append(art)
-        elif source_counts.get(src, 0) >= config.source_max_in_window:
-            logger.info(f"   ⬇️ DEPRIO [src {src}] x{source_counts[src]} в истории: {art.title[:40]}")
+        elif source_counts.get(src, 0) >= max_in_window:
+            decisions("DEPRIO", art, channel=rules.name, in_window=source_counts[src])
             deprioritized.append(art)
         else:
             priority.append(art)
@@ -1120,127 +3863,279 @@ DISCLAIMER = (
 )
 
 
-def has_repeated_sentences(text: str, max_repeats: int = 2) -> bool:
-    sentences = re.split(r'[.!?]\s+', text)
-    sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-    if len(sentences) < 2:
-        return False
-    repeat_count = 0
-    checked = []
-    for sent in sentences:
-        for prev in checked:
-            sim = calculate_similarity(sent, prev)
-            if sim > 0.6:
-                repeat_count += 1
-                if repeat_count >= max_repeats:
-                    return True
-        checked.append(sent)
-    return False
-
-
-def count_sentences(text: str) -> int:
-    parts = re.split(r'[.!?]+(?:\s+|$)', text.strip())
-    return len([p for p in parts if p.strip()])
-
-
-# ====================== ИСПРАВЛЕННАЯ strip_service_lines ======================
-def strip_service_lines(text: str) -> str:
-    lines = text.split('\n')
-    cleaned_lines = []
-
-    for line in lines:
-        line_stripped = line.strip()
-        # Удаляем строки, начинающиеся с маркеров разделов (добавлены Вступление, Суть, Значение, Последствия)
-        if re.match(
-            r'^(НОВОСТЬ|Заголовок|Содержание|Источник|ПОСТ|'
-            r'Вступление|Суть|Значение|Последствия|'
-            r'НОВОСТЬ\s*:|Заголовок\s*:|Содержание\s*:|Источник\s*:|ПОСТ\s*:|'
-            r'Вступление\s*:|Суть\s*:|Значение\s*:|Последствия\s*:)\s*',
-            line_stripped,
-            re.IGNORECASE
-        ):
-            continue
-        cleaned_lines.append(line)
-
-    text = '\n'.join(cleaned_lines)
-
-    # Удаляем сами маркеры из текста (если они остались в середине)
-    text = re.sub(r'\b(Вступление|Суть|Значение|Последствия)\s*[:：]\s*', '', text, flags=re.IGNORECASE)
-
-    return text.strip()
-
-
-def is_valid_post_text(text: Optional[str], min_len: int) -> Tuple[bool, str]:
-    if text is None:
-        return False, "TEXT_NONE"
-
-    cleaned = text.strip()
-
-    if not cleaned:
-        return False, "TEXT_EMPTY"
-
-    if cleaned in {".", "...", "-", "—", ":"}:
-        return False, "TEXT_PUNCT_ONLY"
-
-    if cleaned.lower() in {"skip", "none", "null", "undefined"}:
-        return False, "TEXT_SERVICE_VALUE"
-
-    if len(cleaned) < min_len:
-        return False, f"TEXT_TOO_SHORT ({len(cleaned)} < {min_len})"
-
-    letters = sum(ch.isalpha() for ch in cleaned)
-    if letters < 50:
-        return False, f"TEXT_TOO_FEW_LETTERS ({letters})"
-
-    sentence_count = count_sentences(cleaned)
-    if sentence_count < 3:
-        return False, f"TEXT_TOO_FEW_SENTENCES ({sentence_count})"
-
-    if re.fullmatch(r'[\W_]+', cleaned, flags=re.UNICODE):
-        return False, "TEXT_NON_ALNUM_ONLY"
-
-    if re.search(
+# ====================== ВАЛИДАЦИЯ ПОСТА ======================
+WATER_PHRASES = (
+    "стоит отметить", "важно понимать", "интересно, что",
+    "давайте разберёмся", "как мы знаем", "не секрет",
+    "нельзя не отметить", "следует подчеркнуть",
+    "почему это важно", "для чего это важно",
+    "это важно потому что", "это меняет всё",
+    "это открывает возможности", "это меняет правила",
+    "может привести", "можно ожидать", "вероятно", "возможно",
+    "отражает экспертизу", "укрепит позиции", "пользователи могут рассчитывать",
+)
+POST_LINK_MARKER = '\n\n🔗 <a href="'
+
+
+@dataclass(frozen=True)
+class PostVerdict:
+    ok: bool
+    reasons: Tuple[str, ...]
+    body: str           # очищенный текст, с точкой в конце
+    water: int = 0
+
+
+@dataclass(frozen=True)
+class GeneratedPost:
+    text: str           # готовый пост: тело, хештеги, ссылка, дисклеймер
+    verdict: PostVerdict
+
+    @classmethod
+    def from_text(cls, text: str) -> "GeneratedPost":
+        # Для постов из очереди: тело отделяется от ссылки и проверяется один раз
+        return cls(text=text, verdict=post_validator.validate(text.split(POST_LINK_MARKER, 1)[0]))
+
+
+class RepeatTracker:
+    # Повтор — пара предложений с SequenceMatcher.ratio() > threshold, как в calculate_similarity.
+    # Матчер каждого предложения строится один раз; дешёвые верхние оценки
+    # real_quick_ratio()/quick_ratio() отсекают непохожие пары до полного ratio()
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.matchers: List[difflib.SequenceMatcher] = []
+        self.pairs = 0
+
+    def add(self, sentence: str) -> int:
+        sentence = sentence.strip().lower()
+        if len(sentence) <= 20:
+            return self.pairs
+        for matcher in self.matchers:
+            matcher.set_seq1(sentence)
+            if (matcher.real_quick_ratio() > self.threshold and matcher.quick_ratio() > self.threshold
+                    and matcher.ratio() > self.threshold):
+                self.pairs += 1
+        self.matchers.append(difflib.SequenceMatcher(None, b=sentence))
+        return self.pairs
+
+
+class PostValidator:
+    # Один проход по ответу модели: чистка служебных строк, разбиение на предложения,
+    # все проверки и итоговый вердикт со всеми причинами
+    SERVICE_LINE_RE = re.compile(
+        r'^(НОВОСТЬ|Заголовок|Содержание|Источник|ПОСТ|Вступление|Суть|Значение|Последствия)',
+        re.IGNORECASE
+    )
+    INLINE_MARKER_RE = re.compile(r'\b(Вступление|Суть|Значение|Последствия)\s*[:：]\s*', re.IGNORECASE)
+    SENTENCE_RE = re.compile(r'[.!?]+(?:\s+|$)')
+    REPEAT_SPLIT_RE = re.compile(r'[.!?]\s+')
+    NON_ALNUM_RE = re.compile(r'[\W_]+')
+    BAD_ENDING_RE = re.compile(
         r'\b(и|в|на|с|по|для|от|из|за|до|не|что|как|это|все|его|она|они|мы|вы|он|но|то|так|уже|или|ещё|еще|при|без|тоже|также|будет|была|были|быть|может|этот|эта|эти|тот|того|этого|свой|свои)\s*$',
-        cleaned,
         re.IGNORECASE
-    ):
-        return False, "TEXT_ENDS_BADLY"
+    )
+    SERVICE_PREFIXES = ("ПОСТ:", "НОВОСТЬ:", "ЗАГОЛОВОК:", "СОДЕРЖАНИЕ:", "ИСТОЧНИК:")
+
+    def __init__(self, min_len: int, max_len: int, max_repeats: int, repeat_threshold: float = 0.6):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.max_repeats = max_repeats
+        self.repeat_threshold = repeat_threshold
+
+    def strip_prefixes(self, text: str) -> str:
+        text = text.strip()
+        for pref in self.SERVICE_PREFIXES:
+            if text.upper().startswith(pref):
+                text = text[len(pref):].strip()
+        return text
+
+    def clean(self, text: str) -> str:
+        text = self.strip_prefixes(text)
+        lines = [line for line in text.split('\n') if not self.SERVICE_LINE_RE.match(line.strip())]
+        return self.INLINE_MARKER_RE.sub('', '\n'.join(lines)).strip()
+
+    def repeated_pairs(self, text: str) -> int:
+        tracker = RepeatTracker(self.repeat_threshold)
+        for sentence in self.REPEAT_SPLIT_RE.split(text):
+            tracker.add(sentence)
+        return tracker.pairs
+
+    def validate(self, text: Optional[str]) -> PostVerdict:
+        if text is None:
+            return PostVerdict(False, ("TEXT_NONE",), "")
+        cleaned = self.clean(text)
+        if not cleaned:
+            return PostVerdict(False, ("TEXT_EMPTY",), "")
+        if cleaned in {".", "...", "-", "—", ":"}:
+            return PostVerdict(False, ("TEXT_PUNCT_ONLY",), cleaned)
+        if cleaned.lower() in {"skip", "none", "null", "undefined"}:
+            return PostVerdict(False, ("TEXT_SERVICE_VALUE",), cleaned)
+
+        reasons = []
+        if len(cleaned) < self.min_len:
+            reasons.append(f"TEXT_TOO_SHORT ({len(cleaned)} < {self.min_len})")
+        if len(cleaned) > self.max_len:
+            reasons.append(f"TEXT_TOO_LONG ({len(cleaned)} > {self.max_len})")
+        letters = sum(ch.isalpha() for ch in cleaned)
+        if letters < 50:
+            reasons.append(f"TEXT_TOO_FEW_LETTERS ({letters})")
+        sentences = len([p for p in self.SENTENCE_RE.split(cleaned) if p.strip()])
+        if sentences < 3:
+            reasons.append(f"TEXT_TOO_FEW_SENTENCES ({sentences})")
+        if self.NON_ALNUM_RE.fullmatch(cleaned):
+            reasons.append("TEXT_NON_ALNUM_ONLY")
+        if self.BAD_ENDING_RE.search(cleaned):
+            reasons.append("TEXT_ENDS_BADLY")
+        if not cleaned[0].isupper():
+            reasons.append("TEXT_NOT_CAPITALIZED")
+        lower = cleaned.lower()
+        water = sum(phrase in lower for phrase in WATER_PHRASES)
+        if water >= 3:
+            reasons.append(f"TEXT_WATER ({water})")
+        repeats = self.repeated_pairs(cleaned)
+        if repeats >= self.max_repeats:
+            reasons.append(f"TEXT_REPEATED_SENTENCES ({repeats})")
+
+        body = cleaned if cleaned.endswith(('.', '!', '?')) else cleaned + '.'
+        return PostVerdict(not reasons, tuple(reasons), body, water)
+
+
+post_validator = PostValidator(config.min_post_length, config.max_post_length, config.max_repeat_sentences)
+# Тело плюс хештеги, ссылка и дисклеймер должны влезть в одно сообщение Telegram
+POST_OVERHEAD = len(DISCLAIMER) + max(map(len, Topic.HASHTAGS.values())) + len(POST_LINK_MARKER) + config.source_url_allowance
+if config.max_post_length + POST_OVERHEAD > config.telegram_message_limit:
+    raise ValueError(
+        f"max_post_length={config.max_post_length} не оставляет {POST_OVERHEAD} символов "
+        f"на хештеги, ссылку и дисклеймер в лимите {config.telegram_message_limit}"
+    )
 
-    return True, "OK"
 
+class StreamGuard:
+    # Проверки по мере поступления ответа. Поток рвётся, только когда итоговый вердикт
+    # уже не может быть положительным: проверяется устойчивая часть текста — без
+    # недописанной строки короче самого длинного служебного маркера
+    STABLE_LINE = 12
+    TRIGGERS = frozenset('.!?\n')
+
+    def __init__(self, validator: PostValidator, check_skip: bool):
+        self.validator = validator
+        self.check_skip = check_skip
+        self.parts: List[str] = []
+        self.length = 0
+        self.checked_at = 0
+        self.tracker = RepeatTracker(validator.repeat_threshold)
+        self.sentences = 0
+
+    def feed(self, delta: str) -> Optional[str]:
+        self.parts.append(delta)
+        self.length += len(delta)
+        # Проверяем на концах предложений и строк, плюс раз в ~40 символов
+        if not (self.TRIGGERS & set(delta)) and self.length - self.checked_at < 40:
+            return None
+        self.checked_at = self.length
+        text = ''.join(self.parts)
+
+        head = self.validator.strip_prefixes(text)
+        if self.check_skip and "SKIP" in head.upper()[:10]:
+            return "SKIP"
+
+        last_break = text.rfind('\n')
+        if len(text[last_break + 1:].strip()) < self.STABLE_LINE:
+            text = text[:max(last_break, 0)]
+        cleaned = self.validator.clean(text)
+        if not cleaned:
+            return None
+
+        first_line = cleaned.split('\n', 1)[0]
+        if ('\n' in cleaned or len(first_line) >= self.STABLE_LINE) and not cleaned[0].isupper():
+            return "TEXT_NOT_CAPITALIZED"
+        if len(cleaned) > self.validator.max_len:
+            return f"TEXT_TOO_LONG ({len(cleaned)} > {self.validator.max_len})"
+        lower = cleaned.lower()
+        water = sum(phrase in lower for phrase in WATER_PHRASES)
+        if water >= 3:
+            return f"TEXT_WATER ({water})"
+        sentences = self.validator.REPEAT_SPLIT_RE.split(cleaned)[:-1]
+        for sentence in sentences[self.sentences:]:
+            if self.tracker.add(sentence) >= self.validator.max_repeats:
+                return f"TEXT_REPEATED_SENTENCES ({self.tracker.pairs})"
+        self.sentences = max(self.sentences, len(sentences))
+        return None
+
+
+# ====================== build_final_post ======================
+def build_final_post(article: Article, verdict: PostVerdict, topic: str) -> GeneratedPost:
+    hashtags = Topic.HASHTAGS.get(topic, Topic.HASHTAGS[Topic.GENERAL])
+    source_link = f'{POST_LINK_MARKER}{article.link}">Источник</a>'
+    final = f"{verdict.body}\n\n{hashtags}{source_link}{DISCLAIMER}"
+    return GeneratedPost(text=final.strip(), verdict=verdict)
+
+
+# ====================== ПРОМПТ И УЧЁТ ТОКЕНОВ ======================
+# Хвосты RSS-анонсов, которые модели ничего не дают
+BOILERPLATE_RE = re.compile(
+    r'^(?:читать далее|подробнее|read more|continue reading|comments|more…|more\.\.\.)\W*$'
+    r'|^the (?:article|post) .* appeared first on .*$'
+    r'|^(?:фото|изображение|источник|image|photo|credit|подписывайтесь)\b.*$',
+    re.IGNORECASE
+)
+SUMMARY_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+SUMMARY_NOISE_RE = re.compile(r'https?://\S+|\[(?:…|\.\.\.)\]')
+CYRILLIC_RE = re.compile(r'[а-яё]', re.IGNORECASE)
+
+# gpt-oss тратит max_tokens и на рассуждение: задаём усилие и запас под него
+REASONING_EFFORT = {
+    "openai/gpt-oss-120b": "low",
+    "openai/gpt-oss-20b": "low",
+}
 
-# ====================== build_final_post (с дополнительной очисткой) ======================
-def build_final_post(article: Article, body_text: str, topic: str, skip_clean: bool = False) -> str:
-    if skip_clean:
-        text = body_text.strip()
-    else:
-        text = strip_service_lines(body_text)
 
-    # Дополнительно удаляем оставшиеся маркеры в начале строк
-    text = re.sub(r'^\s*(Вступление|Суть|Значение|Последствия)\s*[:：]\s*', '', text, flags=re.IGNORECASE | re.MULTILINE)
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка с запасом: кириллица ~3 символа на токен, остальное ~4
+    cyrillic = len(CYRILLIC_RE.findall(text))
+    return int(cyrillic / 3 + (len(text) - cyrillic) / 4) + 1
 
-    if not text.endswith(('.', '!', '?')):
-        text += '.'
 
-    hashtags = Topic.HASHTAGS.get(topic, Topic.HASHTAGS[Topic.GENERAL])
-    source_link = f'\n\n🔗 <a href="{article.link}">Источник</a>'
-    final = f"{text}\n\n{hashtags}{source_link}{DISCLAIMER}"
-    return final.strip()
+def compact_summary(title: str, summary: str, token_budget: int) -> str:
+    # Без HTML-сущностей, ссылок, служебных хвостов и повторов заголовка/предложений;
+    # предложения добавляются по порядку, пока укладываются в бюджет
+    text = SUMMARY_NOISE_RE.sub(' ', html.unescape(summary))
+    seen = {text_normalizer.analyze(title).normalized}
+    kept = []
+    tokens = 0
+    for sentence in SUMMARY_SENTENCE_RE.split(text):
+        sentence = SPACE_RE.sub(' ', sentence).strip()
+        if not sentence or BOILERPLATE_RE.match(sentence):
+            continue
+        normalized = text_normalizer.analyze(sentence).normalized
+        if not normalized or normalized in seen:
+            continue
+        cost = estimate_tokens(sentence)
+        if tokens + cost > token_budget:
+            break
+        seen.add(normalized)
+        kept.append(sentence)
+        tokens += cost
+    return ' '.join(kept)
 
 
-# ====================== ГЕНЕРАЦИЯ ПОСТА ======================
-async def generate_summary(article: Article) -> Optional[str]:
-    logger.info(f"📝 Генерация: {article.title[:55]}...")
-    text_for_topic = f"{article.title} {article.summary}"
-    topic = Topic.detect(text_for_topic)
-    is_block_topic = any(kw in text_for_topic.lower() for kw in BLOCK_KEYWORDS)
+@dataclass(frozen=True)
+class PromptPlan:
+    text: str
+    estimated_tokens: int
+    answer_tokens: int      # под пост целевой длины, без рассуждений
 
-    if is_block_topic:
-        prompt = f"""Ты — редактор Telegram-канала про блокировки и цифровые ограничения в РФ. Напиши краткий, но законченный пост по новости.
+
+def build_prompt(article: Article) -> PromptPlan:
+    is_block_topic = get_features(article).is_block
+    max_chars = 800 if is_block_topic else 1000
+
+    def render(summary: str) -> str:
+        if is_block_topic:
+            return f"""Ты — редактор Telegram-канала про блокировки и цифровые ограничения в РФ. Напиши краткий, но законченный пост по новости.
 
 НОВОСТЬ:
 Заголовок: {article.title}
-Содержание: {article.summary[:2000]}
+Содержание: {summary}
 Источник: {article.source}
 
 **Структура поста:**
@@ -1256,12 +4151,11 @@ async def generate_summary(article: Article) -> Optional[str]:
 - Пост должен быть связным и читаться как единое целое.
 
 ПОСТ:"""
-    else:
-        prompt = f"""Ты — редактор Telegram-канала про AI и технологии. Напиши краткий, но законченный пост по новости. Твой пост должен быть понятен даже тем, кто не читал исходную статью.
+        return f"""Ты — редактор Telegram-канала про AI и технологии. Напиши краткий, но законченный пост по новости. Твой пост должен быть понятен даже тем, кто не читал исходную статью.
 
 НОВОСТЬ:
 Заголовок: {article.title}
-Содержание: {article.summary[:2000]}
+Содержание: {summary}
 Источник: {article.source}
 
 **Структура поста (строго соблюдай):**
@@ -1279,85 +4173,196 @@ async def generate_summary(article: Article) -> Optional[str]:
 
 ПОСТ:"""
 
-    water_phrases = [
-        "стоит отметить", "важно понимать", "интересно, что",
-        "давайте разберёмся", "как мы знаем", "не секрет",
-        "нельзя не отметить", "следует подчеркнуть",
-        "почему это важно", "для чего это важно",
-        "это важно потому что", "это меняет всё",
-        "это открывает возможности", "это меняет правила",
-        "может привести", "можно ожидать", "вероятно", "возможно",
-        "отражает экспертизу", "укрепит позиции", "пользователи могут рассчитывать",
-    ]
+    overhead = estimate_tokens(render(""))
+    budget = max(config.prompt_token_budget - overhead, config.prompt_min_summary_tokens)
+    text = render(compact_summary(article.title, article.summary, budget))
+    answer_tokens = int(estimate_tokens("я" * max_chars) * config.completion_token_margin)
+    return PromptPlan(text=text, estimated_tokens=estimate_tokens(text), answer_tokens=answer_tokens)
+
+
+def completion_params(model: str, plan: PromptPlan) -> dict:
+    effort = REASONING_EFFORT.get(model)
+    if effort is None:
+        return {"max_tokens": plan.answer_tokens}
+    # Через extra_body: groq из нижней границы requirements (0.15) не знает этих аргументов
+    return {
+        "max_tokens": plan.answer_tokens + config.reasoning_token_allowance,
+        "extra_body": {"reasoning_effort": effort, "include_reasoning": False},
+    }
+
+
+class LLMUsage:
+    # Токены и задержка по моделям за запуск; по ним видно цену и время одного поста
+    def __init__(self):
+        self.models: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.posts = 0
+
+    def record(self, model: str, resp, latency: float, estimated: int) -> Tuple[int, int, int]:
+        usage = getattr(resp, "usage", None)
+        stats = self.models[model]
+        if usage is None:
+            # Прерванный поток приходит без usage — считаем по оценке
+            stats["aborted"] += 1
+            prompt, completion, reasoning = estimated, estimate_tokens(getattr(resp, "text", "")), 0
+        else:
+            prompt = getattr(usage, "prompt_tokens", 0) or 0
+            completion = getattr(usage, "completion_tokens", 0) or 0
+            details = getattr(usage, "completion_tokens_details", None)
+            reasoning = getattr(details, "reasoning_tokens", 0) or 0
+        stats["calls"] += 1
+        stats["prompt"] += prompt
+        stats["completion"] += completion
+        stats["reasoning"] += reasoning
+        stats["estimated"] += estimated
+        stats["latency"] += latency
+        return prompt, completion, reasoning
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for model, stats in self.models.items():
+            calls = stats["calls"]
+            result[model] = {
+                "calls": int(calls),
+                "prompt_avg": round(stats["prompt"] / calls),
+                "completion_avg": round(stats["completion"] / calls),
+                "reasoning_avg": round(stats["reasoning"] / calls),
+                "estimate_ratio": round(stats["prompt"] / max(stats["estimated"], 1), 2),
+                "latency_avg": round(stats["latency"] / calls, 2),
+                "aborted": int(stats["aborted"]),
+            }
+        return result
+
+    def per_post(self) -> Optional[Tuple[float, float]]:
+        if not self.posts:
+            return None
+        tokens = sum(s["prompt"] + s["completion"] for s in self.models.values())
+        latency = sum(s["latency"] for s in self.models.values())
+        return tokens / self.posts, latency / self.posts
+
+
+llm_usage = LLMUsage()
+
+
+@dataclass
+class StreamedCompletion:
+    text: str
+    finish_reason: Optional[str] = None
+    usage: Optional[object] = None
+    aborted: Optional[str] = None       # причина досрочной остановки потока
+
+
+def stream_completion(model: str, plan: PromptPlan, temperature: float,
+                      guard: Optional[StreamGuard] = None) -> StreamedCompletion:
+    # Выполняется в потоке: читает ответ по кускам и рвёт соединение, как только
+    # StreamGuard видит, что текст уже не пройдёт проверку
+    params = dict(model=model, temperature=temperature,
+                  messages=[{"role": "user", "content": plan.text}], **completion_params(model, plan))
+    if not config.llm_streaming:
+        resp = groq_client.chat.completions.create(**params)
+        choice = resp.choices[0]
+        return StreamedCompletion(choice.message.content or "", choice.finish_reason, resp.usage)
+
+    stream = groq_client.chat.completions.create(stream=True, **params)
+    result = StreamedCompletion(text="")
+    parts: List[str] = []
+    try:
+        for chunk in stream:
+            # Старые версии groq не объявляют usage/x_groq у чанков потока
+            x_groq = getattr(chunk, "x_groq", None)
+            usage = getattr(x_groq, "usage", None) if x_groq else getattr(chunk, "usage", None)
+            if usage is not None:
+                result.usage = usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta.content or ""
+            if delta:
+                parts.append(delta)
+                if guard is not None:
+                    result.aborted = guard.feed(delta)
+                    if result.aborted:
+                        break
+            if choice.finish_reason:
+                result.finish_reason = choice.finish_reason
+    finally:
+        stream.close()
+    result.text = ''.join(parts)
+    return result
+
+
+# ====================== ГЕНЕРАЦИЯ ПОСТА ======================
+async def generate_summary(
+    article: Article,
+    record: Optional[GenerationRecord] = None
+) -> Optional[GeneratedPost]:
+    logger.info(f"📝 Генерация: {article.title[:55]}...")
+    record = record or GenerationRecord()
+    features = get_features(article)
+    topic = features.topic
+    is_block_topic = features.is_block
+    plan = build_prompt(article)
+    logger.info(
+        f"  🧾 Промпт ~{plan.estimated_tokens} токенов (анонс {len(article.summary)} симв.), "
+        f"ответ ≤{plan.answer_tokens}"
+    )
 
     for model in GROQ_MODELS:
         for attempt in range(config.groq_retries_per_model):
             try:
-                await asyncio.sleep(1)
+                await asyncio.sleep(config.groq_call_delay)
                 logger.info(f"  🤖 {model} (попытка {attempt + 1})")
 
                 temp = 0.8 if attempt == 1 else 0.7
-
-                resp = await asyncio.to_thread(
-                    groq_client.chat.completions.create,
-                    model=model,
-                    temperature=temp,
-                    max_tokens=1500,
-                    messages=[{"role": "user", "content": prompt}],
+                record.calls += 1
+
+                started = time.perf_counter()
+                guard = StreamGuard(post_validator, check_skip=not is_block_topic)
+                completion = await asyncio.to_thread(stream_completion, model, plan, temp, guard)
+                latency = time.perf_counter() - started
+                prompt_tokens, completion_tokens, reasoning_tokens = llm_usage.record(
+                    model, completion, latency, plan.estimated_tokens
+                )
+                record.prompt_tokens += prompt_tokens
+                record.completion_tokens += completion_tokens
+                record.latency += latency
+                raw_text = completion.text.strip()
+                logger.info(
+                    f"  ℹ️ [{model}] raw_len={len(raw_text)} токены {prompt_tokens}+{completion_tokens}"
+                    f"{f' (рассуждение {reasoning_tokens})' if reasoning_tokens else ''}, "
+                    f"{latency:.1f}s, {completion.aborted or completion.finish_reason}"
                 )
-                raw_text = resp.choices[0].message.content or ""
-                raw_text = raw_text.strip()
-
-                logger.info(f"  ℹ️ [{model}] raw_len={len(raw_text)}")
-
-                # Специальная очистка (для всех моделей)
-                for pref in ["ПОСТ:", "НОВОСТЬ:", "Заголовок:", "Содержание:", "Источник:"]:
-                    if raw_text.upper().startswith(pref.upper()):
-                        raw_text = raw_text[len(pref):].strip()
-                cleaned_text = strip_service_lines(raw_text)
-
-                logger.info(f"  ℹ️ [{model}] cleaned_len={len(cleaned_text)}")
 
-                if not is_block_topic and "SKIP" in raw_text.upper()[:10]:
+                if completion.aborted == "SKIP" or (
+                        not is_block_topic and "SKIP" in post_validator.strip_prefixes(raw_text).upper()[:10]):
                     logger.info("  ⏭️ SKIP (не подходит)")
+                    record.outcome = "skip"
                     return None
 
-                ok, reason = is_valid_post_text(cleaned_text, config.min_post_length)
-                if not ok:
-                    logger.warning(f"  ⚠️ [{model}] reject before final build: {reason}")
-                    continue
-
-                if cleaned_text and not cleaned_text[0].isupper():
-                    logger.warning("  ⚠️ Текст не начинается с заглавной буквы, перегенерация...")
-                    continue
-
-                water_count = sum(1 for phrase in water_phrases if phrase in cleaned_text.lower())
-                if water_count >= 3:
-                    logger.warning(f"  ⚠️ Штампы ({water_count}), перегенерация...")
-                    if attempt == config.groq_retries_per_model - 1:
-                        logger.warning("  ⏭️ Пропускаем из-за штампов")
-                        return None
-                    continue
-
-                if has_repeated_sentences(cleaned_text, config.max_repeat_sentences):
-                    logger.warning("  ⚠️ Повторяющиеся предложения, следующая модель...")
+                if completion.aborted:
+                    verdict = PostVerdict(False, (completion.aborted,), raw_text)
+                else:
+                    verdict = post_validator.validate(raw_text)
+                logger.info(f"  ℹ️ [{model}] cleaned_len={len(verdict.body)}")
+
+                if not verdict.ok:
+                    logger.warning(f"  ⚠️ [{model}] reject: {'; '.join(verdict.reasons)}")
+                    record.outcome = "invalid"
+                    # Штампы при прочих равных — повторяем; на последней попытке статью пропускаем
+                    if verdict.reasons[0].startswith("TEXT_WATER"):
+                        record.outcome = "water"
+                        if attempt == config.groq_retries_per_model - 1:
+                            logger.warning("  ⏭️ Пропускаем из-за штампов")
+                            return None
                     continue
 
-                skip_clean = True
-                final = build_final_post(article, cleaned_text, topic, skip_clean=skip_clean)
-
+                record.outcome = "ok"
+                llm_usage.posts += 1
+                post = build_final_post(article, verdict, topic)
                 logger.info(
-                    f"  ℹ️ [{model}] final_len={len(final)} preview={final[:120].replace(chr(10), ' ')}"
+                    f"  ✅ [{model}]: body={len(verdict.body)} symb, final={len(post.text)} symb "
+                    f"preview={post.text[:120].replace(chr(10), ' ')}"
                 )
-
-                body_part = final.split('\n\n🔗 <a href="', 1)[0].strip()
-                ok_final, reason_final = is_valid_post_text(body_part, config.min_post_length)
-                if not ok_final:
-                    logger.warning(f"  ⚠️ [{model}] reject after final build: {reason_final}")
-                    continue
-
-                logger.info(f"  ✅ [{model}]: body={len(cleaned_text)} symb, final={len(final)} symb")
-                return final
+                return post
 
             except Exception as e:
                 error_str = str(e).lower()
@@ -1371,36 +4376,150 @@ async def generate_summary(article: Article) -> Optional[str]:
     return None
 
 
-# ====================== ОСТАЛЬНОЙ КОД (без изменений) ======================
-async def post_article(article: Article, text: str, posted: PostedManager) -> bool:
-    topic = Topic.detect(f"{article.title} {article.summary}")
+# ====================== ДОСТАВКА В TELEGRAM ======================
+class TelegramDelivery:
+    SENT = "sent"
+    DEFERRED = "deferred"
+    FAILED = "failed"
+
+    def __init__(self):
+        self._chat_locks: Dict[str, asyncio.Lock] = {}
+        self._chat_ready_at: Dict[str, float] = {}
+        self._global_lock = asyncio.Lock()
+        self._global_sent: deque = deque()
+        self.stats = defaultdict(int)
+
+    async def _pace(self, chat_id: str):
+        wait = self._chat_ready_at.get(chat_id, 0.0) - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with self._global_lock:
+            while True:
+                now = time.monotonic()
+                while self._global_sent and now - self._global_sent[0] >= 1.0:
+                    self._global_sent.popleft()
+                if len(self._global_sent) < config.telegram_global_rate:
+                    break
+                await asyncio.sleep(1.0 - (now - self._global_sent[0]))
+            self._global_sent.append(time.monotonic())
+
+    async def send(self, chat_id: str, text: str) -> Tuple[str, str, float]:
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            last_error = ""
+            for attempt in range(config.telegram_send_retries):
+                await self._pace(chat_id)
+                try:
+                    await bot.send_message(chat_id, text, disable_web_page_preview=False)
+                    self._chat_ready_at[chat_id] = time.monotonic() + config.telegram_chat_interval
+                    self.stats["sent"] += 1
+                    return self.SENT, "", 0.0
+                except TelegramRetryAfter as e:
+                    self.stats["retry_after"] += 1
+                    self._chat_ready_at[chat_id] = time.monotonic() + e.retry_after
+                    last_error = f"RetryAfter {e.retry_after}s"
+                    if e.retry_after > config.telegram_max_retry_wait:
+                        logger.warning(f"  ⏳ Flood control {chat_id}: {e.retry_after}s — откладываем")
+                        return self.DEFERRED, last_error, float(e.retry_after)
+                    logger.warning(f"  ⏳ Flood control {chat_id}: ждём {e.retry_after}s")
+                except (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound,
+                        TelegramUnauthorizedError, TelegramEntityTooLarge) as e:
+                    self.stats["failed"] += 1
+                    return self.FAILED, str(e), 0.0
+                except Exception as e:
+                    # Сетевые и серверные ошибки: экспоненциальная пауза с jitter
+                    self.stats["network_retry"] += 1
+                    last_error = str(e) or type(e).__name__
+                    delay = random.uniform(0, config.telegram_retry_base_delay * (2 ** attempt))
+                    logger.warning(f"  ⚠️ Telegram {chat_id} попытка {attempt + 1}: {last_error}, пауза {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            self.stats["deferred"] += 1
+            return self.DEFERRED, last_error, config.telegram_retry_base_delay * (2 ** config.telegram_send_retries)
+
+    async def deliver(self, posted: AsyncPostedManager, item: dict) -> str:
+        article = item['article']
+        channel = posted.profile
+        # «sending» до вызова API: упади процесс после отправки, следующий запуск
+        # сверит пост с историей, а не пошлёт его второй раз
+        if not await posted.outbox_claim(item['id']):
+            logger.warning(f"📮 [{channel.name}] Пост уже не ждёт отправки: {article.title[:50]}")
+            return self.FAILED
+        status, error, retry_in = await self.send(channel.channel_id, item['text'])
+        if status == self.SENT:
+            logger.info(f"✅ ОПУБЛИКОВАНО [{channel.name}][{item['topic']}][{article.source}]: {article.title[:50]}")
+            saved = await posted.outbox_sent(item['id'], article, item['topic'], item['topic'])
+            if not saved:
+                logger.warning(f"⚠️ Пост отправлен, но не сохранён в БД (возможно дубль): {article.title[:50]}")
+        elif status == self.DEFERRED:
+            await posted.outbox_defer(item['id'], retry_in, error)
+            logger.warning(f"📮 Отложено в outbox [{channel.name}] ({error}): {article.title[:50]}")
+        else:
+            await posted.outbox_fail(item['id'], error)
+            logger.error(f"❌ Telegram ошибка отправки [{channel.name}]: {error}")
+        return status
+
+
+async def flush_outbox(channels: List[AsyncPostedManager]) -> Set[str]:
+    # Доставка отложенных постов прошлых запусков; чаты отправляются параллельно
+    async def flush_channel(posted: AsyncPostedManager) -> bool:
+        delivered = False
+        confirmed, unconfirmed = await posted.outbox_reconcile()
+        if confirmed or unconfirmed:
+            logger.warning(
+                f"📮 [{posted.profile.name}] Outbox: прерванных отправок {confirmed + unconfirmed}, "
+                f"из них в истории {confirmed}; остальные не досылаем (SEND_UNCONFIRMED)"
+            )
+        expired = await posted.outbox_expire()
+        if expired:
+            logger.warning(
+                f"📮 [{posted.profile.name}] Outbox: {expired} постов не ушли за "
+                f"{config.outbox_max_attempts} попыток или {config.outbox_max_age_hours} ч — failed"
+            )
+        for item in await posted.get_outbox(due_only=True):
+            article = item['article']
+            # Пока пост ждал, ту же историю могли опубликовать
+            dup_result = await posted.is_duplicate(article.link, article.title, article.summary)
+            if dup_result.is_duplicate:
+                reason = f"FINAL_DUP: {'; '.join(dup_result.reasons[:2])}"
+                await posted.outbox_fail(item['id'], reason)
+                posted.log_rejected(article, reason)
+                logger.info(f"📮 [{posted.profile.name}] Outbox: дубль, не досылаем: {article.title[:50]}")
+                continue
+            if await delivery.deliver(posted, item) == TelegramDelivery.SENT:
+                delivered = True
+        return delivered
+
+    results = await asyncio.gather(*(flush_channel(p) for p in channels))
+    return {p.profile.channel_id for p, ok in zip(channels, results) if ok}
+
+
+# ====================== ПУБЛИКАЦИЯ ПОСТА ======================
+async def post_article(article: Article, post: GeneratedPost, posted: AsyncPostedManager) -> bool:
+    topic = get_features(article).topic
     subject = topic
-    body_part = text.split('\n\n🔗 <a href="', 1)[0].strip()
-    ok, reason = is_valid_post_text(body_part, config.min_post_length)
+    channel = posted.profile
+    text = post.text
+    body_part = post.verdict.body
 
-    if not ok:
+    # Вердикт получен один раз — при генерации или при чтении из очереди
+    if not post.verdict.ok:
         logger.error(
-            f"❌ POST_REJECTED_BEFORE_SEND: {reason} | "
+            f"❌ POST_REJECTED_BEFORE_SEND: {'; '.join(post.verdict.reasons)} | "
             f"body_len={len(body_part)} | final_len={len(text)} | "
             f"title={article.title[:80]}"
         )
         return False
 
-    try:
-        logger.info(
-            f"  📤 Отправка поста... body_len={len(body_part)} "
-            f"final_len={len(text)} preview={body_part[:120].replace(chr(10), ' ')}"
-        )
-        await bot.send_message(config.channel_id, text, disable_web_page_preview=False)
-        logger.info(f"✅ ОПУБЛИКОВАНО [{topic}][{article.source}]: {article.title[:50]}")
-    except Exception as e:
-        logger.error(f"❌ Telegram ошибка отправки: {e}")
-        return False
-
-    saved = posted.add(article, topic, subject)
-    if not saved:
-        logger.warning(f"⚠️ Пост отправлен, но не сохранён в БД (возможно дубль): {article.title[:50]}")
-    return True
+    logger.info(
+        f"  📤 Отправка поста [{channel.name}]... body_len={len(body_part)} "
+        f"final_len={len(text)} preview={body_part[:120].replace(chr(10), ' ')}"
+    )
+    # Сначала в outbox: при flood control / сбое сети пост не теряется
+    item_id = await posted.outbox_add(article, text, subject)
+    item = {'id': item_id, 'article': article, 'text': text, 'topic': topic}
+    status = await delivery.deliver(posted, item)
+    # Отложенный пост будет доставлен следующим запуском — новый не генерируем
+    return status != TelegramDelivery.FAILED
 
 
 async def check_telegram_connection() -> bool:
@@ -1417,8 +4536,167 @@ async def check_telegram_connection() -> bool:
         return False
 
 
-async def main():
+async def generate_with_lease(
+    article: Article,
+    coordinator: AsyncRunCoordinator,
+    generated: Dict[str, Optional[GeneratedPost]],
+    ranker: Optional[CandidateRanker] = None
+) -> Optional[GeneratedPost]:
+    key = normalize_url(article.link)
+    if key in generated:
+        return generated[key]
+    lease = f"generate:{key}"
+    if not await coordinator.acquire(lease, config.lease_ttl_seconds):
+        logger.info(f"  ⏭️ Генерирует другой запуск: {article.title[:50]}")
+        return None
+    record = GenerationRecord()
+    try:
+        generated[key] = await generate_summary(article, record)
+    finally:
+        await coordinator.release(lease)
+    if ranker is not None:
+        ranker.record(article, record)
+    return generated[key]
+
+
+async def publish_for_channel(
+    candidates: List[Article],
+    posted: AsyncPostedManager,
+    coordinator: AsyncRunCoordinator,
+    generated: Dict[str, Optional[GeneratedPost]],
+    shutdown_event: asyncio.Event,
+    ranker: Optional[CandidateRanker] = None
+) -> bool:
+    profile = posted.profile
+
+    if not candidates:
+        logger.info(f"📭 [{profile.name}] Нет подходящих новостей.")
+        return False
+
+    candidates = await rotate_candidates(candidates, posted)
+
+    logger.info(f"🎯 [{profile.name}] Топ-10 кандидатов после ротации:")
+    for i, c in enumerate(candidates[:10]):
+        logger.info(f"  {i+1}. [{get_features(c).topic}] [{c.source}] {c.title[:55]}")
+
+    for article in candidates[:25]:
+        if shutdown_event.is_set():
+            logger.info("🛑 Прерывание в цикле публикации")
+            break
+
+        dup_result = await posted.is_duplicate(article.link, article.title, article.summary)
+        if dup_result.is_duplicate:
+            posted.log_rejected(article, f"FINAL_DUP: {'; '.join(dup_result.reasons[:2])}")
+            continue
+
+        post = await generate_with_lease(article, coordinator, generated, ranker)
+        if not post:
+            posted.log_rejected(article, "GENERATION_FAILED")
+            continue
+
+        posted_ok = await post_article(article, post, posted)
+        if posted_ok:
+            logger.info(f"🏁 Готово [{profile.name}]!")
+            return True
+        else:
+            posted.log_rejected(article, "POST_VALIDATION_OR_SEND_FAILED")
+
+        await asyncio.sleep(config.post_retry_delay)
+
+    logger.info(f"😔 [{profile.name}] Не удалось опубликовать ни одну статью.")
+    return False
+
+
+async def send_from_queue(posted: AsyncPostedManager, shutdown_event: asyncio.Event) -> bool:
+    profile = posted.profile
+    await posted.evict_stale_queue(config.queue_max_age_hours)
+    queued = await posted.get_queued_posts()
+    if not queued:
+        logger.info(f"📭 [{profile.name}] Очередь пуста")
+        return False
+
+    logger.info(f"📬 [{profile.name}] В очереди: {len(queued)}")
+    for item in queued:
+        if shutdown_event.is_set():
+            logger.info("🛑 Прерывание в отправке из очереди")
+            break
+
+        article = item['article']
+        age_hours = (datetime.now(timezone.utc) - article.published).total_seconds() / 3600
+        if age_hours > config.max_article_age_hours:
+            decisions("QUEUE_TOO_OLD", article, channel=posted.profile.name, age_hours=round(age_hours))
+            await posted.remove_queued(item['id'])
+            continue
+
+        dup_result = await posted.is_duplicate(article.link, article.title, article.summary)
+        if dup_result.is_duplicate:
+            posted.log_rejected(article, f"QUEUE_DUP: {'; '.join(dup_result.reasons[:2])}")
+            await posted.remove_queued(item['id'])
+            continue
+
+        posted_ok = await post_article(article, GeneratedPost.from_text(item['text']), posted)
+        await posted.remove_queued(item['id'])
+        if posted_ok:
+            logger.info(f"🏁 Готово из очереди [{profile.name}]!")
+            return True
+        posted.log_rejected(article, "QUEUE_SEND_FAILED")
+
+    return False
+
+
+async def prepare_for_channel(
+    candidates: List[Article],
+    posted: AsyncPostedManager,
+    coordinator: AsyncRunCoordinator,
+    generated: Dict[str, Optional[GeneratedPost]],
+    shutdown_event: asyncio.Event,
+    ranker: Optional[CandidateRanker] = None
+) -> int:
+    profile = posted.profile
+    await posted.evict_stale_queue(config.queue_max_age_hours)
+    need = config.queue_target_size - await posted.queue_size()
+    if need <= 0:
+        logger.info(f"📦 [{profile.name}] Очередь заполнена ({config.queue_target_size})")
+        return 0
+
+    if not candidates:
+        logger.info(f"📭 [{profile.name}] Нет подходящих новостей для очереди.")
+        return 0
+    candidates = await rotate_candidates(candidates, posted)
+    queued_urls = await posted.get_queued_urls()
+
+    added = 0
+    for article in candidates[:25]:
+        if added >= need or shutdown_event.is_set():
+            break
+
+        key = normalize_url(article.link)
+        if key in queued_urls:
+            continue
+
+        dup_result = await posted.is_duplicate(article.link, article.title, article.summary)
+        if dup_result.is_duplicate:
+            posted.log_rejected(article, f"FINAL_DUP: {'; '.join(dup_result.reasons[:2])}")
+            continue
+
+        post = await generate_with_lease(article, coordinator, generated, ranker)
+        if not post:
+            posted.log_rejected(article, "GENERATION_FAILED")
+            continue
+
+        if await posted.enqueue_post(article, post.text, get_features(article).topic):
+            queued_urls.add(key)
+            added += 1
+
+    logger.info(f"📦 [{profile.name}] Подготовлено: {added}, в очереди: {await posted.queue_size()}")
+    return added
+
+
+async def main(mode: str = "run"):
+    global feed_archive
     shutdown_event = asyncio.Event()
+    decisions.reset()
+    feed_archive = FeedArchive(config.feed_archive_dir) if config.feed_archive_dir else None
 
     def signal_handler(signum, frame):
         logger.info(f"🛑 Получен сигнал {signum}, завершаем...")
@@ -1427,123 +4705,164 @@ async def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    lock_file = "bot.lock"
-
-    if os.path.exists(lock_file):
-        try:
-            with open(lock_file) as f:
-                old_pid = int(f.read().strip())
-            if os.path.exists(f"/proc/{old_pid}"):
-                logger.error(f"❌ Бот уже запущен (PID {old_pid})! Удалите bot.lock если это ошибка.")
-                return
-            else:
-                logger.warning(f"⚠️ Найден устаревший lock (PID {old_pid} не существует), удаляю...")
-                os.remove(lock_file)
-        except Exception:
-            logger.warning("⚠️ Не удалось прочитать bot.lock, удаляю и продолжаю...")
-            os.remove(lock_file)
-
-    with open(lock_file, 'w') as f:
-        f.write(str(os.getpid()))
-
     logger.info("=" * 60)
-    logger.info("🚀 БЛОКИРОВКИ + AI (простой пересказ новостей)")
+    logger.info(f"🚀 БЛОКИРОВКИ + AI (простой пересказ новостей), режим: {mode}")
+    logger.info(f"🪪 Runner: {config.runner_id}")
     logger.info("=" * 60)
 
-    posted = None
+    channels: List[AsyncPostedManager] = []
+    coordinator = AsyncRunCoordinator(RunCoordinator(config.db_file, config.runner_id))
+    scheduler = AsyncFeedScheduler(FeedScheduler(config.db_file))
+    heartbeat_task = asyncio.create_task(keep_leases_alive(coordinator, shutdown_event))
 
     try:
-        init_clients()
-
-        if not await check_telegram_connection():
-            logger.error("❌ Не удалось подключиться к Telegram. Проверьте токен и сеть.")
+        tiers = source_tiers(get_rss_feeds())
+        if mode == "fetch":
+            for tier, tier_feeds in enumerate(tiers, 1):
+                await obtain_articles(coordinator, scheduler, shutdown_event, tier_feeds, tier)
             return
 
-        posted = PostedManager(config.db_file)
+        config.require_secrets()
+        init_clients()
 
-        if posted.verify_db():
-            logger.info("✅ БД OK")
-        else:
-            logger.error("❌ Проблема с БД!")
+        if mode != "prepare" and not await check_telegram_connection():
+            logger.error("❌ Не удалось подключиться к Telegram. Проверьте токен и сеть.")
             return
 
-        posted.cleanup(config.retention_days)
+        for profile in load_channel_profiles():
+            posted = AsyncPostedManager(PostedManager(profile.db_file, profile))
+            channels.append(posted)
 
-        stats = posted.get_stats()
-        logger.info(f"📊 Статистика: {stats['total_posted']} posted, {stats['total_rejected']} в чёрном списке")
+            if await posted.verify_db():
+                logger.info(f"✅ БД OK [{profile.name}]")
+            else:
+                logger.error(f"❌ Проблема с БД [{profile.name}]!")
+                return
+            scans = await posted.full_scans()
+            if scans:
+                logger.warning(f"🐢 [{profile.name}] Горячие запросы без индекса: {scans}")
 
-        recent = posted.get_recent_posts(config.rotation_history_size)
-        if recent:
-            logger.info(f"📋 Последние {len(recent)} постов:")
-            for p in recent:
-                logger.info(f"   • [{p['topic']}][{p.get('source', '?')}] {p['title'][:50]}...")
+            await posted.cleanup(config.retention_days)
 
-        if shutdown_event.is_set():
-            logger.info("🛑 Прерывание перед загрузкой RSS")
-            return
+            stats = await posted.get_stats()
+            logger.info(
+                f"📊 Статистика [{profile.name}]: {stats['total_posted']} posted, "
+                f"{stats['total_rejected']} в чёрном списке, фильтр Блума {stats['bloom']}"
+            )
 
-        raw = await load_all_feeds()
+            recent = await posted.get_recent_posts(profile.rule("rotation_history_size"))
+            if recent:
+                logger.info(f"📋 Последние {len(recent)} постов [{profile.name}]:")
+                for p in recent:
+                    logger.info(f"   • [{p['topic']}][{p.get('source', '?')}] {p['title'][:50]}...")
+
+        publishers: List[AsyncPostedManager] = []
+        if mode != "prepare":
+            for posted in channels:
+                lease = f"publish:{posted.profile.channel_id}"
+                if await coordinator.acquire(lease, config.lease_ttl_seconds):
+                    publishers.append(posted)
+                else:
+                    holder = await coordinator.get_holder(lease)
+                    logger.warning(
+                        f"⏭️ [{posted.profile.name}] Публикует другой запуск "
+                        f"({holder[0] if holder else '?'})"
+                    )
 
-        sources_count: Dict[str, int] = {}
-        for art in raw:
-            sources_count[art.source] = sources_count.get(art.source, 0) + 1
-        logger.info(f"📰 Источники: {sources_count}")
+        # Сначала досылаем outbox прошлых запусков, затем готовые посты из очереди
+        delivered = await flush_outbox(publishers) if publishers else set()
 
-        working = sum(1 for v in sources_count.values() if v > 0)
-        logger.info(f"📡 Работающих источников: {working}/{len(RSS_FEEDS)}")
+        pending: List[AsyncPostedManager] = []
+        for posted in channels if mode == "prepare" else publishers:
+            if mode != "prepare":
+                if shutdown_event.is_set():
+                    break
+                if posted.profile.channel_id in delivered:
+                    logger.info(f"📮 [{posted.profile.name}] Слот занят постом из outbox")
+                    continue
+                if await send_from_queue(posted, shutdown_event):
+                    continue
+                if mode == "send" or not config.queue_fallback_full_run:
+                    continue
+            pending.append(posted)
 
-        if shutdown_event.is_set():
-            logger.info("🛑 Прерывание перед фильтрацией")
+        if not pending:
             return
 
-        candidates = filter_and_dedupe(raw, posted)
-
-        if not candidates:
-            logger.info("📭 Нет подходящих новостей. Завершаем работу.")
+        if shutdown_event.is_set():
+            logger.info("🛑 Прерывание перед загрузкой RSS")
             return
 
-        candidates = rotate_candidates(candidates, posted)
-
-        logger.info("🎯 Топ-10 кандидатов после ротации:")
-        for i, c in enumerate(candidates[:10]):
-            topic_t = Topic.detect(f"{c.title} {c.summary}")
-            logger.info(f"  {i+1}. [{topic_t}] [{c.source}] {c.title[:55]}")
-
-        published = False
-        for article in candidates[:25]:
-            if shutdown_event.is_set():
-                logger.info("🛑 Прерывание в цикле публикации")
+        # Фильтры каналов получают статьи потоком, по мере загрузки лент
+        accepted: Set[str] = set()
+        ranker = CandidateRanker(config.db_file)
+        if config.learned_ranking and ranker.fit():
+            logger.info("📈 Кандидаты ранжируются по истории исходов генерации")
+        filters = [CandidateFilter(posted, accepted, ranker) for posted in pending]
+
+        # Нижние уровни лент качаются только для каналов, которым не хватило верхних
+        polled_sources: Set[str] = set()
+        raw: List[Article] = []
+        for tier, tier_feeds in enumerate(tiers, 1):
+            # Каналы сверяются с историей параллельно, каждый в своём пуле БД
+            await asyncio.gather(*(candidate_filter.process() for candidate_filter in filters))
+            hungry = [f for f in filters if not f.candidates]
+            if not hungry:
+                skipped = [feed for lower in tiers[tier - 1:] for feed in lower]
+                requests, parse_time = await scheduler.estimate_cost(skipped)
+                logger.info(
+                    f"💤 Уровни {tier}+ не нужны: сэкономлено {requests} запросов, "
+                    f"~{parse_time:.2f}s парсинга"
+                )
                 break
+            if tier > 1:
+                logger.info(f"🔄 Уровень {tier}: {len(tier_feeds)} лент для {len(hungry)} каналов без кандидатов")
 
-            dup_result = posted.is_duplicate(article.link, article.title, article.summary)
-            if dup_result.is_duplicate:
-                posted.log_rejected(article, f"FINAL_DUP: {'; '.join(dup_result.reasons[:2])}")
-                continue
+            def on_batch(articles: List[Article], hungry=hungry):
+                for candidate_filter in hungry:
+                    candidate_filter.add(articles)
 
-            summary = await generate_summary(article)
-            if not summary:
-                posted.log_rejected(article, "GENERATION_FAILED")
-                continue
+            tier_raw = await obtain_articles(
+                coordinator, scheduler, shutdown_event, tier_feeds, tier, polled_sources, on_batch
+            )
+            if tier_raw is None:
+                return
+            raw.extend(tier_raw)
 
-            posted_ok = await post_article(article, summary, posted)
-            if posted_ok:
-                logger.info("🏁 Готово!")
-                published = True
-                break
+        # Тексты постов общие для всех каналов: одна статья — один вызов LLM
+        generated: Dict[str, Optional[GeneratedPost]] = {}
+        for posted, candidate_filter in zip(pending, filters):
+            if shutdown_event.is_set():
+                logger.info("🛑 Прерывание перед публикацией")
+                return
+            candidates = await candidate_filter.finalize()
+            if mode == "prepare":
+                await prepare_for_channel(candidates, posted, coordinator, generated, shutdown_event, ranker)
             else:
-                posted.log_rejected(article, "POST_VALIDATION_OR_SEND_FAILED")
-
-            await asyncio.sleep(2)
+                await publish_for_channel(candidates, posted, coordinator, generated, shutdown_event, ranker)
 
-        if not published:
-            logger.info("😔 Не удалось опубликовать ни одну статью.")
+        if polled_sources:
+            await scheduler.record_acceptance(raw, polled_sources, accepted)
 
     except asyncio.CancelledError:
         logger.info("🛑 Операция отменена")
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
     finally:
-        if posted:
+        heartbeat_task.cancel()
+        if feed_archive is not None:
+            feed_archive.finish()
+        logger.info(f"🔤 Кэш нормализации текста: {text_normalizer.stats()}")
+        logger.info(f"🧾 Журнал решений: {decisions.summary()}")
+        if llm_usage.models:
+            logger.info(f"🧮 LLM по моделям: {llm_usage.summary()}")
+            per_post = llm_usage.per_post()
+            if per_post:
+                logger.info(f"🧮 На пост: ~{per_post[0]:.0f} токенов, {per_post[1]:.1f}s LLM")
+        await coordinator.release_all()
+        coordinator.close()
+        scheduler.close()
+        for posted in channels:
             posted.close()
         if bot:
             try:
@@ -1551,14 +4870,159 @@ async def main():
                 logger.info("🔒 Telegram сессия закрыта")
             except Exception as e:
                 logger.error(f"❌ Ошибка закрытия Telegram: {e}")
-        if os.path.exists(lock_file):
-            os.remove(lock_file)
         logger.info("👋 Завершение работы")
 
 
+def check_query_plans() -> bool:
+    # Сначала схема, которую строит _init_db на пустой БД (проверка в CI), затем БД каналов:
+    # у них индексы могли разойтись со схемой после миграций
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="check-db-") as workdir:
+        targets = [ChannelProfile(name="fresh", channel_id="", db_file=os.path.join(workdir, "fresh.db"))]
+        targets += [p for p in load_channel_profiles() if os.path.exists(p.db_file)]
+        for profile in targets:
+            db = PostedManager(profile.db_file, profile)
+            try:
+                scans = db.full_scans()
+            finally:
+                db.close()
+            if scans:
+                ok = False
+                logger.error(f"🐢 [{profile.name}] Горячие запросы без индекса: {scans}")
+            else:
+                logger.info(f"✅ [{profile.name}] Горячие запросы идут по индексам")
+    return ok
+
+
+def search_history(query: str, by: str = "", days: int = 0, limit: int = 20) -> bool:
+    # Результаты — в stdout, а не в лог бота
+    if not query and not by:
+        logger.error("❌ Нужен --query и/или --by")
+        return False
+    for profile in load_channel_profiles():
+        db = PostedManager(profile.db_file, profile)
+        try:
+            if by:
+                rows = db.aggregate(by, query, days, limit)
+                print(f"📊 [{profile.name}] По {by}" + (f" для «{query}»" if query else "") + f": {len(rows)}")
+                for row in rows:
+                    print(f"  {row['posts']:>6}  {row['key']}  ({row['first'][:10]} … {row['last'][:10]})")
+            else:
+                rows = db.search(query, days, limit)
+                print(f"🔎 [{profile.name}] «{query}»: {len(rows)} результатов")
+                for row in rows:
+                    print(f"  {row['posted_date'][:16]} | {row['source']} | {row['topic']} | {row['title']}")
+                    print(f"      {row['snippet']}")
+                    print(f"      {row['url']}")
+        finally:
+            db.close()
+    return True
+
+
+async def replay_archive(run_ids: Optional[List[str]], since: Optional[datetime],
+                         snapshot: str, report_path: str = "") -> bool:
+    # Записанные запуски прогоняются через filter_and_dedupe против копии снимка БД:
+    # снимок не меняется, и все запуски видят одну и ту же историю
+    if not config.feed_archive_dir:
+        logger.error("❌ Не задан FEED_ARCHIVE_DIR")
+        return False
+    archive = FeedArchive(config.feed_archive_dir)
+    runs = archive.load_runs(run_ids, since)
+    if not runs:
+        logger.error(f"❌ В архиве {config.feed_archive_dir} нет подходящих запусков")
+        return False
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    db_copy = os.path.join(workdir, "replay.db")
+    source_db, copy_db = sqlite3.connect(snapshot), sqlite3.connect(db_copy)
+    source_db.backup(copy_db)
+    source_db.close()
+    copy_db.close()
+    profile = ChannelProfile(name="replay", channel_id=config.channel_id or "", db_file=db_copy)
+    posted = AsyncPostedManager(PostedManager(db_copy, profile))
+
+    report = []
+    try:
+        for run in runs:
+            decisions.reset()
+            shift = datetime.now(timezone.utc) - datetime.fromisoformat(run['started'])
+            parse_started = time.perf_counter()
+            articles: List[Article] = []
+            for fetch in run['fetches']:
+                if fetch['body']:
+                    articles.extend(parse_feed_articles(
+                        archive.get(fetch['body']), fetch['content_type'], fetch['source'], shift
+                    ))
+            parse_time = time.perf_counter() - parse_started
+            filter_started = time.perf_counter()
+            candidates = await filter_and_dedupe(articles, posted)
+            filter_time = time.perf_counter() - filter_started
+            entry = {
+                'run': run['run_id'], 'feeds': len(run['fetches']), 'articles': len(articles),
+                'parse_s': round(parse_time, 3), 'filter_s': round(filter_time, 3),
+                'articles_per_s': round(len(articles) / max(parse_time + filter_time, 1e-9)),
+                'decisions': dict(decisions.counts.most_common()),
+                'candidates': [c.link for c in candidates],
+            }
+            report.append(entry)
+            logger.info(
+                f"🔁 {entry['run']}: {entry['articles']} статей из {entry['feeds']} лент, "
+                f"разбор {parse_time:.2f}s, фильтр {filter_time:.2f}s, {entry['articles_per_s']}/s, "
+                f"кандидатов {len(candidates)} | {entry['decisions']}"
+            )
+    finally:
+        posted.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total_articles = sum(e['articles'] for e in report)
+    total_time = sum(e['parse_s'] + e['filter_s'] for e in report)
+    logger.info(
+        f"🔁 Повтор: {len(report)} запусков, {total_articles} статей за {total_time:.2f}s "
+        f"({total_articles / max(total_time, 1e-9):.0f}/s)"
+    )
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({'snapshot': snapshot, 'runs': report}, f, ensure_ascii=False, indent=2)
+    return True
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Блокировки + AI: постинг новостей в Telegram")
+    parser.add_argument(
+        "mode", nargs="?", default="run",
+        choices=["run", "fetch", "prepare", "send", "rank-eval", "check-db", "replay", "search"],
+        help="run — очередь, иначе полный цикл; fetch — только скачать RSS в общий пул; "
+             "prepare — только наполнить очередь; send — только отправить из очереди; "
+             "rank-eval — офлайн-оценка ранжирования по истории исходов генерации; "
+             "check-db — планы горячих запросов (код 1, если есть проход без индекса); "
+             "replay — прогнать записанные ленты (FEED_ARCHIVE_DIR) через фильтры; "
+             "search — полнотекстовый поиск и агрегаты по истории постов"
+    )
+    parser.add_argument("--run", action="append", dest="runs", help="replay: id запуска из архива (можно несколько)")
+    parser.add_argument("--since-hours", type=float, help="replay: все запуски за последние N часов")
+    parser.add_argument("--snapshot", default=config.db_file, help="replay: снимок БД истории")
+    parser.add_argument("--report", default="", help="replay: JSON-отчёт для сравнения вердиктов")
+    parser.add_argument("--query", "-q", default="", help="search: запрос FTS5 (слова, \"фраза\", префикс*, OR, NOT)")
+    parser.add_argument("--by", choices=PostedManager.AGGREGATE_KEYS, help="search: агрегат по источникам/топикам/сюжетам")
+    parser.add_argument("--days", type=int, default=0, help="search: только последние N дней")
+    parser.add_argument("--limit", type=int, default=20, help="search: число строк")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.mode == "rank-eval":
+            logger.info(f"📈 Оценка ранжирования: {CandidateRanker(config.db_file).evaluate()}")
+            sys.exit(0)
+        if args.mode == "check-db":
+            sys.exit(0 if check_query_plans() else 1)
+        if args.mode == "replay":
+            since = (datetime.now(timezone.utc) - timedelta(hours=args.since_hours)) if args.since_hours else None
+            sys.exit(0 if asyncio.run(replay_archive(args.runs, since, args.snapshot, args.report)) else 1)
+        if args.mode == "search":
+            sys.exit(0 if search_history(args.query, args.by or "", args.days, args.limit) else 1)
+        asyncio.run(main(args.mode))
     except KeyboardInterrupt:
         logger.info("🛑 Прервано пользователем")
     except Exception as e:
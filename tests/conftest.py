@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# Модуль при импорте открывает логи в текущей папке — уводим их во временную
+os.chdir(tempfile.mkdtemp(prefix="telegrambot-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegrambot  # noqa: E402
+
+
+@pytest.fixture
+def posted(tmp_path):
+    profile = telegrambot.ChannelProfile(name="test", channel_id="@test", db_file=str(tmp_path / "posted.db"))
+    db = telegrambot.PostedManager(profile.db_file, profile)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def make_article():
+    def make(title: str, summary: str = "", link: str = "", source: str = "Test") -> telegrambot.Article:
+        link = link or "https://example.com/" + telegrambot.get_content_hash(title)[:12]
+        return telegrambot.Article(title=title, summary=summary, link=link, source=source,
+                                   published=datetime.now())
+    return make
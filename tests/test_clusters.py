@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from telegrambot import StoryClusters, config
+
+GPT = "OpenAI releases GPT-5 with a million-token context window"
+GPT_SUMMARY = "OpenAI released GPT-5 to developers. The model supports a million-token context window."
+
+
+@pytest.fixture
+def clusters():
+    return StoryClusters(np.ones(config.content_vector_dim, dtype=np.float32))
+
+
+def batch(make_article):
+    return [
+        make_article(GPT, GPT_SUMMARY, source="The Verge"),
+        make_article("Nvidia ships the RTX 6090 graphics card", "The card doubles ray tracing throughput."),
+        make_article(GPT, GPT_SUMMARY, link="https://mirror.example.com/gpt-5", source="3DNews Software"),
+        make_article("Apple opens its on-device model to third-party apps", "Developers get a new framework."),
+    ]
+
+
+def test_same_story_is_one_cluster(clusters, make_article):
+    articles = batch(make_article)
+    new, grown = clusters.add(articles)
+    assert new == [0, 1, 2]
+    assert grown == {}
+    assert [len(members) for members in clusters.members] == [2, 1, 1]
+    # Лучшая статья сюжета — из приоритетного источника
+    assert clusters.best(0).source == "3DNews Software"
+
+
+def test_incremental_batches_match_single_batch(make_article):
+    idf = np.ones(config.content_vector_dim, dtype=np.float32)
+    articles = batch(make_article)
+    whole = StoryClusters(idf)
+    whole.add(articles)
+    split = StoryClusters(idf)
+    for article in articles:
+        split.add([article])
+    assert ([sorted(a.link for a in m) for m in split.members]
+            == [sorted(a.link for a in m) for m in whole.members])
+
+
+def test_late_copy_grows_known_story(clusters, make_article):
+    articles = batch(make_article)
+    clusters.add(articles[:2])
+    new, grown = clusters.add(articles[2:])
+    assert new == [2]
+    assert list(grown) == [0]
+    assert grown[0][0].link == "https://mirror.example.com/gpt-5"
+
+
+def test_known_stories_are_not_merged(clusters, make_article):
+    long_summary = (
+        "Samsung started shipping the Galaxy S30 in Korea and Europe. The phone uses a new "
+        "Exynos chip, a larger battery and a titanium frame, and the base model keeps last "
+        "year's price. Preorders opened two weeks ago and deliveries begin on Friday."
+    )
+    first = make_article("Google updates the Gemini app", "Gemini answers faster and supports more languages.")
+    second = make_article("Samsung ships Galaxy S30", long_summary)
+    clusters.add([first])
+    clusters.add([second])
+    # Заголовок первого сюжета и текст второго: статья похожа на оба, но известные
+    # сюжеты между собой не склеиваются
+    bridge = make_article(first.title, long_summary, link="https://bridge.example.com/a")
+    new, grown = clusters.add([bridge])
+    assert new == []
+    assert len(grown) == 1
+    assert len(clusters.members) == 2
+    assert [len(members) for members in clusters.members] in ([2, 1], [1, 2])
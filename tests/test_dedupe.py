@@ -0,0 +1,83 @@
+from telegrambot import BloomFilter, config, normalize_url
+
+SUMMARY = (
+    "OpenAI released GPT-5 to developers on Tuesday. The model scores higher on coding "
+    "and math benchmarks, supports a million-token context window and costs less per token "
+    "than GPT-4o. Enterprise customers get access first, with a wider rollout next month."
+)
+
+
+def add_posted(posted, make_article):
+    article = make_article("OpenAI releases GPT-5 with a million-token context", SUMMARY,
+                           link="https://news.example.com/openai-gpt-5")
+    assert posted.add(article, "ai", "openai")
+    return article
+
+
+def check(posted, url, title, summary=""):
+    return posted.check_duplicates([(url, title, summary)])[0]
+
+
+def test_unrelated_article_passes(posted, make_article):
+    add_posted(posted, make_article)
+    result = check(posted, "https://other.example.com/rtx", "Nvidia ships the RTX 6090 graphics card",
+                   "The new card doubles ray tracing throughput and draws 600 watts under load.")
+    assert not result.is_duplicate, result.reasons
+
+
+def test_exact_url_after_normalization(posted, make_article):
+    article = add_posted(posted, make_article)
+    result = check(posted, article.link + "?utm_source=rss", "Completely different headline")
+    assert result.reasons[:1] == ["URL_EXACT"]
+
+
+def test_exact_title_and_content_hash(posted, make_article):
+    article = add_posted(posted, make_article)
+    assert check(posted, "https://mirror.example.com/a", article.title).reasons[:1] == ["TITLE_EXACT"]
+    result = check(posted, "https://mirror.example.com/b", article.title.upper(), "  " + SUMMARY)
+    assert result.reasons[:1] == ["CONTENT_HASH"]
+
+
+def test_bloom_false_positive_is_confirmed_by_query(posted, make_article):
+    add_posted(posted, make_article)
+    url = "https://fresh.example.com/unseen-story"
+    with posted._lock:
+        posted._bloom.add(normalize_url(url))
+    result = check(posted, url, "Apple opens its on-device model to third-party apps",
+                   "Developers can call the local model through a new framework in iOS.")
+    assert not result.is_duplicate, result.reasons
+
+
+def test_posted_keys_outlive_cleanup(posted, make_article):
+    article = add_posted(posted, make_article)
+    conn = posted._get_conn()
+    conn.execute("UPDATE posted_articles SET posted_date = datetime('now', ?)",
+                 (f"-{config.retention_days + 10} days",))
+    conn.commit()
+    posted.cleanup(days=config.retention_days)
+    assert conn.execute("SELECT COUNT(*) FROM posted_articles").fetchone()[0] == 0
+    assert check(posted, article.link, "Some new title").reasons[:1] == ["URL_SEEN"]
+    assert check(posted, "https://x.example.com/c", article.title, SUMMARY).reasons[:1] == ["CONTENT_SEEN"]
+
+
+def test_simhash_bands_find_near_copy(posted, make_article):
+    add_posted(posted, make_article)
+    # Другой URL и заголовок на слово длиннее: точных совпадений нет, отпечаток — в пределах полос
+    title = "OpenAI releases GPT-5 with a million-token context window"
+    result = check(posted, "https://copy.example.com/gpt5", title, SUMMARY)
+    assert result.is_duplicate
+    assert any(reason.startswith("SIMHASH") for reason in result.reasons), result.reasons
+
+
+def test_bloom_merge_keeps_keys_and_estimates_count():
+    left = BloomFilter(64 * 1024, 0.01)
+    right = BloomFilter(64 * 1024, 0.01)
+    for i in range(3000):
+        left.add(f"left-{i}")
+        right.add(f"right-{i}")
+    for i in range(1000):
+        left.add(f"both-{i}")
+        right.add(f"both-{i}")
+    left.merge(bytes(right.bits))
+    assert all(f"{side}-{i}" in left for side in ("left", "right") for i in range(3000))
+    assert abs(left.items - 7000) < 7000 * 0.05
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import telegrambot
+from telegrambot import AsyncPostedManager, TelegramDelivery, config
+
+
+def status(posted, item_id):
+    row = posted._get_conn().execute(
+        "SELECT status, attempts, last_error FROM outbox WHERE id = ?", (item_id,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+class FakeDelivery(TelegramDelivery):
+    # Вместо Bot API — заранее заданный исход отправки
+    def __init__(self, outcome=TelegramDelivery.SENT, error=""):
+        super().__init__()
+        self.outcome = outcome
+        self.error = error
+        self.sent = []
+
+    async def send(self, chat_id, text):
+        self.sent.append(text)
+        return self.outcome, self.error, 60.0
+
+
+@pytest.fixture
+def article(make_article):
+    return make_article("Nvidia ships the RTX 6090 graphics card",
+                        "The card doubles ray tracing throughput and draws 600 watts under load.")
+
+
+def deliver(posted, item_id, article, delivery):
+    item = {'id': item_id, 'article': article, 'text': "post", 'topic': "hardware"}
+    return asyncio.run(delivery.deliver(AsyncPostedManager(posted), item))
+
+
+def test_sent_post_is_recorded_and_removed(posted, article):
+    item_id = posted.outbox_add(article, "post", "hardware")
+    assert [item['id'] for item in posted.get_outbox()] == [item_id]
+    assert deliver(posted, item_id, article, FakeDelivery()) == TelegramDelivery.SENT
+    assert status(posted, item_id) is None
+    assert posted.is_duplicate(article.link, article.title).reasons[:1] == ["URL_EXACT"]
+
+
+def test_deferred_post_waits_for_next_attempt(posted, article):
+    item_id = posted.outbox_add(article, "post", "hardware")
+    outcome = deliver(posted, item_id, article, FakeDelivery(TelegramDelivery.DEFERRED, "RetryAfter 60s"))
+    assert outcome == TelegramDelivery.DEFERRED
+    assert status(posted, item_id) == ("pending", 1, "RetryAfter 60s")
+    assert posted.get_outbox(due_only=True) == []
+    assert [item['id'] for item in posted.get_outbox(due_only=False)] == [item_id]
+
+
+def test_failed_post_is_not_retried(posted, article):
+    item_id = posted.outbox_add(article, "post", "hardware")
+    deliver(posted, item_id, article, FakeDelivery(TelegramDelivery.FAILED, "chat not found"))
+    assert status(posted, item_id)[0] == "failed"
+    assert posted.get_outbox(due_only=False) == []
+
+
+def test_claimed_post_is_not_claimed_twice(posted, article):
+    item_id = posted.outbox_add(article, "post", "hardware")
+    assert posted.outbox_claim(item_id)
+    assert not posted.outbox_claim(item_id)
+    assert posted.get_outbox(due_only=False) == []
+
+
+def test_interrupted_send_is_reconciled(posted, article, make_article):
+    recorded = posted.outbox_add(article, "post", "hardware")
+    unknown_article = make_article("Apple opens its on-device model", "Developers get a new framework.")
+    unknown = posted.outbox_add(unknown_article, "post", "ai")
+    posted.outbox_claim(recorded)
+    posted.outbox_claim(unknown)
+    posted.add(article, "hardware", "hardware")
+    assert posted.outbox_reconcile() == (1, 1)
+    assert status(posted, recorded) is None
+    assert status(posted, unknown)[0::2] == ("failed", "SEND_UNCONFIRMED")
+
+
+def test_expired_posts_are_failed(posted, article, make_article):
+    retried = posted.outbox_add(article, "post", "hardware")
+    old = posted.outbox_add(make_article("Old story", "Nothing new here at all."), "post", "ai")
+    fresh = posted.outbox_add(make_article("Fresh story", "Something new happened."), "post", "ai")
+    conn = posted._get_conn()
+    conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (config.outbox_max_attempts, retried))
+    conn.execute("UPDATE outbox SET created_at = datetime('now', ?) WHERE id = ?",
+                 (f"-{config.outbox_max_age_hours + 1} hours", old))
+    conn.commit()
+    assert posted.outbox_expire() == 2
+    assert status(posted, retried)[0] == status(posted, old)[0] == "failed"
+    assert status(posted, fresh)[0] == "pending"
+
+
+def test_flush_skips_story_published_meanwhile(posted, article, monkeypatch):
+    item_id = posted.outbox_add(article, "post", "hardware")
+    posted.add(article, "hardware", "hardware")
+    delivery = FakeDelivery()
+    monkeypatch.setattr(telegrambot, "delivery", delivery)
+    assert asyncio.run(telegrambot.flush_outbox([AsyncPostedManager(posted)])) == set()
+    assert delivery.sent == []
+    assert status(posted, item_id)[0::2] == ("failed", "FINAL_DUP: URL_EXACT")
@@ -0,0 +1,24 @@
+import re
+
+import pytest
+
+from telegrambot import PostedManager
+
+EXPECTED_INDEXES = [
+    (name, re.search(r"INDEX (\w+)", expected).group(1))
+    for name, plans in sorted(PostedManager.EXPECTED_PLANS.items())
+    for expected in plans
+]
+
+
+def test_hot_queries_use_indexes(posted):
+    # Схема, которую _init_db строит на пустой БД: ни одного SCAN и все ожидаемые индексы
+    assert posted.full_scans() == {}
+
+
+@pytest.mark.parametrize("name, index", EXPECTED_INDEXES)
+def test_missing_index_is_reported(posted, name, index):
+    conn = posted._get_conn()
+    conn.execute(f"DROP INDEX {index}")
+    conn.commit()
+    assert name in posted.full_scans()
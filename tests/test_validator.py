@@ -0,0 +1,128 @@
+import pytest
+
+from telegrambot import PostValidator, RepeatTracker, StreamGuard, calculate_similarity, config, post_validator
+
+# Пары предложений из ответов моделей: перефразированные повторы и соседние разные мысли
+SENTENCE_PAIRS = [
+    ("Компания OpenAI представила новую модель GPT-5 для разработчиков",
+     "Компания OpenAI представила новую модель GPT-5 для бизнеса"),
+    ("Nvidia объявила о выпуске ускорителя Blackwell Ultra",
+     "Nvidia объявила о выпуске нового ускорителя Blackwell Ultra для дата-центров"),
+    ("Это решение может изменить рынок облачных вычислений",
+     "Такое решение может изменить весь рынок облачных вычислений"),
+    ("Модель доступна через API и в веб-интерфейсе ChatGPT",
+     "Роскомнадзор заблокировал ещё несколько VPN-протоколов"),
+    ("Google выпустила Gemini 2.5 с увеличенным контекстным окном",
+     "Anthropic обновила Claude и снизила цены на API для стартапов"),
+    ("Аналитики ожидают роста спроса на чипы в следующем году",
+     "Аналитики ожидают снижения спроса на смартфоны в этом году"),
+    ("Meta открыла веса модели Llama для исследователей",
+     "Веса модели Llama Meta открыла для исследователей"),
+    ("Пользователи сообщают о сбоях в работе сервиса",
+     "Разработчики обещают исправить ошибки в ближайшем обновлении"),
+]
+
+
+@pytest.mark.parametrize("first, second", SENTENCE_PAIRS)
+def test_repeat_tracker_matches_sequence_matcher(first, second):
+    tracker = RepeatTracker(0.6)
+    tracker.add(first)
+    expected = 1 if calculate_similarity(second, first) > 0.6 else 0
+    assert tracker.add(second) == expected
+
+
+def test_pairs_cover_both_verdicts():
+    verdicts = {calculate_similarity(b, a) > 0.6 for a, b in SENTENCE_PAIRS}
+    assert verdicts == {True, False}
+
+
+def test_short_sentences_are_ignored():
+    tracker = RepeatTracker(0.6)
+    assert tracker.add("Коротко и ясно.") == 0
+    assert tracker.add("Коротко и ясно.") == 0
+
+
+def test_repeated_pairs_counts_every_similar_pair():
+    text = ". ".join([SENTENCE_PAIRS[0][0], SENTENCE_PAIRS[0][1], SENTENCE_PAIRS[0][0]]) + "."
+    # Три почти одинаковых предложения — три пары
+    assert post_validator.repeated_pairs(text) == 3
+
+
+VALID_POST = (
+    "Компания OpenAI открыла разработчикам доступ к модели GPT-5 через API. "
+    "Новая версия решает олимпиадные задачи по математике заметно лучше предшественницы "
+    "и держит в контексте до миллиона токенов, то есть целую кодовую базу среднего проекта. "
+    "Цена за токен ниже, чем у GPT-4o, а скорость ответа на длинных запросах выросла почти вдвое.\n\n"
+    "Первыми модель получили корпоративные клиенты и участники программы раннего доступа. "
+    "Остальным пользователям ChatGPT обновление придёт в течение месяца, "
+    "бесплатный тариф сохранит ограничение на число сообщений в день. "
+    "Для российских разработчиков API по-прежнему недоступен без зарубежной карты.\n\n"
+    "Конкуренты ответят быстро: Google готовит новую Gemini, а Anthropic обновляет Claude. "
+    "Гонка за длинный контекст превращается в гонку цен, и выигрывают от неё прежде всего "
+    "команды, которые строят продукты поверх чужих моделей."
+)
+
+
+def feed_in_chunks(guard, text, size=7):
+    for start in range(0, len(text), size):
+        verdict = guard.feed(text[start:start + size])
+        if verdict:
+            return verdict
+    return None
+
+
+def test_valid_post_passes():
+    verdict = post_validator.validate("ПОСТ: " + VALID_POST)
+    assert verdict.ok, verdict.reasons
+    assert verdict.body == VALID_POST
+
+
+@pytest.mark.parametrize("text, reason", [
+    (None, "TEXT_NONE"),
+    ("SKIP", "TEXT_SERVICE_VALUE"),
+    ("Коротко. Ясно. Мало.", "TEXT_TOO_SHORT"),
+    (VALID_POST * 3, "TEXT_TOO_LONG"),
+    (VALID_POST[0].lower() + VALID_POST[1:], "TEXT_NOT_CAPITALIZED"),
+    (VALID_POST.rstrip(".") + " и", "TEXT_ENDS_BADLY"),
+    ("Стоит отметить, что это важно. Возможно, вероятно. " + VALID_POST, "TEXT_WATER"),
+])
+def test_invalid_post_is_rejected(text, reason):
+    verdict = post_validator.validate(text)
+    assert not verdict.ok
+    assert any(r.startswith(reason) for r in verdict.reasons), verdict.reasons
+
+
+def test_service_lines_are_cleaned():
+    marked = VALID_POST.replace("через API. Новая", "через API. Суть: Новая")
+    assert marked != VALID_POST
+    verdict = post_validator.validate("ПОСТ: " + marked + "\nИсточник: example.com")
+    assert verdict.ok, verdict.reasons
+    assert verdict.body == VALID_POST
+
+
+def test_stream_guard_lets_valid_post_through():
+    guard = StreamGuard(post_validator, check_skip=True)
+    assert feed_in_chunks(guard, "ПОСТ: " + VALID_POST) is None
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("SKIP — не про ИИ.\n", "SKIP"),
+    ("компания OpenAI открыла доступ к модели.\n" + VALID_POST, "TEXT_NOT_CAPITALIZED"),
+    (SENTENCE_PAIRS[0][0] + ". " + SENTENCE_PAIRS[0][1] + ". " + SENTENCE_PAIRS[0][0] + ". " + VALID_POST,
+     "TEXT_REPEATED_SENTENCES"),
+])
+def test_stream_guard_aborts_only_failing_posts(text, reason):
+    guard = StreamGuard(post_validator, check_skip=True)
+    aborted = feed_in_chunks(guard, text)
+    assert aborted and aborted.startswith(reason)
+    # Досрочный обрыв допустим, только если полный валидатор тоже отверг бы текст
+    assert not post_validator.validate(text).ok
+
+
+def test_stream_guard_aborts_too_long_post():
+    # Повторы не считаем, чтобы сработал именно лимит длины
+    validator = PostValidator(config.min_post_length, config.max_post_length, max_repeats=10 ** 6)
+    guard = StreamGuard(validator, check_skip=True)
+    aborted = feed_in_chunks(guard, VALID_POST * 3)
+    assert aborted and aborted.startswith("TEXT_TOO_LONG")
+    assert guard.length < len(VALID_POST * 3)